@@ -0,0 +1,103 @@
+"""
+Time the column naming filters, precompiled and fused versus one re.sub or
+str.replace call per filter
+
+Usage:
+
+    python benchmarks/column_names.py
+    python benchmarks/column_names.py --layout=./data/2015\ School\ Report\ Card/RC15_layout.xlsx
+
+With a layout file, the descriptions and subgroup specifiers from the
+layout are used instead of a small set of sample strings.
+"""
+import argparse
+import re
+import time
+
+from ilreportcard.schema import ReportCardSchema2016
+from ilreportcard.schema.column_names import (FilterPipeline, RegexFilter,
+    ReplaceFilter)
+
+
+SAMPLE_STRINGS = [
+    '% TWO OR MORE RACES TEACHER - DISTRICT',
+    '% OF STUDENTS WHO MET OR EXCEEDED EXPECTATIONS IN ELA',
+    'PERCENTAGE OF STUDENTS PARTICIALLY MEETING EXPECTATIONS FOR MATH',
+    'AVERGE CLASS SIZE - SUBREGION AND STATE',
+    'STUDENTS ENROLLED IN PHYSICAL EDUCATION COMPOSITE SCORE',
+    'NOT YET MEETING CREDIT REQUIREMENTS FOR GRADE NINE',
+]
+
+
+def uncompiled(fn):
+    """Get a version of a filter that works like the original functions"""
+    if isinstance(fn, RegexFilter):
+        return lambda s: re.sub(fn.regex.pattern, fn.repl, s,
+            flags=fn.regex.flags)
+
+    if isinstance(fn, ReplaceFilter):
+        return lambda s: s.replace(fn.old, fn.new)
+
+    return fn
+
+
+def layout_strings(path):
+    import xlrd
+
+    with open(path, 'rb') as f:
+        workbook = xlrd.open_workbook(file_contents=f.read())
+
+    strings = []
+    for sheet in workbook.sheets():
+        for i in range(sheet.nrows):
+            row = sheet.row(i)
+            if len(row) > 5 and row[0].ctype == xlrd.XL_CELL_NUMBER:
+                strings.append(row[5].value.strip())
+
+    return strings
+
+
+def time_filters(fn, strings, repeat):
+    start = time.time()
+    for i in range(repeat):
+        for s in strings:
+            fn(s)
+
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--layout')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.layout:
+        strings = layout_strings(args.layout)
+    else:
+        strings = SAMPLE_STRINGS * 500
+
+    filters = ReportCardSchema2016.DESCRIPTION_FILTERS
+    legacy_filters = [uncompiled(fn) for fn in filters]
+
+    def legacy(s):
+        for fn in legacy_filters:
+            s = fn(s)
+        return s
+
+    pipeline = FilterPipeline(filters)
+
+    for s in strings:
+        assert pipeline(s) == legacy(s), s
+
+    legacy_time = time_filters(legacy, strings, args.repeat)
+    pipeline_time = time_filters(pipeline, strings, args.repeat)
+
+    print("{} strings x {} repeats".format(len(strings), args.repeat))
+    print("{:>10} {:>10.3f}s".format("legacy", legacy_time))
+    print("{:>10} {:>10.3f}s ({:.1f}x)".format("pipeline", pipeline_time,
+        legacy_time / pipeline_time))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Compare the time it takes each load engine to write the same rows
+
+Usage:
+
+    python benchmarks/load_engines.py --rows=10000 --columns=200
+    python benchmarks/load_engines.py --database=postgresql://localhost:5432/bench
+
+By default this uses an in-memory SQLite database, where the 'copy' engine
+falls back to 'executemany'.  Point it at a scratch PostgreSQL database to
+compare COPY against the INSERT based engines.
+"""
+import argparse
+import random
+import time
+
+from sqlalchemy import create_engine, MetaData
+
+from ilreportcard.load.writers import WRITERS, get_writer
+from ilreportcard.schema import Column, Table, COLUMN_TYPES
+
+
+def make_table(num_columns):
+    tabledef = Table('bench_load_engines')
+    tabledef.add_column(Column(column_index=0, name='school_id',
+        column_type=COLUMN_TYPES.STRING, primary_key=True))
+
+    column_types = [COLUMN_TYPES.INTEGER, COLUMN_TYPES.FLOAT,
+        COLUMN_TYPES.STRING]
+    for i in range(1, num_columns):
+        tabledef.add_column(Column(column_index=i, name='col_{}'.format(i),
+            column_type=column_types[i % len(column_types)]))
+
+    return tabledef
+
+
+def make_rows(tabledef, num_rows):
+    rng = random.Random(0)
+    rows = []
+    for i in range(num_rows):
+        row = ['{:015d}'.format(i)]
+        for columndef in tabledef.columns[1:]:
+            if rng.random() < 0.1:
+                row.append(None)
+            elif columndef.column_type == COLUMN_TYPES.INTEGER:
+                row.append(rng.randint(0, 5000))
+            elif columndef.column_type == COLUMN_TYPES.FLOAT:
+                row.append(round(rng.random() * 100, 1))
+            else:
+                row.append('School {}'.format(rng.randint(0, 5000)))
+        rows.append(tuple(row))
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--database', default='sqlite://')
+    parser.add_argument('--rows', type=int, default=5000)
+    parser.add_argument('--columns', type=int, default=100)
+    parser.add_argument('--engines', default=','.join(sorted(WRITERS.keys())))
+    args = parser.parse_args()
+
+    engine = create_engine(args.database)
+    tabledef = make_table(args.columns)
+    rows = make_rows(tabledef, args.rows)
+
+    print("{:>12} {:>12} {:>10} {:>12}".format("engine", "writer", "seconds",
+        "rows/sec"))
+
+    for name in args.engines.split(','):
+        table = tabledef.as_sqlalchemy(MetaData())
+        table.drop(engine, checkfirst=True)
+        table.create(engine)
+
+        try:
+            with engine.connect() as connection:
+                writer = get_writer(name, connection)
+                start = time.time()
+                writer.write(connection, table, rows)
+                elapsed = time.time() - start
+
+            print("{:>12} {:>12} {:>10.3f} {:>12.0f}".format(name,
+                writer.name, elapsed, len(rows) / elapsed))
+        finally:
+            table.drop(engine)
+
+
+if __name__ == '__main__':
+    main()
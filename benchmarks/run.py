@@ -0,0 +1,217 @@
+"""
+Benchmark schema parsing, row conversion and loading on synthetic data
+
+Usage:
+
+    python benchmarks/run.py
+    python benchmarks/run.py --scale=10 --year=2016 --json=bench.json
+    python benchmarks/run.py --postgres=postgresql://localhost:5432/scratch
+
+Synthetic layouts and data files are generated with benchmarks/synthetic.py
+unless --data points at a directory generated earlier.  Each benchmark runs
+in its own process so that the reported peak RSS is for that benchmark
+alone.  Loads into PostgreSQL only run when a scratch database is given
+with --postgres.  The benchmark tables are dropped afterwards.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, MetaData
+
+from ilreportcard.load import get_assessment_loader, get_report_card_loader
+from ilreportcard.schema import get_assessment_schema, get_report_card_schema
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic
+
+
+SCHEMAS = {
+    'report_card': get_report_card_schema,
+    'assessment': get_assessment_schema,
+}
+
+LOADERS = {
+    'report_card': get_report_card_loader,
+    'assessment': get_assessment_loader,
+}
+
+
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        # Bytes on macOS, kilobytes elsewhere
+        return maxrss / (1024.0 * 1024.0)
+
+    return maxrss / 1024.0
+
+
+def count_lines(path):
+    with open(path, 'rb') as f:
+        return sum(1 for line in f)
+
+
+def parse_schema(kind, year, paths):
+    schema = SCHEMAS[kind](year)
+    with open(paths[kind + '_layout'], 'rb') as f:
+        schema.from_file(f)
+
+    return schema
+
+
+def bench_schema(kind, year, paths, options):
+    start = time.time()
+    schema = parse_schema(kind, year, paths)
+    elapsed = time.time() - start
+    return elapsed, sum(len(t.columns) for t in schema.tables)
+
+
+def bench_convert(kind, year, paths, options):
+    schema = parse_schema(kind, year, paths)
+    loader = LOADERS[kind](year, batch_size=options['batch_size'],
+        workers=options['workers'])
+    loader.set_schema(schema)
+
+    start = time.time()
+    num_rows = 0
+    with open(paths[kind + '_data'], 'r') as f:
+        for batch in loader.iter_batches(f):
+            num_rows += len(batch[0])
+
+    return time.time() - start, num_rows
+
+
+def bench_load(kind, year, paths, options, database):
+    schema = parse_schema(kind, year, paths)
+    engine = create_engine(database)
+    metadata = MetaData()
+    tables = [t.as_sqlalchemy(metadata) for t in schema.tables]
+    for table in tables:
+        table.drop(engine, checkfirst=True)
+        table.create(engine)
+
+    loader = LOADERS[kind](year, batch_size=options['batch_size'],
+        workers=options['workers'], engine=options['engine'])
+    loader.set_schema(schema)
+
+    try:
+        start = time.time()
+        with open(paths[kind + '_data'], 'r') as f:
+            with engine.connect() as connection:
+                loader.load(f, MetaData(), connection)
+        elapsed = time.time() - start
+    finally:
+        for table in tables:
+            table.drop(engine, checkfirst=True)
+
+    return elapsed, count_lines(paths[kind + '_data'])
+
+
+def run_benchmark(queue, fn, args):
+    elapsed, count = fn(*args)
+    queue.put((elapsed, count, peak_rss_mb()))
+
+
+def run_in_process(fn, *args):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target=run_benchmark,
+        args=(queue, fn, args))
+    process.start()
+    # The result is small enough that the child can exit before it's read
+    process.join()
+    if process.exitcode != 0:
+        raise RuntimeError("{} failed".format(fn.__name__))
+
+    return queue.get()
+
+
+def get_benchmarks(year, paths, options, tmpdir, postgres=None):
+    benchmarks = []
+    for kind in ('report_card', 'assessment'):
+        benchmarks.append(('schema_' + kind, 'columns', bench_schema,
+            (kind, year, paths, options)))
+        benchmarks.append(('convert_' + kind, 'rows', bench_convert,
+            (kind, year, paths, options)))
+
+        sqlite = 'sqlite:///' + os.path.join(tmpdir, kind + '.db')
+        benchmarks.append(('load_sqlite_' + kind, 'rows', bench_load,
+            (kind, year, paths, options, sqlite)))
+
+        if postgres:
+            benchmarks.append(('load_postgres_' + kind, 'rows', bench_load,
+                (kind, year, paths, options, postgres)))
+
+    return benchmarks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--data', help="Directory of previously generated "
+        "synthetic files")
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--year', type=int, default=2015)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--engine', default='copy')
+    parser.add_argument('--postgres', help="URL of a scratch PostgreSQL "
+        "database")
+    parser.add_argument('--only', help="Only run benchmarks whose names "
+        "contain this string")
+    parser.add_argument('--json', help="Write results to this file")
+    args = parser.parse_args()
+
+    options = {
+        'batch_size': args.batch_size,
+        'workers': args.workers,
+        'engine': args.engine,
+    }
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        if args.data:
+            paths = synthetic.get_paths(args.data, args.year)
+        else:
+            paths = synthetic.generate(tmpdir, scale=args.scale,
+                year=args.year)
+
+        results = []
+        print("{:<28} {:>10} {:>14} {:>14}".format("benchmark", "seconds",
+            "units/sec", "peak RSS (MB)"))
+
+        for name, unit, fn, fn_args in get_benchmarks(args.year, paths,
+                options, tmpdir, args.postgres):
+            if args.only and args.only not in name:
+                continue
+
+            elapsed, count, rss = run_in_process(fn, *fn_args)
+            rate = count / elapsed if elapsed else 0
+            results.append({
+                'name': name,
+                'seconds': elapsed,
+                unit: count,
+                unit + '_per_second': rate,
+                'peak_rss_mb': rss,
+            })
+            print("{:<28} {:>10.3f} {:>9.0f} {:<4} {:>14.1f}".format(name,
+                elapsed, rate, unit, rss))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                'scale': args.scale,
+                'year': args.year,
+                'options': options,
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
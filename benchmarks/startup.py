@@ -0,0 +1,86 @@
+"""
+Measure how long it takes to start the command line tasks
+
+Usage:
+
+    python benchmarks/startup.py --runs=20
+    python benchmarks/startup.py --command='invoke --list'
+
+Each command runs in a new Python process, so nothing is already imported.
+Besides the import time of ilreportcard.tasks, this reports which of the
+slow to import dependencies were imported along the way.  None of them
+should be until a task that needs them runs.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+# Dependencies that tasks import only when they need them
+HEAVY_MODULES = ['sqlalchemy', 'xlrd', 'psycopg2', 'ilreportcard.schema',
+    'ilreportcard.load', 'ilreportcard.query', 'ilreportcard.export']
+
+IMPORT_SCRIPT = """
+import sys
+import time
+start = time.time()
+import ilreportcard.tasks
+elapsed = time.time() - start
+print(elapsed)
+print(','.join(m for m in {!r} if m in sys.modules))
+""".format(HEAVY_MODULES)
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def time_import(cwd):
+    output = subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT],
+        cwd=cwd, universal_newlines=True)
+    elapsed, imported = output.splitlines()[-2:]
+    return float(elapsed), [m for m in imported.split(',') if m]
+
+
+def time_command(command, cwd):
+    start = time.time()
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(command, shell=True, cwd=cwd, stdout=devnull)
+
+    return time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--command', default=None,
+        help="Also time a shell command, like 'invoke --list'")
+    args = parser.parse_args()
+
+    cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    times = []
+    for i in range(args.runs):
+        elapsed, imported = time_import(cwd)
+        times.append(elapsed)
+
+    print("{:>24} {:>10} {:>10}".format("", "median ms", "min ms"))
+    print("{:>24} {:>10.1f} {:>10.1f}".format("import ilreportcard.tasks",
+        median(times) * 1000, min(times) * 1000))
+
+    if args.command:
+        times = [time_command(args.command, cwd) for i in range(args.runs)]
+        print("{:>24} {:>10.1f} {:>10.1f}".format(args.command[:24],
+            median(times) * 1000, min(times) * 1000))
+
+    print("Heavy modules imported: {}".format(", ".join(imported) or "none"))
+
+
+if __name__ == '__main__':
+    main()
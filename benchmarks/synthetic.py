@@ -0,0 +1,277 @@
+"""
+Generate synthetic record layouts and data files for benchmarking
+
+The layouts are XLSX spreadsheets with the same structure as the ISBE record
+layouts: a field number, test, subgroup specifier, character range, width,
+description and type for each column, with heading rows separating the
+sections of the assessment layout.  The data files are semicolon-delimited
+with a row for each school.
+
+Usage:
+
+    python benchmarks/synthetic.py --output=./data/synthetic --scale=10
+
+The default sizes are roughly those of the 2015 and 2016 files.  --scale
+multiplies the number of schools.
+"""
+import argparse
+import os
+import random
+import zipfile
+from xml.sax.saxutils import escape
+
+from ilreportcard.schema import AssessmentSchema
+
+
+# Roughly the size of the RC15/RC16 files
+NUM_SCHOOLS = 3900
+REPORT_CARD_COLUMNS = 1000
+ASSESSMENT_COLUMNS_PER_TABLE = 30
+
+TESTS = ['ALL TESTS', 'PARCC', 'DLM', '']
+SUBGROUPS = ['ALL', 'MALE', 'FEMALE', 'WHITE', 'BLACK', 'HISPANIC', 'ASIAN',
+    'NATIVE HAWAIIAN AND OTHERS', 'TWO OR MORE RACES', 'LOW INCOME', 'LEP',
+    'IEP', '']
+DESCRIPTIONS = [
+    ('% STUDENTS MEETING EXPECTATIONS ITEM {}', 'F5.1'),
+    ('# STUDENTS TESTED ITEM {}', 'COMMA6'),
+    ('AVERAGE CLASS SIZE ITEM {}', 'F5.1'),
+    ('PERCENTAGE OF STUDENTS FOR ITEM {}', 'F5.1'),
+    ('TOTAL ENROLLMENT ITEM {}', 'COMMA6.0'),
+    ('EXPENDITURE PER PUPIL ITEM {}', 'DOLLAR8'),
+    ('NOTE ITEM {}', 'A20'),
+]
+METADATA_COLUMNS = [
+    ('SCHOOL ID (RCDTS)', 'A15'),
+    ('SCHOOL TYPE CODE (0,1,2,C)', 'A1'),
+    ('SCHOOL NAME', 'A60'),
+    ('DISTRICT NAME', 'A60'),
+    ('CITY', 'A30'),
+    ('COUNTY', 'A30'),
+]
+COUNTIES = ['Cook', 'Dupage', 'Will', 'Lake', 'McHenry', 'Kane', 'Adams',
+    'Champaign', 'Peoria', 'Sangamon']
+
+
+def column_xml(values):
+    cells = []
+    for value in values:
+        if isinstance(value, (int, float)):
+            cells.append('<c><v>{}</v></c>'.format(value))
+        else:
+            cells.append('<c t="inlineStr"><is><t>{}</t></is></c>'.format(
+                escape(value)))
+
+    return '<row>{}</row>'.format(''.join(cells))
+
+
+def write_xlsx(path, sheets):
+    """
+    Write a minimal XLSX workbook
+
+    Args:
+
+        path: Path of the workbook file.
+        sheets: List of (sheet name, rows) tuples, where each row is a list
+            of strings and numbers.
+
+    """
+    content_types = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '{}</Types>').format(''.join(
+            '<Override PartName="/xl/worksheets/sheet{}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(i + 1)
+            for i in range(len(sheets))))
+    rels = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>')
+    workbook = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets>{}</sheets></workbook>').format(''.join(
+            '<sheet name="{}" sheetId="{}" r:id="rId{}"/>'.format(escape(name), i + 1, i + 1)
+            for i, (name, rows) in enumerate(sheets)))
+    workbook_rels = ('<?xml version="1.0" encoding="UTF-8"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '{}</Relationships>').format(''.join(
+            '<Relationship Id="rId{}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet{}.xml"/>'.format(i + 1, i + 1)
+            for i in range(len(sheets))))
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', content_types)
+        z.writestr('_rels/.rels', rels)
+        z.writestr('xl/workbook.xml', workbook)
+        z.writestr('xl/_rels/workbook.xml.rels', workbook_rels)
+
+        for i, (name, rows) in enumerate(sheets):
+            z.writestr('xl/worksheets/sheet{}.xml'.format(i + 1),
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+                '<sheetData>{}</sheetData></worksheet>'.format(
+                    ''.join(column_xml(row) for row in rows)))
+
+
+class LayoutWriter(object):
+    """Build the rows of a record layout spreadsheet"""
+    def __init__(self, rng, header=True):
+        self.rng = rng
+        self.rows = []
+        if header:
+            self.rows.append(['FIELD', 'TEST', 'SUBGROUP', 'RANGE', 'WIDTH',
+                'DESCRIPTION', 'TYPE'])
+        self.types = []
+        self.position = 1
+
+    def heading(self, text):
+        self.rows.append([text])
+
+    def column(self, description, column_type, test='', subgroup=''):
+        width = 15 if column_type.startswith('A') else 8
+        self.rows.append([len(self.types) + 1, test, subgroup,
+            '{}-{}'.format(self.position, self.position + width - 1), width,
+            description, column_type])
+        self.types.append(column_type)
+        self.position += width
+
+    def metadata_columns(self):
+        for description, column_type in METADATA_COLUMNS:
+            self.column(description, column_type)
+
+    def data_columns(self, num_columns):
+        for i in range(num_columns):
+            description, column_type = self.rng.choice(DESCRIPTIONS)
+            self.column(description.format(len(self.types) + 1), column_type,
+                test=self.rng.choice(TESTS), subgroup=self.rng.choice(SUBGROUPS))
+
+
+def report_card_layout(rng, num_columns=REPORT_CARD_COLUMNS):
+    layout = LayoutWriter(rng)
+    layout.heading('SCHOOL REPORT CARD')
+    layout.metadata_columns()
+    layout.heading('SCHOOL CHARACTERISTICS')
+    layout.data_columns(num_columns - len(METADATA_COLUMNS))
+    return layout
+
+
+def assessment_layout(rng, columns_per_table=ASSESSMENT_COLUMNS_PER_TABLE):
+    # A heading row before the school metadata columns would start a second
+    # schools table in AssessmentSchema.from_file
+    layout = LayoutWriter(rng, header=False)
+    layout.metadata_columns()
+
+    heading = None
+    for section in sorted(AssessmentSchema.SECTION_TO_TABLE.keys(),
+            key=lambda s: AssessmentSchema.SECTION_TO_TABLE[s]):
+        if section == (None, None):
+            continue
+
+        if section[0] != heading:
+            heading = section[0]
+            layout.heading(heading)
+
+        layout.heading(section[1])
+        layout.data_columns(columns_per_table)
+
+    return layout
+
+
+def random_value(rng, column_type):
+    if rng.random() < 0.1:
+        return ''
+
+    if column_type.startswith('A'):
+        return 'TEXT {}'.format(rng.randint(0, 999))
+
+    if column_type.startswith('COMMA'):
+        return '{:,}'.format(rng.randint(0, 20000))
+
+    if column_type.startswith('DOLLAR'):
+        return '${:,.2f}'.format(rng.random() * 20000)
+
+    return '{:.1f}'.format(rng.random() * 100)
+
+
+def write_data(path, layout, num_schools, rng):
+    with open(path, 'w') as f:
+        for i in range(num_schools):
+            values = [
+                '{:02d}{:03d}{:04d}{:02d}{:04d}'.format(rng.randint(1, 60),
+                    rng.randint(1, 999), rng.randint(1, 9999), 26, i),
+                rng.choice(['0', '1', '2', 'C']),
+                'School {}'.format(i),
+                'District {}'.format(i // 4),
+                'City {}'.format(i % 300),
+                rng.choice(COUNTIES),
+            ]
+            values.extend(random_value(rng, t)
+                for t in layout.types[len(values):])
+            f.write(';'.join(values))
+            f.write('\n')
+
+
+def get_paths(output, year):
+    """Get the paths of the files generated for a year"""
+    suffix = str(year)[2:]
+    return {
+        'report_card_layout': os.path.join(output,
+            'RC{}_layout.xlsx'.format(suffix)),
+        'report_card_data': os.path.join(output, 'rc{}.txt'.format(suffix)),
+        'assessment_layout': os.path.join(output,
+            'RC{}_assessment_layout.xlsx'.format(suffix)),
+        'assessment_data': os.path.join(output,
+            'rc{}_assessment.txt'.format(suffix)),
+    }
+
+
+def generate(output, scale=1, year=2015, seed=0,
+        report_card_columns=REPORT_CARD_COLUMNS,
+        assessment_columns_per_table=ASSESSMENT_COLUMNS_PER_TABLE):
+    """
+    Write synthetic layouts and data files to a directory
+
+    Returns a dictionary of the paths of the generated files.
+
+    """
+    rng = random.Random(seed)
+    num_schools = int(NUM_SCHOOLS * scale)
+    suffix = str(year)[2:]
+
+    if not os.path.isdir(output):
+        os.makedirs(output)
+
+    paths = get_paths(output, year)
+
+    layout = report_card_layout(rng, report_card_columns)
+    write_xlsx(paths['report_card_layout'], [('RC' + suffix, layout.rows)])
+    write_data(paths['report_card_data'], layout, num_schools, rng)
+
+    layout = assessment_layout(rng, assessment_columns_per_table)
+    sheets = [('Assessment', layout.rows)]
+    if year >= 2016:
+        # In 2016, the assessment layout is the second worksheet
+        sheets.insert(0, ('RC' + suffix, [['FIELD']]))
+    write_xlsx(paths['assessment_layout'], sheets)
+    write_data(paths['assessment_data'], layout, num_schools, rng)
+
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--output', required=True)
+    parser.add_argument('--scale', type=float, default=1)
+    parser.add_argument('--year', type=int, default=2015)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    paths = generate(args.output, scale=args.scale, year=args.year,
+        seed=args.seed)
+    for name, path in sorted(paths.items()):
+        print("{}: {}".format(name, path))
+
+
+if __name__ == '__main__':
+    main()
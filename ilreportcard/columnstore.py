@@ -0,0 +1,344 @@
+"""
+Load a schema's tables into memory, one typed array per column
+
+Analysis that only needs a few columns for every school doesn't need a
+database.  A ColumnStore keeps each table's converted values in typed
+arrays, one for each column: 64-bit integers, 64-bit floats and bytes for
+booleans.  Text columns store an integer code for each row and a dictionary
+of the distinct values, so repeated values like county names are only kept
+once.  Each column also has a bitmap with a bit set for every null value.
+
+Tables can be filtered, projected onto some of their columns and grouped,
+without converting them back to lists of tuples.
+"""
+from array import array
+from collections import OrderedDict
+
+from ilreportcard.compat import int64_array, text_type
+from ilreportcard.schema import COLUMN_TYPES
+
+
+class ArrayColumn(object):
+    """
+    A column's values in a typed array, with a bitmap of nulls
+
+    Args:
+
+        name: Name of the column.
+        typecode: array typecode of the values.  'q' is always 64-bit
+            integers, even on Python 2, which doesn't have that typecode.
+
+    Null values are stored as zeros in the array.
+
+    """
+    def __init__(self, name, typecode):
+        self.name = name
+        self.values = int64_array() if typecode == 'q' else array(typecode)
+        self.nulls = bytearray()
+        self.null_count = 0
+
+    def empty(self):
+        """Make an empty column of the same type"""
+        return self.__class__(self.name, self.values.typecode)
+
+    def encode(self, value):
+        return value
+
+    def decode(self, value):
+        return value
+
+    def append(self, value):
+        i = len(self.values)
+        if not i & 7:
+            self.nulls.append(0)
+
+        if value is None:
+            self.nulls[i >> 3] |= 1 << (i & 7)
+            self.null_count += 1
+            self.values.append(0)
+        else:
+            self.values.append(self.encode(value))
+
+    def is_null(self, i):
+        return bool(self.nulls[i >> 3] & (1 << (i & 7)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if self.is_null(i):
+            return None
+
+        return self.decode(self.values[i])
+
+    def __iter__(self):
+        if not self.null_count:
+            for value in self.values:
+                yield self.decode(value)
+            return
+
+        for i in range(len(self.values)):
+            yield self[i]
+
+    def take(self, indexes):
+        """Make a new column with the values at some positions"""
+        column = self.empty()
+        for i in indexes:
+            column.append(self[i])
+
+        return column
+
+    @property
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + len(self.nulls)
+
+
+class BooleanColumn(ArrayColumn):
+    def __init__(self, name, typecode='b'):
+        super(BooleanColumn, self).__init__(name, typecode)
+
+    def decode(self, value):
+        return bool(value)
+
+
+class StringColumn(ArrayColumn):
+    """
+    A text column stored as codes into a dictionary of its distinct values
+    """
+    def __init__(self, name, typecode='I'):
+        super(StringColumn, self).__init__(name, typecode)
+        self.dictionary = []
+        self._codes = {}
+
+    def encode(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.dictionary)
+            self.dictionary.append(value)
+            self._codes[value] = code
+
+        return code
+
+    def decode(self, value):
+        return self.dictionary[value]
+
+    @property
+    def nbytes(self):
+        return (super(StringColumn, self).nbytes +
+            sum(len(value.encode('utf-8') if isinstance(value, text_type)
+                else value) for value in self.dictionary))
+
+
+def make_column(columndef):
+    """Make an empty column for a schema column definition"""
+    if columndef.column_type == COLUMN_TYPES.STRING:
+        return StringColumn(columndef.name)
+
+    if columndef.column_type == COLUMN_TYPES.BOOLEAN:
+        return BooleanColumn(columndef.name)
+
+    if columndef.column_type == COLUMN_TYPES.FLOAT:
+        return ArrayColumn(columndef.name, 'd')
+
+    return ArrayColumn(columndef.name, 'q')
+
+
+def count_values(values):
+    return len(values)
+
+
+def mean(values):
+    if not values:
+        return None
+
+    return float(sum(values)) / len(values)
+
+
+def get_min(values):
+    return min(values) if values else None
+
+
+def get_max(values):
+    return max(values) if values else None
+
+
+# Aggregate functions for group_by().  Each is called with the non-null
+# values of a group.
+AGGREGATES = {
+    'count': count_values,
+    'sum': sum,
+    'mean': mean,
+    'min': get_min,
+    'max': get_max,
+}
+
+
+class ColumnTable(object):
+    """
+    A table's rows, stored by column
+
+    Args:
+
+        name: Name of the table.
+        columns: List of columns, like the ones made by make_column().
+
+    """
+    def __init__(self, name, columns):
+        self.name = name
+        self.columns = OrderedDict((column.name, column) for column in columns)
+
+    @classmethod
+    def from_tabledef(cls, tabledef):
+        return cls(tabledef.name, [make_column(c) for c in tabledef.columns])
+
+    @property
+    def column_names(self):
+        return list(self.columns)
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+
+        return len(next(iter(self.columns.values())))
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append_rows(self, rows):
+        """Append row tuples with values in the same order as the columns"""
+        columns = list(self.columns.values())
+        for row in rows:
+            for column, value in zip(columns, row):
+                column.append(value)
+
+    def iter_rows(self):
+        return zip(*self.columns.values())
+
+    def to_dicts(self):
+        names = self.column_names
+        return [dict(zip(names, row)) for row in self.iter_rows()]
+
+    def take(self, indexes):
+        """Make a new table with the rows at some positions"""
+        indexes = list(indexes)
+        return ColumnTable(self.name,
+            [column.take(indexes) for column in self.columns.values()])
+
+    def project(self, *names):
+        """
+        Make a table with only some of the columns
+
+        The columns aren't copied, so this is cheap even for large tables.
+
+        """
+        return ColumnTable(self.name, [self.columns[name] for name in names])
+
+    def filter(self, predicate, *names):
+        """
+        Make a new table with the rows that match a predicate
+
+        Args:
+
+            predicate: Function called with the values of the named columns
+                for each row.  Rows are kept when it returns a true value.
+            names: Names of the columns passed to the predicate.
+
+        """
+        values = zip(*[self.columns[name] for name in names])
+        return self.take(i for i, row in enumerate(values) if predicate(*row))
+
+    def group_by(self, keys, **aggregates):
+        """
+        Aggregate the values of groups of rows
+
+        Args:
+
+            keys: Name, or list of names, of the columns to group by.
+            aggregates: Each keyword argument is an (aggregate, column name)
+                tuple, where aggregate is one of the names in AGGREGATES.
+                Null values are left out of the aggregates.  Use
+                ('count', None) to count the rows in each group.
+
+        Returns a list of dictionaries with the keys and aggregates of each
+        group, in the order each group first appears in the table.
+
+        """
+        if not isinstance(keys, (list, tuple)):
+            keys = [keys]
+
+        for name, (aggregate, column_name) in aggregates.items():
+            if aggregate not in AGGREGATES:
+                raise ValueError("Unknown aggregate '{}'.  Use one of {}".format(
+                    aggregate, ", ".join(sorted(AGGREGATES))))
+
+        groups = OrderedDict()
+        for i, key in enumerate(zip(*[self.columns[k] for k in keys])):
+            groups.setdefault(key, []).append(i)
+
+        results = []
+        for key, indexes in groups.items():
+            result = dict(zip(keys, key))
+            for name, (aggregate, column_name) in aggregates.items():
+                if column_name is None:
+                    values = indexes
+                else:
+                    column = self.columns[column_name]
+                    values = [column[i] for i in indexes]
+                    values = [v for v in values if v is not None]
+
+                result[name] = AGGREGATES[aggregate](values)
+
+            results.append(result)
+
+        return results
+
+    @property
+    def nbytes(self):
+        return sum(column.nbytes for column in self.columns.values())
+
+
+class ColumnStore(object):
+    """
+    In-memory tables for a schema
+
+    Args:
+
+        schema: Schema whose tables are stored.  Load its layout first for
+            the report card and assessment schemas.
+
+    """
+    def __init__(self, schema):
+        self.schema = schema
+        self.tables = OrderedDict((tabledef.name,
+                ColumnTable.from_tabledef(tabledef))
+            for tabledef in schema.tables)
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def append_batch(self, batch):
+        """Append a batch with a list of rows for each of the schema's
+        tables"""
+        for table, rows in zip(self.tables.values(), batch):
+            table.append_rows(rows)
+
+    def load(self, loader, f):
+        """
+        Load a data file with a loader, instead of writing it to a database
+
+        Args:
+
+            loader: Loader whose schema has been set to this store's schema.
+            f: File-like object containing the data.
+
+        Returns the store.
+
+        """
+        for batch in loader.iter_batches(f):
+            self.append_batch(batch)
+
+        return self
+
+    @property
+    def nbytes(self):
+        return sum(table.nbytes for table in self.tables.values())
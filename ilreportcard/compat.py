@@ -0,0 +1,70 @@
+"""
+Differences between Python 2 and 3 used by the binary file formats
+
+The columnar export format, the column store and snapshots keep values in
+arrays.  Python 2's arrays don't have the 'q' and 'Q' typecodes for 64-bit
+integers, or the tobytes() and frombytes() methods.
+"""
+from array import array
+import sys
+
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    text_type = unicode
+    integer_types = (int, long)
+else:
+    text_type = str
+    integer_types = (int,)
+
+
+def get_64_bit_typecode(typecodes):
+    """
+    Get the first of some array typecodes whose items are 8 bytes wide, or
+    None if there isn't one, as on Python 2 on Windows
+    """
+    for typecode in typecodes:
+        try:
+            if array(typecode).itemsize == 8:
+                return typecode
+        except ValueError:
+            # Python 2 doesn't have 'q' or 'Q'
+            continue
+
+    return None
+
+
+INT64_TYPECODE = get_64_bit_typecode(('q', 'l'))
+UINT64_TYPECODE = get_64_bit_typecode(('Q', 'L'))
+
+
+def get_native_typecode(typecode):
+    """Get the typecode this Python uses for a Python 3 array typecode"""
+    native = {'q': INT64_TYPECODE, 'Q': UINT64_TYPECODE}.get(typecode,
+        typecode)
+    if native is None:
+        raise ValueError("This platform has no 64-bit integer arrays")
+
+    return native
+
+
+def int64_array(values=()):
+    return array(get_native_typecode('q'), values)
+
+
+def array_to_bytes(values):
+    if PY2:
+        return values.tostring()
+
+    return values.tobytes()
+
+
+def array_from_bytes(typecode, data):
+    values = array(typecode)
+    if PY2:
+        values.fromstring(bytes(data))
+    else:
+        values.frombytes(data)
+
+    return values
@@ -0,0 +1,320 @@
+"""
+Export query results and tables to files
+
+Results are read from the database with a server-side cursor (see the
+'iter' result mode of the query functions) and written in chunks, so
+exporting a large table doesn't need more memory than a small one.  Files
+can be written as CSV, newline-delimited JSON or the columnar binary format
+in ilreportcard.export.columnar, and optionally compressed with gzip.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import datetime
+from decimal import Decimal
+import gzip
+import io
+from itertools import islice
+import json
+import logging
+import os
+
+from sqlalchemy import MetaData, Table
+
+from ilreportcard.compat import PY2, text_type
+from ilreportcard.query import (best_worst_performers_query, get_results,
+    summary_query)
+
+from .columnar import ColumnarWriter
+
+
+# Number of rows fetched and written at a time
+DEFAULT_CHUNK_SIZE = 1000
+
+GZIP_EXTENSION = '.gz'
+
+
+def encode_csv_value(value):
+    if isinstance(value, text_type):
+        return value.encode('utf-8')
+
+    return value
+
+
+class CSVExporter(object):
+    """
+    Write rows as CSV, with a header row of column names
+
+    Python 2's csv module writes bytes, so text is encoded as UTF-8 before
+    it's written.
+
+    """
+    extension = '.csv'
+    binary = PY2
+
+    def __init__(self, f, columns):
+        self._writer = csv.writer(f)
+        self.write_rows([columns])
+
+    def write_rows(self, rows):
+        if PY2:
+            rows = ([encode_csv_value(value) for value in row]
+                for row in rows)
+
+        self._writer.writerows(rows)
+
+    def close(self):
+        pass
+
+
+def json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+
+    raise TypeError("{!r} is not JSON serializable".format(value))
+
+
+class JSONLinesExporter(object):
+    """Write each row as a JSON object on its own line"""
+    extension = '.ndjson'
+    binary = False
+
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = list(columns)
+
+    def write_rows(self, rows):
+        self.f.write(u''.join(
+            json.dumps(dict(zip(self.columns, row)), default=json_default,
+                sort_keys=True) + u'\n'
+            for row in rows))
+
+    def close(self):
+        pass
+
+
+class ColumnarExporter(object):
+    """Write each chunk of rows as a row group of a columnar file"""
+    extension = '.ilcol'
+    binary = True
+
+    def __init__(self, f, columns):
+        self._writer = ColumnarWriter(f, columns)
+
+    def write_rows(self, rows):
+        self._writer.write_rows(rows)
+
+    def close(self):
+        self._writer.close()
+
+
+EXPORTERS = {
+    'csv': CSVExporter,
+    'ndjson': JSONLinesExporter,
+    'columnar': ColumnarExporter,
+}
+
+
+def get_exporter_class(format):
+    try:
+        return EXPORTERS[format]
+    except KeyError:
+        raise ValueError("Unknown export format '{}'.  Use one of {}".format(
+            format, ", ".join(sorted(EXPORTERS))))
+
+
+def get_export_filename(name, format, compress=False):
+    filename = name + get_exporter_class(format).extension
+    if compress:
+        filename += GZIP_EXTENSION
+
+    return filename
+
+
+def open_output(path, binary, compress=False):
+    if compress:
+        f = gzip.open(path, 'wb')
+    else:
+        f = io.open(path, 'wb')
+
+    if binary:
+        return f
+
+    return io.TextIOWrapper(f, encoding='utf-8', newline='')
+
+
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+
+        yield chunk
+
+
+def export_rows(columns, rows, path, format='csv', compress=False,
+        chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write rows to a file
+
+    Args:
+
+        columns: List of column names.
+        rows: Iterable of row tuples.  It's read chunk_size rows at a time.
+        path: Path of the file to write.
+        format: One of the names in EXPORTERS.
+        compress: Whether to compress the file with gzip.
+        chunk_size: Number of rows written at a time.
+
+    Returns the number of rows written.
+
+    """
+    exporter_class = get_exporter_class(format)
+    count = 0
+
+    with open_output(path, exporter_class.binary, compress) as f:
+        exporter = exporter_class(f, columns)
+        for chunk in iter_chunks(rows, chunk_size):
+            exporter.write_rows(chunk)
+            count += len(chunk)
+
+        exporter.close()
+
+    logging.info("Exported {} rows to {}".format(count, path))
+    return count
+
+
+def export_result(result, path, **kwargs):
+    """
+    Write the rows of a ResultIterator, like the ones returned by the query
+    functions with result='iter', to a file
+
+    Keyword arguments are passed to export_rows().
+
+    """
+    with result:
+        return export_rows(result.columns, result, path, **kwargs)
+
+
+# Query functions that can be exported, by name
+QUERIES = {
+    'summary': summary_query,
+    'best_worst_performers': best_worst_performers_query,
+}
+
+
+def export_query(conn, query, year, path, format='csv', compress=False,
+        chunk_size=DEFAULT_CHUNK_SIZE, **query_kwargs):
+    """
+    Run one of the QUERIES and write its results to a file
+
+    Args:
+
+        conn: SQLAlchemy connection.
+        query: Name of the query in QUERIES.
+        year: Year of the data to query.
+        path: Path of the file to write.
+        format: One of the names in EXPORTERS.
+        compress: Whether to compress the file with gzip.
+        chunk_size: Number of rows fetched and written at a time.
+        query_kwargs: Other arguments of the query function.
+
+    """
+    try:
+        query_function = QUERIES[query]
+    except KeyError:
+        raise ValueError("Unknown query '{}'.  Use one of {}".format(
+            query, ", ".join(sorted(QUERIES))))
+
+    result = query_function(conn, year, result='iter', **query_kwargs)
+    result.chunk_size = chunk_size
+    return export_result(result, path, format=format, compress=compress,
+        chunk_size=chunk_size)
+
+
+def export_table(conn, table_name, path, format='csv', compress=False,
+        chunk_size=DEFAULT_CHUNK_SIZE):
+    """Write all of a database table's rows to a file"""
+    table = Table(table_name, MetaData(), autoload=True, autoload_with=conn)
+    s = table.select()
+    if table.primary_key.columns:
+        # Export rows in a stable order
+        s = s.order_by(*table.primary_key.columns)
+
+    result = get_results(
+        conn.execution_options(stream_results=True).execute(s), 'iter')
+    result.chunk_size = chunk_size
+    return export_result(result, path, format=format, compress=compress,
+        chunk_size=chunk_size)
+
+
+def export_tables(engine, table_names, directory, format='csv',
+        compress=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=1):
+    """
+    Write each table to its own file in a directory
+
+    Args:
+
+        engine: SQLAlchemy engine.  Each table is exported over its own
+            connection, so the engine's pool needs to allow at least workers
+            connections.
+        table_names: List of names of the tables to export.
+        directory: Directory the files are written to.  The files are named
+            after the tables.
+        format: One of the names in EXPORTERS.
+        compress: Whether to compress the files with gzip.
+        chunk_size: Number of rows fetched and written at a time.
+        workers: Number of tables exported at the same time.
+
+    Returns a dictionary mapping each table name to the path of its file.
+
+    """
+    paths = dict((name, os.path.join(directory,
+            get_export_filename(name, format, compress)))
+        for name in table_names)
+
+    def export(table_name):
+        with engine.connect() as conn:
+            export_table(conn, table_name, paths[table_name], format=format,
+                compress=compress, chunk_size=chunk_size)
+
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Reading the results raises any exception from the workers
+            list(executor.map(export, table_names))
+    else:
+        for table_name in table_names:
+            export(table_name)
+
+    return paths
+
+
+def export_column_tables(tables, directory, format='csv', compress=False,
+        chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Write in-memory tables to their own files in a directory
+
+    Args:
+
+        tables: List of ColumnTables, from a ColumnStore or a Snapshot.
+        directory: Directory the files are written to.  The files are named
+            after the tables.
+        format: One of the names in EXPORTERS.
+        compress: Whether to compress the files with gzip.
+        chunk_size: Number of rows written at a time.
+
+    Returns a dictionary mapping each table name to the path of its file.
+
+    """
+    paths = {}
+    for table in tables:
+        path = os.path.join(directory,
+            get_export_filename(table.name, format, compress))
+        export_rows(table.column_names, table.iter_rows(), path,
+            format=format, compress=compress, chunk_size=chunk_size)
+        paths[table.name] = path
+
+    return paths
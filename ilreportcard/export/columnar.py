@@ -0,0 +1,207 @@
+"""
+A compact, column-oriented binary file format
+
+Files start with a magic string and a JSON header with the column names,
+followed by row groups.  Each row group starts with its number of rows, as
+an unsigned 32-bit integer, and then has a block for each column:
+
+* A one-byte type code: 'q' for 64-bit integers, 'd' for 64-bit floats,
+  '?' for booleans, 's' for UTF-8 strings or 'n' for a column that is all
+  nulls.
+* A null bitmap with a bit for each row, set when the value is null.
+* The values.  Numbers and booleans are fixed width.  Strings are stored as
+  num_rows + 1 unsigned 32-bit offsets followed by the concatenated UTF-8
+  bytes.
+
+A row group with zero rows marks the end of the file.  All numbers are
+little-endian.  The type of each column is picked separately for each row
+group, based on its values, so results can be written one chunk at a time
+without knowing their types in advance.
+"""
+from array import array
+from decimal import Decimal
+import json
+import struct
+import sys
+
+from ilreportcard.compat import (array_from_bytes, array_to_bytes,
+    get_native_typecode, int64_array, integer_types, text_type)
+
+
+MAGIC = b'ILRCOL1\n'
+
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+COUNT = struct.Struct('<I')
+
+
+def get_column_type(values):
+    column_type = 'n'
+    for value in values:
+        if value is None:
+            continue
+
+        if isinstance(value, bool):
+            value_type = '?'
+        elif isinstance(value, integer_types):
+            value_type = 'q'
+        elif isinstance(value, (float, Decimal)):
+            value_type = 'd'
+        else:
+            return 's'
+
+        if column_type == 'n' or column_type == value_type:
+            column_type = value_type
+        elif set((column_type, value_type)) == set(('q', 'd')):
+            column_type = 'd'
+        else:
+            return 's'
+
+    return column_type
+
+
+def to_bytes(values):
+    if not LITTLE_ENDIAN:
+        values = array(values.typecode, values)
+        values.byteswap()
+
+    return array_to_bytes(values)
+
+
+def from_bytes(typecode, data):
+    values = array_from_bytes(get_native_typecode(typecode), data)
+    if not LITTLE_ENDIAN:
+        values.byteswap()
+
+    return values
+
+
+def get_null_bitmap(values):
+    bitmap = bytearray((len(values) + 7) // 8)
+    for i, value in enumerate(values):
+        if value is None:
+            bitmap[i >> 3] |= 1 << (i & 7)
+
+    return bytes(bitmap)
+
+
+def encode_column(values):
+    """Encode a column's values for one row group"""
+    column_type = get_column_type(values)
+    parts = [column_type.encode('ascii'), get_null_bitmap(values)]
+
+    if column_type == 'q':
+        parts.append(to_bytes(int64_array(
+            [0 if v is None else v for v in values])))
+    elif column_type == 'd':
+        parts.append(to_bytes(array('d',
+            [0.0 if v is None else float(v) for v in values])))
+    elif column_type == '?':
+        parts.append(bytes(bytearray(1 if v else 0 for v in values)))
+    elif column_type == 's':
+        offsets = array('I', [0])
+        encoded = []
+        length = 0
+        for value in values:
+            if value is not None:
+                if not isinstance(value, text_type):
+                    value = u'{}'.format(value)
+                data = value.encode('utf-8')
+                encoded.append(data)
+                length += len(data)
+
+            offsets.append(length)
+
+        parts.append(to_bytes(offsets))
+        parts.append(b''.join(encoded))
+
+    return b''.join(parts)
+
+
+class ColumnarWriter(object):
+    """
+    Write rows to a columnar file, one row group at a time
+
+    Args:
+
+        f: Binary file-like object.
+        columns: List of column names.
+
+    """
+    def __init__(self, f, columns):
+        self.f = f
+        self.columns = list(columns)
+        header = json.dumps({'columns': self.columns}).encode('utf-8')
+        f.write(MAGIC)
+        f.write(COUNT.pack(len(header)))
+        f.write(header)
+
+    def write_rows(self, rows):
+        """Write a list of row tuples as a row group"""
+        if not rows:
+            return
+
+        self.f.write(COUNT.pack(len(rows)))
+        for values in zip(*rows):
+            self.f.write(encode_column(values))
+
+    def close(self):
+        self.f.write(COUNT.pack(0))
+
+
+class ColumnarReader(object):
+    """
+    Read a columnar file written by ColumnarWriter
+
+    Args:
+
+        f: Binary file-like object.
+
+    Iterating over the reader yields a dictionary mapping column names to
+    lists of values for each row group.
+
+    """
+    def __init__(self, f):
+        self.f = f
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("Not a columnar file")
+
+        header_length, = COUNT.unpack(f.read(COUNT.size))
+        self.columns = json.loads(f.read(header_length).decode('utf-8'))[
+            'columns']
+
+    def read_column(self, num_rows):
+        column_type = self.f.read(1).decode('ascii')
+        bitmap = bytearray(self.f.read((num_rows + 7) // 8))
+        nulls = [bitmap[i >> 3] & (1 << (i & 7)) for i in range(num_rows)]
+
+        if column_type == 'n':
+            return [None] * num_rows
+
+        if column_type in ('q', 'd'):
+            values = from_bytes(column_type, self.f.read(8 * num_rows))
+        elif column_type == '?':
+            values = [bool(b) for b in bytearray(self.f.read(num_rows))]
+        elif column_type == 's':
+            offsets = from_bytes('I', self.f.read(4 * (num_rows + 1)))
+            data = self.f.read(offsets[-1])
+            values = [data[offsets[i]:offsets[i + 1]].decode('utf-8')
+                for i in range(num_rows)]
+        else:
+            raise ValueError("Unknown column type '{}'".format(column_type))
+
+        return [None if null else value for null, value in zip(nulls, values)]
+
+    def __iter__(self):
+        while True:
+            num_rows, = COUNT.unpack(self.f.read(COUNT.size))
+            if not num_rows:
+                break
+
+            yield dict((name, self.read_column(num_rows))
+                for name in self.columns)
+
+    def iter_rows(self):
+        for group in self:
+            for row in zip(*[group[name] for name in self.columns]):
+                yield row
@@ -0,0 +1,59 @@
+"""
+Count the loads made into a database
+
+Every time a loader finishes writing data, it increments the generation
+number stored in the load_generation table.  Anything derived from the
+loaded data, like cached query results, can compare the generation it was
+built from with the current one to tell whether it is out of date.
+"""
+import datetime
+
+from sqlalchemy import (BigInteger, Column, DateTime, Integer, MetaData,
+    Table, select)
+
+
+LOAD_GENERATION_TABLE_NAME = 'load_generation'
+
+
+def get_load_generation_table(metadata):
+    # A single row, with id 1
+    return Table(LOAD_GENERATION_TABLE_NAME, metadata,
+        Column('id', Integer, primary_key=True, autoincrement=False),
+        Column('generation', BigInteger, nullable=False),
+        Column('updated', DateTime, nullable=False),
+    )
+
+
+def get_load_generation(connection, check_exists=True):
+    """
+    Get the current load generation, or 0 if nothing has been loaded
+
+    Pass check_exists=False when the load_generation table is known to
+    exist, to save a query.
+
+    """
+    table = get_load_generation_table(MetaData())
+    if check_exists and not table.exists(connection):
+        return 0
+
+    generation = connection.execute(select([table.c.generation])
+        .where(table.c.id == 1)).scalar()
+    return generation or 0
+
+
+def bump_load_generation(connection):
+    """Increment the load generation and return the new value"""
+    table = get_load_generation_table(MetaData())
+    table.create(connection, checkfirst=True)
+
+    with connection.begin():
+        updated = connection.execute(table.update()
+            .where(table.c.id == 1)
+            .values(generation=table.c.generation + 1,
+                updated=datetime.datetime.now()))
+        if updated.rowcount == 0:
+            connection.execute(table.insert().values(id=1, generation=1,
+                updated=datetime.datetime.now()))
+
+        return connection.execute(select([table.c.generation])
+            .where(table.c.id == 1)).scalar()
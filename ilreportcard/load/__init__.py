@@ -1,11 +1,225 @@
 import csv
+from functools import partial
+from itertools import chain, islice
 import logging
+import os
 import re
+import time
 
-import xlrd
+from ilreportcard.columnstore import ColumnStore
+from ilreportcard.generation import bump_load_generation
+from ilreportcard.metrics import CountingLines, LoadMetrics
+from ilreportcard.registry import get_loader
+from ilreportcard.schema import compile_converter, compile_row_converter
+from ilreportcard.snapshot import (DEFAULT_BATCH_SIZE as
+    DEFAULT_SNAPSHOT_BATCH_SIZE, get_source_info, open_matching_snapshot,
+    write_snapshot)
+from ilreportcard.xlsx import XL_CELL_TEXT, open_workbook
+
+from .checkpoint import Batch, CheckpointTableWriter
+from .incremental import IncrementalTableWriter
+from .parallel import convert_rows, iter_parallel_batches
+from .pipeline import BatchPipeline
+from .staging import StagedTables
+from .writers import (DEFAULT_ENGINE, ConcurrentTableWriter, TableWriter,
+    get_writer)
+
+
+# Number of rows DelimitedLoader parses and converts before writing them
+DEFAULT_BATCH_SIZE = 10000
 
 
 class BaseLoader(object):
+    """
+    Base class for loaders
+
+    Args:
+
+        engine: Name of the strategy used to write rows to the database.
+            One of 'copy', 'executemany' or 'values'.  'copy' falls back to
+            'executemany' for databases that don't support COPY.
+        table_workers: Number of tables written at the same time, each
+            over its own connection from the engine's pool.
+        atomic: If True, either all of the tables are loaded or, if there's
+            an error, none of them are.  With more than one table worker
+            this uses two-phase commit.
+        metrics: LoadMetrics object that collects timings of the phases of
+            the load.  A new one is created if this isn't specified.
+        incremental: If True, only insert rows that are new or have changed
+            since the last incremental load, based on a hash of each row
+            stored with its primary key.  Tables are written one after
+            another in a single transaction, so table_workers and atomic
+            are ignored.
+        delete_missing: If True, an incremental load also deletes rows
+            whose keys aren't in the data file.
+        staging: If True, load the data into empty staging copies of the
+            tables and replace the tables with them in a single transaction
+            once the load is done, so that queries made during the load see
+            the old data.  Existing rows are always replaced, so flush is
+            ignored.  Can't be combined with incremental.
+        snapshot: Optional path of a snapshot file (see
+            ilreportcard.snapshot).  If the snapshot was made from the same
+            data file, rows are read from it instead of parsing and
+            converting the data file.  Otherwise, the converted rows are
+            saved to it for the next load.  Writing a snapshot keeps every
+            row of the load in a ColumnStore until the end, so memory use
+            grows with the data file even when rows are written in
+            batches.
+
+    After an incremental load, incremental_counts maps each table name to
+    the number of 'inserted', 'updated', 'unchanged' and 'deleted' rows.
+
+    """
+    def __init__(self, engine=DEFAULT_ENGINE, table_workers=1, atomic=False,
+            metrics=None, incremental=False, delete_missing=False,
+            staging=False, snapshot=None):
+        if staging and incremental:
+            raise ValueError("Staged loads can't be incremental")
+
+        self.engine = engine
+        self.table_workers = table_workers
+        self.atomic = atomic
+        self.metrics = metrics if metrics is not None else LoadMetrics()
+        self.incremental = incremental
+        self.delete_missing = delete_missing
+        self.incremental_counts = None
+        self.staging = staging
+        self.snapshot = snapshot
+
+    def get_writer(self, connection):
+        return get_writer(self.engine, connection, metrics=self.metrics)
+
+    def get_table_writer(self, connection, tables):
+        writer = self.get_writer(connection)
+
+        if self.incremental:
+            return IncrementalTableWriter(writer, connection, tables,
+                delete_missing=self.delete_missing)
+
+        if self.table_workers > 1 and len(tables) > 1:
+            return ConcurrentTableWriter(writer, connection.engine, tables,
+                self.table_workers, atomic=self.atomic)
+
+        return TableWriter(writer, connection, tables, atomic=self.atomic)
+
+    def iter_snapshot_batches(self, f):
+        """
+        Get batches of converted rows from the loader's snapshot
+
+        If the snapshot is out of date, the data file is parsed with
+        iter_batches() and the snapshot is written once all of the batches
+        have been read.  Until then, the batches are kept in a ColumnStore,
+        which is more compact than the rows but holds the whole load.
+
+        """
+        source = get_source_info(f)
+        snapshot = open_matching_snapshot(self.snapshot, self._schema, source)
+        if snapshot is not None:
+            logging.info("Reading converted rows from snapshot {}".format(
+                self.snapshot))
+            batch_size = (getattr(self, 'batch_size', None) or
+                DEFAULT_SNAPSHOT_BATCH_SIZE)
+            with snapshot:
+                batches = snapshot.iter_batches(batch_size)
+                while True:
+                    start = time.time()
+                    batch = next(batches, None)
+                    if batch is None:
+                        break
+
+                    self.metrics.record('snapshot',
+                        seconds=time.time() - start, rows=len(batch[0]))
+                    yield batch
+            return
+
+        store = ColumnStore(self._schema)
+        for batch in self.iter_batches(f):
+            store.append_batch(batch)
+            yield batch
+
+        write_snapshot(self.snapshot, store.tables.values(), source)
+
+    def write_tables(self, connection, tables, batches, flush=False,
+            table_writer=None):
+        """
+        Write batches of converted rows to tables
+
+        Args:
+
+            connection: SQLAlchemy connection.
+            tables: List of (tabledef, SQLAlchemy Table) tuples.
+            batches: Iterable of batches.  Each batch is a list of rows for
+                each table, in the same order as tables.
+            flush: If True, delete existing rows, and the row hashes of
+                incremental loads, from the tables once the first batch has
+                been converted.  Unless the load is atomic, an error in a
+                later batch leaves the tables with the rows written before
+                it.
+            table_writer: Table writer to use instead of the one returned by
+                get_table_writer().
+
+        Returns the number of rows in the batches.
+
+        Afterwards, the load generation is incremented so that cached query
+        results are invalidated.
+
+        """
+        if self.staging:
+            num_rows = self.write_staged_tables(connection, tables, batches)
+        else:
+            if table_writer is None:
+                table_writer = self.get_table_writer(connection, tables)
+
+            # Convert the first batch before deleting anything, so a data
+            # file that can't be parsed doesn't leave the tables empty
+            batches = iter(batches)
+            first_batch = next(batches, None)
+            if first_batch is not None:
+                batches = chain([first_batch], batches)
+
+            num_rows = self.write_batches(table_writer, batches, flush=flush)
+
+            if self.incremental:
+                self.incremental_counts = table_writer.counts
+
+        bump_load_generation(connection)
+
+        return num_rows
+
+    def write_batches(self, table_writer, batches, flush=False):
+        num_rows = 0
+
+        table_writer.open()
+        try:
+            if flush:
+                table_writer.delete()
+
+            for batch in batches:
+                num_rows += len(batch[0])
+                table_writer.write(batch)
+
+            table_writer.commit()
+        finally:
+            table_writer.close()
+
+        return num_rows
+
+    def write_staged_tables(self, connection, tables, batches):
+        """Write batches to staging tables and swap them in when done"""
+        staged = StagedTables(connection, tables,
+            indexes=self._schema.get_indexes())
+        staged.create()
+        try:
+            num_rows = self.write_batches(self.get_table_writer(connection,
+                staged.staging_tables), batches)
+            staged.finish()
+            staged.swap()
+        except Exception:
+            staged.drop()
+            raise
+
+        return num_rows
+
     def set_schema(self, schema):
         self._schema = schema
 
@@ -20,50 +234,197 @@ class BaseLoader(object):
 
         return column.convert_value(stripped)
 
+    @classmethod
+    def get_row_converter(cls, tabledef):
+        """
+        Get a function that converts a raw row to a tuple of values for
+        the columns of a table
+        """
+        return tabledef.get_row_converter()
+
     @classmethod
     def get_row_values(cls, tabledef, row):
-        return tuple(cls.get_column_value(c, row[c.column_index])
-            for c in tabledef.columns)
+        return cls.get_row_converter(tabledef)(row)
 
 
 class DelimitedLoader(BaseLoader):
-    def load(self, f, metadata, connection, flush=False):
-        table_data = {t.name: [] for t in self._schema.tables}
+    """
+    Load a semicolon-delimited data file into the tables of a schema
+
+    Args:
+
+        batch_size: Number of rows to parse and convert before writing them
+            to the database, which keeps memory use flat regardless of the
+            size of the data file.  When 0 or None, the whole file is parsed
+            before anything is inserted.
+        workers: Number of processes used to parse and convert the data
+            file.  With more than one worker, the file is split into
+            newline-aligned byte ranges that are converted in a process pool
+            and written in file order.  Each range is written as one batch,
+            so batch_size is ignored.
+        queue_size: If set, the data file is read and converted in a
+            background thread while earlier batches are written to the
+            database.  This is the maximum number of converted batches
+            waiting to be written.
+        checkpoint: If True, each batch is committed along with the byte
+            offset in the data file where it ends, in the load_state table,
+            so that a failed load can be resumed.  The data file must be a
+            file on disk.  table_workers and atomic are ignored.  Can't be
+            combined with incremental.
+        resume: If True, continue the last checkpointed load of the same
+            data file, skipping the batches that were already committed for
+            each table.  This implies checkpoint.
+
+    Other keyword arguments are passed to BaseLoader.
+
+    """
+    delimiter = ';'
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE, workers=1,
+            queue_size=None, checkpoint=False, resume=False, **kwargs):
+        super(DelimitedLoader, self).__init__(**kwargs)
+        if self.staging and (checkpoint or resume):
+            raise ValueError("Staged loads can't be checkpointed")
+
+        if self.snapshot and (checkpoint or resume):
+            raise ValueError("Loads from snapshots can't be checkpointed")
+
+        if self.incremental and (checkpoint or resume):
+            raise ValueError("Incremental loads can't be checkpointed")
+
+        self.batch_size = batch_size or None
+        self.workers = workers
+        self.queue_size = queue_size
+        self.checkpoint = checkpoint or resume
+        self.resume = resume
+
+    def get_checkpoint_writer(self, f, connection, tables):
+        path = getattr(f, 'name', None)
+        if path is None or not os.path.isfile(path):
+            raise ValueError("Checkpointed loads need a data file on disk")
+
+        return CheckpointTableWriter(self.get_writer(connection), connection,
+            tables, path, resume=self.resume)
 
-        reader = csv.reader(f, delimiter=';')
-        num_rows = 0
+    def load(self, f, metadata, connection, flush=False):
+        tables = [(tabledef, tabledef.as_sqlalchemy(metadata))
+            for tabledef in self._schema.tables]
+        table_writer = None
+        start = None
+
+        if self.checkpoint:
+            table_writer = self.get_checkpoint_writer(f, connection, tables)
+            start = table_writer.resume_offset
+            if start:
+                logging.info("Resuming load at byte {}".format(start))
+                # Flushing would delete the rows that are being kept
+                flush = False
 
         logging.info("Beginning parsing data file")
 
-        for row in reader:
-            num_rows += 1
-            for tabledef in self._schema.tables:
-                insert_row = self.get_row_values(tabledef, row)
-                table_data[tabledef.name].append(insert_row)
+        if self.snapshot:
+            batches = self.iter_snapshot_batches(f)
+        else:
+            batches = self.iter_batches(f, start=start)
+        if self.queue_size:
+            batches = BatchPipeline(batches, self.queue_size,
+                metrics=self.metrics)
 
-        logging.info("Parsed {} rows".format(num_rows))
+        try:
+            num_rows = self.write_tables(connection, tables, batches,
+                flush=flush, table_writer=table_writer)
+        finally:
+            batches.close()
 
-        for tabledef in self._schema.tables:
-            table = tabledef.as_sqlalchemy(metadata)
+        logging.info("Inserted {} rows into each of {} tables".format(
+            num_rows, len(tables)))
 
-            if flush:
-                logging.info("Deleting existing data from {}".format(tabledef.name))
-                connection.execute(table.delete())
+    def iter_batches(self, f, start=None):
+        """
+        Parse the data file into batches of converted rows
 
-            logging.info("Inserting {} rows into {}".format(
-                len(table_data[tabledef.name]), tabledef.name))
+        Yields a list of rows for each table in the schema, in the same order
+        as the schema's tables.
 
-            insert = table.insert().values(table_data[tabledef.name])
-            connection.execute(insert)
+        If start is specified, the data file is read as bytes from that
+        offset and each batch is a Batch that records where it ends.
 
+        """
+        path = getattr(f, 'name', None)
+        on_disk = path is not None and os.path.isfile(path)
+        encoding = getattr(f, 'encoding', None) or 'utf-8'
 
+        if self.workers > 1:
+            if on_disk:
+                return iter_parallel_batches(self, path, self.workers,
+                    encoding=encoding, start=start or 0)
 
-def get_assessment_loader(year):
-    return DelimitedLoader()
+            logging.warning("Parallel parsing needs a file on disk. "
+                "Parsing in a single process.")
 
+        if start is not None:
+            if not on_disk:
+                raise ValueError("Reading from an offset needs a data file "
+                    "on disk")
 
-def get_report_card_loader(year):
-    return DelimitedLoader()
+            return self.iter_file_batches(path, start, encoding)
+
+        return self.iter_serial_batches(f)
+
+    def iter_file_batches(self, path, start, encoding):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            for batch in self.iter_serial_batches(f, start=start,
+                    encoding=encoding):
+                yield batch
+
+    def iter_serial_batches(self, f, start=None, encoding='utf-8'):
+        """
+        Parse the data file in this process
+
+        If start is specified, f is a binary file positioned at that byte
+        offset and the batches are Batch objects.
+
+        """
+        lines = CountingLines(f)
+        if start is None:
+            reader = csv.reader(lines, delimiter=self.delimiter)
+        else:
+            reader = csv.reader((line.decode(encoding) for line in lines),
+                delimiter=self.delimiter)
+        converters = [self.get_row_converter(t) for t in self._schema.tables]
+
+        while True:
+            timings = {}
+            start_length = lines.length
+            batch = convert_rows(islice(reader, self.batch_size), converters,
+                timings)
+            if not batch or not batch[0]:
+                break
+
+            # The length of text files is counted in characters, which is
+            # the number of bytes for the ASCII data files
+            self.metrics.record('read', seconds=timings['read'],
+                rows=len(batch[0]), bytes=lines.length - start_length)
+            self.metrics.record('convert', seconds=timings['convert'],
+                rows=len(batch[0]))
+
+            if start is not None:
+                batch = Batch(batch, start + lines.length)
+
+            yield batch
+
+
+def get_assessment_loader(year, **kwargs):
+    return get_loader('assessment', year, **kwargs)
+
+
+def get_report_card_loader(year, **kwargs):
+    return get_loader('report_card', year, **kwargs)
+
+
+# Data rows of the participation spreadsheet start with a school's RCDTS
+SCHOOL_ID_RE = re.compile(r'[\dA-Z]{15}')
 
 
 class PARCCParticipationLoader2015(BaseLoader):
@@ -87,15 +448,18 @@ class PARCCParticipationLoader2015(BaseLoader):
         return column_index
 
     @classmethod
-    def get_row_values(cls, tabledef, row):
-        updated_row = []
-
-        for columndef in tabledef.columns:
-            column_index = cls.get_column_index(columndef)
+    def get_column_converter(cls, columndef):
+        if (columndef.name in ("tested_enrollment_ela", "tested_enrollment_math")
+                or columndef.name.startswith("tested_enrollment_masked")):
+            return partial(cls.get_column_value, columndef)
 
-            updated_row.append(cls.get_column_value(columndef, row[column_index]))
+        return compile_converter(columndef)
 
-        return tuple(updated_row)
+    @classmethod
+    def get_row_converter(cls, tabledef):
+        return compile_row_converter(tabledef.columns,
+            indexes=[cls.get_column_index(c) for c in tabledef.columns],
+            converters=[cls.get_column_converter(c) for c in tabledef.columns])
 
     @classmethod
     def get_column_value(cls, column, val):
@@ -128,32 +492,51 @@ class PARCCParticipationLoader2015(BaseLoader):
     def load(self, f, metadata, connection, flush=False):
         tabledef = self._schema.tables[0]
         table = tabledef.as_sqlalchemy(metadata)
+        if self.snapshot:
+            batches = list(self.iter_snapshot_batches(f))
+        else:
+            batches = list(self.iter_batches(f))
+
+        logging.info("Inserting {} rows into {}".format(
+            sum(len(batch[0]) for batch in batches), tabledef.name))
+        self.write_tables(connection, [(tabledef, table)], batches,
+            flush=flush)
 
-        workbook = xlrd.open_workbook(file_contents=f.read())
-        sheet = workbook.sheet_by_index(0)
+    def iter_batches(self, f):
+        """
+        Read and convert the rows of the participation spreadsheet
 
-        data = []
-        for i in range(sheet.nrows):
-            # Extract values from Excel cells so row is just a list of values
-            row = [c.value for c in sheet.row(i)]
-            if re.match(r'[\dA-Z]{15}', row[0]) is None:
-                # Skip header rows
-                continue
+        The spreadsheet is small, so all of its rows are yielded as a single
+        batch, with a list of rows for the schema's one table.
 
-            data.append(self.get_row_values(tabledef, row))
+        """
+        tabledef = self._schema.tables[0]
 
-        if flush:
-            logging.info("Deleting existing data from {}".format(tabledef.name))
-            connection.execute(table.delete())
+        with self.metrics.phase('read') as phase:
+            # Rows are read from the sheet as they're converted, so this only
+            # reads the workbook's list of sheets
+            f.seek(0, os.SEEK_END)
+            phase['bytes'] = f.tell()
+            f.seek(0)
+            workbook = open_workbook(f)
+            sheet = workbook.sheet_by_index(0)
 
-        logging.info("Inserting {} rows into {}".format(
-            len(data), tabledef.name))
-        insert = table.insert().values(data)
-        connection.execute(insert)
+        convert = self.get_row_converter(tabledef)
+        data = []
+        with self.metrics.phase('convert') as phase:
+            for row in sheet.get_rows():
+                # Skip header rows, which don't start with a school ID
+                if (row[0].ctype != XL_CELL_TEXT or
+                        SCHOOL_ID_RE.match(row[0].value) is None):
+                    continue
+
+                # Extract values from Excel cells so row is just a list of values
+                data.append(convert([c.value for c in row]))
+
+            phase['rows'] = len(data)
 
+        yield [data]
 
-def get_parcc_participation_loader(year):
-    if year == 2015:
-        return PARCCParticipationLoader2015()
 
-    raise ValueError("No loader found for {}".format(year))
+def get_parcc_participation_loader(year, **kwargs):
+    return get_loader('parcc_participation', year, **kwargs)
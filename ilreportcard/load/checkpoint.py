@@ -0,0 +1,193 @@
+"""
+Record the progress of a load so that a failed load can be resumed
+
+A checkpointed load writes each batch of rows, and the byte offset in the
+data file where the batch ends, in one transaction.  The offsets are kept in
+a load state table with a row for each data file and table.  When the load
+is resumed, parsing starts at the smallest saved offset and batches that a
+table has already stored are skipped for that table.
+"""
+import datetime
+import logging
+import os
+
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, MetaData,
+    String, Table, and_, select)
+
+from .incremental import clear_row_hashes
+
+
+LOAD_STATE_TABLE_NAME = 'load_state'
+
+
+def get_load_state_table(metadata):
+    return Table(LOAD_STATE_TABLE_NAME, metadata,
+        Column('data_file', String, primary_key=True),
+        Column('table_name', String(63), primary_key=True),
+        Column('file_size', BigInteger, nullable=False),
+        Column('byte_offset', BigInteger, nullable=False),
+        Column('rows', BigInteger, nullable=False),
+        Column('completed', Boolean, nullable=False),
+        Column('updated', DateTime, nullable=False),
+    )
+
+
+class Batch(list):
+    """
+    A list of converted rows for each table that also records the byte
+    offset in the data file just after the batch's last line
+    """
+    def __init__(self, rows, end_offset):
+        super(Batch, self).__init__(rows)
+        self.end_offset = end_offset
+
+
+class CheckpointTableWriter(object):
+    """
+    Write batches of rows to a schema's tables, committing the progress of
+    the load after each batch
+
+    It has the same interface as ilreportcard.load.writers.TableWriter, but
+    each batch written must be a Batch.
+
+    Args:
+
+        writer: Writer used to write the rows for each table.
+        connection: SQLAlchemy connection.
+        tables: List of (tabledef, SQLAlchemy Table) tuples.
+        data_file: Path of the data file being loaded.
+        resume: If True, continue from the progress saved by an earlier
+            load of the same data file.  Otherwise, any saved progress is
+            discarded.
+
+    """
+    def __init__(self, writer, connection, tables, data_file, resume=False):
+        self.writer = writer
+        self.connection = connection
+        self.tables = tables
+        self.data_file = os.path.abspath(data_file)
+        self.resume = resume
+        self.state_table = get_load_state_table(MetaData())
+        self._state = None
+
+    def _where(self, table_name=None):
+        condition = self.state_table.c.data_file == self.data_file
+        if table_name is not None:
+            condition = and_(condition,
+                self.state_table.c.table_name == table_name)
+
+        return condition
+
+    def load_state(self):
+        """Read the saved progress of each table, starting over if needed"""
+        if self._state is not None:
+            return self._state
+
+        self.state_table.create(self.connection, checkfirst=True)
+        file_size = os.path.getsize(self.data_file)
+        state = {}
+
+        if self.resume:
+            for row in self.connection.execute(
+                    select([self.state_table]).where(self._where())):
+                if row['file_size'] != file_size:
+                    logging.warning("{} has changed since it was last "
+                        "loaded.  Starting over.".format(self.data_file))
+                    state = {}
+                    break
+
+                state[row['table_name']] = {
+                    'byte_offset': row['byte_offset'],
+                    'rows': row['rows'],
+                    'completed': row['completed'],
+                }
+
+        missing = [tabledef.name for tabledef, table in self.tables
+            if tabledef.name not in state]
+        if missing:
+            with self.connection.begin():
+                self.connection.execute(self.state_table.delete().where(and_(
+                    self._where(), self.state_table.c.table_name.in_(missing))))
+                self.connection.execute(self.state_table.insert(), [{
+                    'data_file': self.data_file,
+                    'table_name': name,
+                    'file_size': file_size,
+                    'byte_offset': 0,
+                    'rows': 0,
+                    'completed': False,
+                    'updated': datetime.datetime.now(),
+                } for name in missing])
+
+            for name in missing:
+                state[name] = {'byte_offset': 0, 'rows': 0,
+                    'completed': False}
+
+        self._state = state
+        return state
+
+    @property
+    def resume_offset(self):
+        """Byte offset of the data file where parsing should start"""
+        state = self.load_state()
+        return min(state[tabledef.name]['byte_offset']
+            for tabledef, table in self.tables)
+
+    def _update_state(self, table_name, **values):
+        values['updated'] = datetime.datetime.now()
+        self.connection.execute(self.state_table.update()
+            .where(self._where(table_name)).values(**values))
+
+    def open(self):
+        self.load_state()
+
+    def delete(self):
+        """
+        Delete existing rows, and the row hashes of incremental loads, from
+        all tables and reset their progress
+        """
+        for tabledef, table in self.tables:
+            logging.info("Deleting existing data from {}".format(tabledef.name))
+            with self.connection.begin():
+                clear_row_hashes(self.connection, [tabledef.name])
+                with self.writer.metrics.phase('delete', tabledef.name):
+                    self.connection.execute(table.delete())
+
+                self._update_state(tabledef.name, byte_offset=0, rows=0,
+                    completed=False)
+
+            self._state[tabledef.name] = {'byte_offset': 0, 'rows': 0,
+                'completed': False}
+
+    def write(self, batch):
+        with self.connection.begin():
+            for (tabledef, table), rows in zip(self.tables, batch):
+                state = self._state[tabledef.name]
+                if batch.end_offset <= state['byte_offset']:
+                    # Stored by the load being resumed
+                    continue
+
+                logging.debug("Inserting {} rows into {}".format(
+                    len(rows), tabledef.name))
+                self.writer.write(self.connection, table, rows)
+                self._update_state(tabledef.name,
+                    byte_offset=batch.end_offset,
+                    rows=state['rows'] + len(rows))
+
+        # Only update the saved progress once it's committed
+        for (tabledef, table), rows in zip(self.tables, batch):
+            state = self._state[tabledef.name]
+            if batch.end_offset > state['byte_offset']:
+                state['byte_offset'] = batch.end_offset
+                state['rows'] += len(rows)
+
+    def commit(self):
+        with self.connection.begin():
+            for tabledef, table in self.tables:
+                self._update_state(tabledef.name, completed=True)
+                self._state[tabledef.name]['completed'] = True
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
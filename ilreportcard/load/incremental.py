@@ -0,0 +1,234 @@
+"""
+Incrementally update tables with only the rows that changed
+
+ISBE sometimes corrects the data for a few schools after the initial
+release.  Instead of deleting and reloading every row, the incremental table
+writer keeps a hash of each row's contents, keyed on the table name and the
+row's primary key, in a separate table.  When a data file is loaded again,
+only rows whose hash is new or different are deleted and re-inserted.
+Rows that are no longer in the data file can optionally be deleted.
+"""
+import hashlib
+import logging
+
+from sqlalchemy import (Column, MetaData, String, Table, and_, or_,
+    select)
+
+from .writers import chunks
+
+
+ROW_HASHES_TABLE_NAME = 'load_row_hashes'
+
+# Columns used as the key of tables that don't have a primary key defined.
+# The report card layout and the PARCC participation schema mark their
+# school ID column as the primary key, but the assessment tables don't have
+# one, so their rows are identified by their school_id column.
+KEY_COLUMN_NAMES = ('school_id', 'rcdts')
+
+# Number of keys in each DELETE statement
+DELETE_CHUNK_SIZE = 500
+
+
+def get_row_hashes_table(metadata):
+    return Table(ROW_HASHES_TABLE_NAME, metadata,
+        Column('table_name', String(63), primary_key=True),
+        Column('row_key', String, primary_key=True),
+        Column('row_hash', String(40), nullable=False),
+    )
+
+
+def clear_row_hashes(connection, table_names):
+    """
+    Delete the stored row hashes of tables
+
+    Call this whenever tables are emptied or replaced other than by an
+    incremental load, so that the next incremental load doesn't count rows
+    as unchanged when they're no longer in the table.
+
+    """
+    hashes_table = get_row_hashes_table(MetaData())
+    if not hashes_table.exists(connection):
+        return
+
+    connection.execute(hashes_table.delete().where(
+        hashes_table.c.table_name.in_(list(table_names))))
+
+
+def get_key_indexes(tabledef):
+    """Get the positions of the columns that identify a row of a table"""
+    indexes = [i for i, c in enumerate(tabledef.columns) if c.primary_key]
+    if indexes:
+        return indexes
+
+    indexes = [i for i, c in enumerate(tabledef.columns)
+        if c.name in KEY_COLUMN_NAMES]
+    if indexes:
+        return indexes[:1]
+
+    raise ValueError("Table {} has no primary key or {} column".format(
+        tabledef.name, " or ".join(KEY_COLUMN_NAMES)))
+
+
+def get_row_hash(row):
+    return hashlib.sha1(repr(row).encode('utf-8')).hexdigest()
+
+
+class IncrementalTableWriter(object):
+    """
+    Write only new and changed rows to a schema's tables
+
+    The whole update happens in one transaction so the rows and their
+    hashes always agree.  It has the same interface as
+    ilreportcard.load.writers.TableWriter.
+
+    Args:
+
+        writer: Writer used to insert new and changed rows.
+        connection: SQLAlchemy connection.
+        tables: List of (tabledef, SQLAlchemy Table) tuples.
+        delete_missing: If True, rows whose keys aren't in the data file are
+            deleted when the writer is committed.
+
+    After commit(), the counts attribute maps each table name to a
+    dictionary with the number of 'inserted', 'updated', 'unchanged' and
+    'deleted' rows.
+
+    """
+    def __init__(self, writer, connection, tables, delete_missing=False):
+        self.writer = writer
+        self.connection = connection
+        self.tables = tables
+        self.delete_missing = delete_missing
+        self.hashes_table = get_row_hashes_table(MetaData())
+        self.counts = {}
+        self._key_indexes = [get_key_indexes(t) for t, table in tables]
+        self._hashes = {}
+        self._seen = {}
+        self._transaction = None
+
+    def open(self):
+        self.hashes_table.create(self.connection, checkfirst=True)
+        self._transaction = self.connection.begin()
+
+        for tabledef, table in self.tables:
+            rows = self.connection.execute(select([
+                self.hashes_table.c.row_key, self.hashes_table.c.row_hash])
+                .where(self.hashes_table.c.table_name == tabledef.name))
+            self._hashes[tabledef.name] = dict(tuple(row) for row in rows)
+            self._seen[tabledef.name] = set()
+            self.counts[tabledef.name] = {'inserted': 0, 'updated': 0,
+                'unchanged': 0, 'deleted': 0}
+
+    def delete(self):
+        """Delete all rows, and their hashes, from all tables"""
+        for tabledef, table in self.tables:
+            logging.info("Deleting existing data from {}".format(tabledef.name))
+            with self.writer.metrics.phase('delete', tabledef.name):
+                self.connection.execute(table.delete())
+                self.connection.execute(self.hashes_table.delete().where(
+                    self.hashes_table.c.table_name == tabledef.name))
+
+            self._hashes[tabledef.name] = {}
+
+    @classmethod
+    def get_row_key(cls, row, key_indexes):
+        return u'\x1f'.join([u'{}'.format(row[i]) for i in key_indexes])
+
+    def delete_keys(self, tabledef, table, key_indexes, keys):
+        """Delete rows, and their hashes, by key"""
+        key_columns = [table.columns[tabledef.columns[i].name]
+            for i in key_indexes]
+
+        for chunk in chunks(list(keys), DELETE_CHUNK_SIZE):
+            if len(key_columns) == 1:
+                condition = key_columns[0].in_(
+                    [values[0] for values in chunk])
+            else:
+                condition = or_(*[and_(*[c == v
+                    for c, v in zip(key_columns, values)])
+                    for values in chunk])
+
+            with self.writer.metrics.phase('delete', tabledef.name,
+                    rows=len(chunk)):
+                self.connection.execute(table.delete().where(condition))
+                self.connection.execute(self.hashes_table.delete().where(and_(
+                    self.hashes_table.c.table_name == tabledef.name,
+                    self.hashes_table.c.row_key.in_([self.get_row_key(values,
+                        range(len(key_columns))) for values in chunk]))))
+
+    def write(self, batch):
+        for (tabledef, table), key_indexes, rows in zip(self.tables,
+                self._key_indexes, batch):
+            hashes = self._hashes[tabledef.name]
+            seen = self._seen[tabledef.name]
+            counts = self.counts[tabledef.name]
+            changed_rows = []
+            changed_keys = []
+            new_hashes = []
+
+            for row in rows:
+                key = self.get_row_key(row, key_indexes)
+                row_hash = get_row_hash(row)
+                seen.add(key)
+                old_hash = hashes.get(key)
+
+                if old_hash == row_hash:
+                    counts['unchanged'] += 1
+                    continue
+
+                if old_hash is None:
+                    counts['inserted'] += 1
+                else:
+                    counts['updated'] += 1
+
+                changed_rows.append(row)
+                changed_keys.append(tuple(row[i] for i in key_indexes))
+                new_hashes.append({'table_name': tabledef.name,
+                    'row_key': key, 'row_hash': row_hash})
+                hashes[key] = row_hash
+
+            if not changed_rows:
+                continue
+
+            # Rows without a hash might still be in the table, for example
+            # if it was last loaded without hashes, so delete them as well
+            self.delete_keys(tabledef, table, key_indexes, changed_keys)
+            self.writer.write(self.connection, table, changed_rows)
+            self.connection.execute(self.hashes_table.insert(), new_hashes)
+
+    def commit(self):
+        if self.delete_missing:
+            for (tabledef, table), key_indexes in zip(self.tables,
+                    self._key_indexes):
+                missing = [key for key in self._hashes[tabledef.name]
+                    if key not in self._seen[tabledef.name]]
+                if not missing:
+                    continue
+
+                # Keys are stored as text, with the values of multiple
+                # column keys joined by a separator, so split them back into
+                # one value for each key column
+                if len(key_indexes) > 1:
+                    missing_keys = [tuple(key.split(u'\x1f'))
+                        for key in missing]
+                else:
+                    missing_keys = [(key,) for key in missing]
+
+                self.delete_keys(tabledef, table, key_indexes, missing_keys)
+                self.counts[tabledef.name]['deleted'] += len(missing)
+
+        self._transaction.commit()
+        self._transaction = None
+
+        for tabledef, table in self.tables:
+            logging.info("{}: {inserted} inserted, {updated} updated, "
+                "{unchanged} unchanged, {deleted} deleted".format(
+                    tabledef.name, **self.counts[tabledef.name]))
+
+    def rollback(self):
+        if self._transaction is not None:
+            self._transaction.rollback()
+            self._transaction = None
+
+    def close(self):
+        self.rollback()
@@ -0,0 +1,78 @@
+"""
+Build a schema's secondary indexes and update table statistics
+
+Inserting rows into a table is slower the more indexes it has, so the
+secondary indexes declared by schema classes (see
+ilreportcard.schema.Index) are dropped before a table is reloaded and built
+once the data is in.  The tables are then analyzed so that the first queries
+after a load get good plans.
+"""
+import hashlib
+import logging
+
+
+# PostgreSQL truncates longer identifiers
+MAX_IDENTIFIER_LENGTH = 63
+
+
+def get_index_name(table_name, index):
+    name = '{}_{}_idx'.format(table_name, index.name)
+    if len(name) <= MAX_IDENTIFIER_LENGTH:
+        return name
+
+    # Keep long names unique after shortening them
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]
+    return '{}_{}'.format(name[:MAX_IDENTIFIER_LENGTH - 9], digest)
+
+
+def get_create_index_sql(connection, table_name, index):
+    quote = connection.dialect.identifier_preparer.quote
+    if index.expression:
+        indexed = index.expression
+    else:
+        indexed = ", ".join(quote(c) for c in index.columns)
+
+    return "CREATE {}INDEX IF NOT EXISTS {} ON {} ({})".format(
+        "UNIQUE " if index.unique else "",
+        quote(get_index_name(table_name, index)),
+        quote(table_name), indexed)
+
+
+def create_indexes(connection, indexes, table_names=None):
+    """
+    Create secondary indexes that don't already exist
+
+    Args:
+
+        connection: SQLAlchemy connection.
+        indexes: List of (tabledef, Index) tuples, like the ones returned by
+            a schema's get_indexes() method.
+        table_names: Optional dictionary mapping table definition names to
+            the names of the database tables the indexes are created on.
+
+    """
+    table_names = table_names or {}
+    for tabledef, index in indexes:
+        table_name = table_names.get(tabledef.name, tabledef.name)
+        logging.info("Creating index {} on {}".format(index.name, table_name))
+        connection.execute(get_create_index_sql(connection, table_name,
+            index))
+
+
+def drop_indexes(connection, indexes):
+    """Drop secondary indexes, before reloading their tables"""
+    quote = connection.dialect.identifier_preparer.quote
+    for tabledef, index in indexes:
+        connection.execute("DROP INDEX IF EXISTS {}".format(
+            quote(get_index_name(tabledef.name, index))))
+
+
+def analyze_tables(connection, table_names):
+    quote = connection.dialect.identifier_preparer.quote
+    # SQLAlchemy doesn't commit ANALYZE by itself, so without a transaction
+    # the statistics would be rolled back when the connection is returned
+    # to the pool
+    with connection.begin():
+        for table_name in table_names:
+            logging.info("Analyzing {}".format(table_name))
+            connection.execute("ANALYZE {}".format(quote(table_name)))
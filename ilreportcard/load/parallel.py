@@ -0,0 +1,173 @@
+"""
+Parse and convert delimited data files in a pool of worker processes
+
+The data file is split into byte ranges that start and end on line
+boundaries.  Each worker reads its range straight from the file, parses it
+and converts the rows with the loader's row converters, so only the converted
+rows are sent back to the parent process.
+
+This assumes that no field in the data file contains a newline, which is
+true of the report card data files.
+"""
+from collections import deque
+import csv
+import io
+import multiprocessing
+import os
+import time
+
+from .checkpoint import Batch
+
+# Bounds on the size of the byte range handed to a worker at a time
+MIN_CHUNK_SIZE = 1024 * 1024
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Number of ranges each worker is given over the course of a load.  More,
+# smaller ranges keep workers busy when some ranges parse slower than others.
+CHUNKS_PER_WORKER = 4
+
+
+def split_byte_ranges(f, chunk_size, start=0):
+    """
+    Split a binary file into (start, end) byte ranges of about chunk_size
+    bytes that begin at the start of a line and end after a newline
+
+    The first range begins at start, which must be the start of a line.
+
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    ranges = []
+
+    while start < size:
+        f.seek(min(start + chunk_size, size))
+        # Move to the start of the next line
+        f.readline()
+        end = min(f.tell(), size)
+        ranges.append((start, end))
+        start = end
+
+    return ranges
+
+
+def get_chunk_size(size, workers):
+    chunk_size = size // (workers * CHUNKS_PER_WORKER) + 1
+    return max(MIN_CHUNK_SIZE, min(chunk_size, MAX_CHUNK_SIZE))
+
+
+def convert_rows(reader, converters, timings):
+    """
+    Convert parsed rows into a list of converted rows for each converter
+
+    The seconds spent reading rows and converting them are added to the
+    'read' and 'convert' values of the timings dictionary.
+
+    """
+    batch = [[] for convert in converters]
+    clock = time.time
+    read_seconds = 0.0
+    convert_seconds = 0.0
+
+    start = clock()
+    for row in reader:
+        converting = clock()
+        read_seconds += converting - start
+
+        for rows, convert in zip(batch, converters):
+            rows.append(convert(row))
+
+        start = clock()
+        convert_seconds += start - converting
+
+    read_seconds += clock() - start
+
+    timings['read'] = timings.get('read', 0.0) + read_seconds
+    timings['convert'] = timings.get('convert', 0.0) + convert_seconds
+
+    return batch
+
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def _init_worker(loader, path, encoding):
+    _worker['path'] = path
+    _worker['encoding'] = encoding
+    _worker['delimiter'] = loader.delimiter
+    _worker['converters'] = [loader.get_row_converter(t)
+        for t in loader._schema.tables]
+
+
+def _convert_range(byte_range):
+    start, end = byte_range
+    read_start = time.time()
+
+    with open(_worker['path'], 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    timings = {'read': time.time() - read_start}
+    text = io.TextIOWrapper(io.BytesIO(data), encoding=_worker['encoding'],
+        newline='')
+    reader = csv.reader(text, delimiter=_worker['delimiter'])
+    batch = convert_rows(reader, _worker['converters'], timings)
+    return batch, timings, len(data)
+
+
+def iter_parallel_batches(loader, path, workers, encoding=None,
+        chunk_size=None, start=0):
+    """
+    Parse a delimited data file in a pool of worker processes
+
+    Yields a Batch with a list of converted rows for each of the loader's
+    schema's tables, for each byte range of the file, in file order.
+    Parsing begins at the start byte offset.  At most twice as
+    many ranges as there are workers are in flight at once, so converted rows
+    don't pile up in memory when the database can't keep up.
+
+    The size of the byte ranges is picked based on the size of the file and
+    the number of workers unless chunk_size is specified.
+
+    """
+    with open(path, 'rb') as f:
+        if chunk_size is None:
+            f.seek(0, os.SEEK_END)
+            chunk_size = get_chunk_size(f.tell(), workers)
+
+        ranges = split_byte_ranges(f, chunk_size, start)
+
+    pool = multiprocessing.Pool(workers, initializer=_init_worker,
+        initargs=(loader, path, encoding or 'utf-8'))
+    try:
+        pending = deque()
+        ranges = iter(ranges)
+
+        def submit():
+            byte_range = next(ranges, None)
+            if byte_range is not None:
+                pending.append((byte_range[1],
+                    pool.apply_async(_convert_range, (byte_range,))))
+
+        for i in range(workers * 2):
+            submit()
+
+        while pending:
+            end, result = pending.popleft()
+            batch, timings, num_bytes = result.get()
+            submit()
+
+            # These are the times spent in the worker processes, which
+            # overlap each other
+            num_rows = len(batch[0]) if batch else 0
+            loader.metrics.record('read', seconds=timings['read'],
+                rows=num_rows, bytes=num_bytes)
+            loader.metrics.record('convert', seconds=timings['convert'],
+                rows=num_rows)
+
+            yield Batch(batch, end)
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,122 @@
+"""
+Overlap parsing a data file with writing it to the database
+
+BatchPipeline runs the loader's reading and converting in a background
+thread that puts converted batches on a bounded queue while the loader
+writes the batches it has already received.  When the queue is full, the
+reader waits for the writer, so at most a fixed number of converted batches
+are held in memory.
+"""
+import threading
+import time
+
+try:
+    from queue import Queue, Full, Empty
+except ImportError:
+    # Python 2
+    from Queue import Queue, Full, Empty
+
+
+# How often a blocked stage checks whether the other stage has stopped
+POLL_SECONDS = 0.1
+
+
+class _Done(object):
+    """Marks the end of the batches, with the reader's error if it failed"""
+    def __init__(self, error=None):
+        self.error = error
+
+
+class BatchPipeline(object):
+    """
+    Iterate over batches that are produced in a background thread
+
+    Args:
+
+        batches: Iterable of batches.  It is consumed in a separate thread.
+        queue_size: Maximum number of batches waiting to be written.
+        metrics: Optional LoadMetrics object.  The time the reader spends
+            waiting for room in the queue is recorded as the 'reader_wait'
+            phase and the time the writer spends waiting for batches as the
+            'writer_wait' phase.
+
+    An error while producing batches is raised in the thread iterating over
+    the pipeline.  If iteration stops early, because of an error writing
+    batches for example, close() stops the reader thread.
+
+    """
+    def __init__(self, batches, queue_size, metrics=None):
+        self._batches = batches
+        self._queue = Queue(maxsize=queue_size)
+        self._stopped = threading.Event()
+        self._thread = None
+        self.metrics = metrics
+
+    def _record(self, phase, seconds):
+        if self.metrics is not None:
+            self.metrics.record(phase, seconds=seconds)
+
+    def _put(self, item):
+        """Put an item on the queue unless the pipeline is closed first"""
+        start = time.time()
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=POLL_SECONDS)
+                break
+            except Full:
+                continue
+
+        self._record('reader_wait', time.time() - start)
+
+    def _produce(self):
+        try:
+            for batch in self._batches:
+                if self._stopped.is_set():
+                    break
+
+                self._put(batch)
+        except Exception as e:
+            self._put(_Done(e))
+        else:
+            self._put(_Done())
+        finally:
+            close = getattr(self._batches, 'close', None)
+            if close is not None:
+                close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._produce,
+            name='BatchPipeline')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        if self._thread is None:
+            self.start()
+
+        while True:
+            start = time.time()
+            item = self._queue.get()
+            self._record('writer_wait', time.time() - start)
+
+            if isinstance(item, _Done):
+                self._thread.join()
+                if item.error is not None:
+                    raise item.error
+
+                return
+
+            yield item
+
+    def close(self):
+        """Stop the reader thread and discard any batches it produced"""
+        self._stopped.set()
+
+        while self._thread is not None and self._thread.is_alive():
+            try:
+                self._queue.get(timeout=POLL_SECONDS)
+            except Empty:
+                pass
+
+        if self._thread is not None:
+            self._thread.join()
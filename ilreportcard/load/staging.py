@@ -0,0 +1,194 @@
+"""
+Load tables under staging names and swap them in when they're ready
+
+Flushing a table deletes its rows before the new rows are inserted, so
+queries made during a reload see an empty or partly loaded table and wait
+on the locks taken by the delete.  A staged load instead writes the data to
+a copy of each table named "<table>__staging".  Once every table is loaded,
+its primary key and secondary indexes are built and it is analyzed, and then
+all of the tables are renamed in a single transaction.  Readers see the old
+data until that transaction commits and the new data after it.
+
+On PostgreSQL, materialized views that select from the tables, like the
+summary views, would keep the old tables from being dropped.  They're
+dropped before the swap and created again from the new tables in the same
+transaction.
+"""
+import logging
+
+from sqlalchemy import MetaData
+from sqlalchemy.sql import text
+
+from .incremental import clear_row_hashes
+from .indexes import analyze_tables, create_indexes, get_index_name
+
+
+STAGING_SUFFIX = '__staging'
+OLD_SUFFIX = '__old'
+
+
+def get_staging_name(name):
+    return name + STAGING_SUFFIX
+
+
+class StagedTables(object):
+    """
+    Staging copies of a schema's tables
+
+    Args:
+
+        connection: SQLAlchemy connection.
+        tables: List of (tabledef, SQLAlchemy Table) tuples for the tables
+            that will be replaced.
+        indexes: Optional list of (tabledef, Index) tuples for the
+            secondary indexes of the tables.
+
+    On PostgreSQL, the staging tables are created without primary keys,
+    which are added after the data is loaded, since building an index once
+    is faster than updating it for every row.  Other databases can't add a
+    primary key to an existing table, so it is created with the table.
+    They also can't rename indexes, so secondary indexes are built after the
+    tables are swapped in.
+
+    """
+    def __init__(self, connection, tables, indexes=None):
+        self.connection = connection
+        self.tables = tables
+        table_names = set(tabledef.name for tabledef, table in tables)
+        self.indexes = [(tabledef, index) for tabledef, index in indexes or []
+            if tabledef.name in table_names]
+        self.is_postgresql = connection.dialect.name == 'postgresql'
+        metadata = MetaData()
+        self.staging_tables = [(tabledef, tabledef.as_sqlalchemy(metadata,
+                name=get_staging_name(tabledef.name),
+                primary_key=not self.is_postgresql))
+            for tabledef, table in tables]
+
+    def execute(self, sql):
+        logging.debug(sql)
+        self.connection.execute(sql)
+
+    def quote(self, name):
+        return self.connection.dialect.identifier_preparer.quote(name)
+
+    def create(self):
+        """Create empty staging tables, replacing any left by a failed load"""
+        for tabledef, table in self.staging_tables:
+            logging.info("Creating staging table {}".format(table.name))
+            table.drop(self.connection, checkfirst=True)
+            table.create(self.connection)
+
+    def drop(self):
+        for tabledef, table in self.staging_tables:
+            table.drop(self.connection, checkfirst=True)
+
+    def finish(self):
+        """Build the staging tables' indexes and update statistics"""
+        for tabledef, table in self.staging_tables:
+            key_columns = [c.name for c in tabledef.columns if c.primary_key]
+            if self.is_postgresql and key_columns:
+                logging.info("Adding primary key to {}".format(table.name))
+                self.execute("ALTER TABLE {} ADD CONSTRAINT {} "
+                    "PRIMARY KEY ({})".format(self.quote(table.name),
+                        self.quote(table.name + '_pkey'),
+                        ", ".join(self.quote(c) for c in key_columns)))
+
+        if self.is_postgresql:
+            create_indexes(self.connection, self.indexes, table_names={
+                tabledef.name: table.name
+                for tabledef, table in self.staging_tables})
+
+        analyze_tables(self.connection,
+            [table.name for tabledef, table in self.staging_tables])
+
+    def rename_index(self, old_name, new_name):
+        self.execute("ALTER INDEX IF EXISTS {} RENAME TO {}".format(
+            self.quote(old_name), self.quote(new_name)))
+
+    def rename_table(self, tabledef, old_name, new_name):
+        self.execute("ALTER TABLE {} RENAME TO {}".format(self.quote(old_name),
+            self.quote(new_name)))
+
+        if not self.is_postgresql:
+            return
+
+        # Renaming a primary key's index renames the constraint too, so
+        # the next staging table can use the staging constraint name
+        self.rename_index(old_name + '_pkey', new_name + '_pkey')
+
+        for index_tabledef, index in self.indexes:
+            if index_tabledef is tabledef:
+                self.rename_index(get_index_name(old_name, index),
+                    get_index_name(new_name, index))
+
+    def get_dependent_views(self):
+        """
+        Get the materialized views that select from the tables
+
+        Returns a list of (name, definition, index definitions) tuples.
+
+        """
+        rows = self.connection.execute(text("""
+            SELECT DISTINCT v.oid, v.relname, pg_get_viewdef(v.oid)
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            JOIN pg_class v ON v.oid = r.ev_class
+            WHERE d.classid = CAST('pg_rewrite' AS regclass)
+            AND v.relkind = 'm'
+            AND d.refobjid IN (SELECT to_regclass(name)
+                FROM unnest(CAST(:tables AS text[])) AS t(name))
+        """), tables=[tabledef.name for tabledef, table in self.tables])
+
+        views = []
+        for oid, name, definition in rows.fetchall():
+            indexes = [row[0] for row in self.connection.execute(text(
+                "SELECT pg_get_indexdef(indexrelid) FROM pg_index "
+                "WHERE indrelid = :oid"), oid=oid)]
+            views.append((name, definition.strip().rstrip(';'), indexes))
+
+        return views
+
+    def create_view(self, name, definition, indexes):
+        logging.info("Creating materialized view {}".format(name))
+        self.execute("CREATE MATERIALIZED VIEW {} AS {}".format(
+            self.quote(name), definition))
+        for index in indexes:
+            self.execute(index)
+
+        self.execute("ANALYZE {}".format(self.quote(name)))
+
+    def swap(self):
+        """Replace the tables with the staging tables in one transaction"""
+        with self.connection.begin():
+            views = []
+            if self.is_postgresql:
+                views = self.get_dependent_views()
+
+            for name, definition, indexes in views:
+                self.execute("DROP MATERIALIZED VIEW {}".format(
+                    self.quote(name)))
+
+            for (tabledef, table), (tabledef, staging_table) in zip(
+                    self.tables, self.staging_tables):
+                old_name = tabledef.name + OLD_SUFFIX
+                if table.exists(self.connection):
+                    self.rename_table(tabledef, tabledef.name, old_name)
+
+                self.rename_table(tabledef, staging_table.name, tabledef.name)
+
+            for tabledef, table in self.tables:
+                self.execute("DROP TABLE IF EXISTS {}".format(
+                    self.quote(tabledef.name + OLD_SUFFIX)))
+
+            clear_row_hashes(self.connection,
+                [tabledef.name for tabledef, table in self.tables])
+
+            # The definitions name the tables, so the views select from
+            # the tables that were just swapped in
+            for name, definition, indexes in views:
+                self.create_view(name, definition, indexes)
+
+            if not self.is_postgresql:
+                create_indexes(self.connection, self.indexes)
+
+        logging.info("Swapped in {} staging tables".format(len(self.tables)))
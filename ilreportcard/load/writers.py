@@ -0,0 +1,409 @@
+"""
+Strategies for writing converted rows to a database table
+
+Each writer takes an SQLAlchemy connection, an SQLAlchemy Table and a list
+of row tuples whose values are in the same order as the table's columns.
+
+Table writers use one of these writers to write batches of rows to all of
+a schema's tables, either one table after another over a single connection
+or concurrently over several pooled connections.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import io
+import logging
+import numbers
+
+from ilreportcard.compat import text_type
+from ilreportcard.metrics import LoadMetrics
+
+
+# Number of rows sent in each executemany call
+DEFAULT_CHUNK_SIZE = 1000
+
+# Most bind parameters a statement can have, for dialects that limit them.
+# SQLite's limit is 999 before version 3.32.
+MAX_BIND_PARAMETERS = {
+    'sqlite': 999,
+    'mssql': 2100,
+}
+
+
+def chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+class BaseWriter(object):
+    """
+    Base class for writers
+
+    Args:
+
+        metrics: LoadMetrics object that records the time spent compiling
+            and executing statements for each table.
+
+    """
+    def __init__(self, metrics=None):
+        self.metrics = metrics if metrics is not None else LoadMetrics()
+
+
+class ValuesWriter(BaseWriter):
+    """
+    Insert rows with a single multi-row INSERT ... VALUES statement
+
+    This is how the loaders originally wrote rows.  SQLAlchemy has to compile
+    one enormous statement, so it is slow for large numbers of rows.  On
+    databases that limit the number of bind parameters in a statement, the
+    rows are split into as few statements as the limit allows.
+
+    """
+    name = 'values'
+
+    @classmethod
+    def get_chunk_size(cls, connection, table, num_rows):
+        """Get the number of rows that can be inserted by one statement"""
+        limit = MAX_BIND_PARAMETERS.get(connection.dialect.name)
+        if limit is None:
+            return num_rows
+
+        return max(1, limit // len(table.columns))
+
+    def write(self, connection, table, rows):
+        if not rows:
+            return
+
+        for chunk in chunks(rows, self.get_chunk_size(connection, table,
+                len(rows))):
+            with self.metrics.phase('compile', table.name, rows=len(chunk)):
+                compiled = table.insert().values(chunk).compile(
+                    dialect=connection.dialect)
+
+            with self.metrics.phase('insert', table.name, rows=len(chunk)):
+                connection.execute(compiled)
+
+
+class ExecuteManyWriter(BaseWriter):
+    """Insert rows with the DB-API's executemany, a chunk of rows at a time"""
+    name = 'executemany'
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+        super(ExecuteManyWriter, self).__init__(**kwargs)
+        self.chunk_size = chunk_size
+
+    def write(self, connection, table, rows):
+        names = [c.name for c in table.columns]
+
+        with self.metrics.phase('compile', table.name):
+            compiled = table.insert().compile(dialect=connection.dialect)
+
+        for chunk in chunks(rows, self.chunk_size):
+            with self.metrics.phase('insert', table.name, rows=len(chunk)):
+                connection.execute(compiled,
+                    [dict(zip(names, row)) for row in chunk])
+
+
+def format_copy_value(value):
+    """
+    Format a Python value for PostgreSQL's COPY text format
+
+    The result is always text, so that the rows can be written to an
+    io.StringIO on Python 2.
+
+    """
+    if value is None:
+        return u'\\N'
+
+    if isinstance(value, bool):
+        return u't' if value else u'f'
+
+    if isinstance(value, float):
+        return text_type(repr(value))
+
+    if isinstance(value, numbers.Integral):
+        return text_type(value)
+
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    elif not isinstance(value, text_type):
+        value = text_type(value)
+
+    return (value.replace(u'\\', u'\\\\')
+        .replace(u'\t', u'\\t')
+        .replace(u'\n', u'\\n')
+        .replace(u'\r', u'\\r'))
+
+
+class CopyWriter(BaseWriter):
+    """
+    Bulk load rows with PostgreSQL's COPY ... FROM STDIN
+
+    Rows are serialized to an in-memory buffer in COPY's text format and
+    streamed to the server through psycopg2's copy_expert.
+
+    """
+    name = 'copy'
+
+    @classmethod
+    def supports(cls, connection):
+        return connection.dialect.driver == 'psycopg2'
+
+    @classmethod
+    def get_copy_sql(cls, connection, table):
+        preparer = connection.dialect.identifier_preparer
+        return "COPY {} ({}) FROM STDIN".format(
+            preparer.format_table(table),
+            ", ".join(preparer.quote(c.name) for c in table.columns))
+
+    @classmethod
+    def get_buffer(cls, rows):
+        buf = io.StringIO()
+        for row in rows:
+            buf.write(u'\t'.join([format_copy_value(v) for v in row]))
+            buf.write(u'\n')
+
+        buf.seek(0)
+        return buf
+
+    def write(self, connection, table, rows):
+        if not rows:
+            return
+
+        with self.metrics.phase('compile', table.name, rows=len(rows)) as phase:
+            sql = self.get_copy_sql(connection, table)
+            buf = self.get_buffer(rows)
+            phase['bytes'] = len(buf.getvalue())
+
+        dbapi_connection = connection.connection
+        cursor = dbapi_connection.cursor()
+        try:
+            with self.metrics.phase('insert', table.name, rows=len(rows)):
+                cursor.copy_expert(sql, buf)
+        finally:
+            cursor.close()
+
+        # SQLAlchemy autocommits the INSERT statements it executes outside of
+        # a transaction.  Do the same for COPY, which goes around SQLAlchemy.
+        if not connection.in_transaction():
+            dbapi_connection.commit()
+
+
+WRITERS = {
+    ValuesWriter.name: ValuesWriter,
+    ExecuteManyWriter.name: ExecuteManyWriter,
+    CopyWriter.name: CopyWriter,
+}
+
+DEFAULT_ENGINE = CopyWriter.name
+
+
+def get_writer(engine, connection, metrics=None):
+    """
+    Get a writer for the named load engine
+
+    Falls back to chunked executemany when COPY is requested but the
+    connection's database doesn't support it, for example SQLite.
+
+    """
+    try:
+        writer_cls = WRITERS[engine]
+    except KeyError:
+        raise ValueError("Unknown load engine '{}'. Expected one of {}".format(
+            engine, ", ".join(sorted(WRITERS.keys()))))
+
+    if writer_cls is CopyWriter and not CopyWriter.supports(connection):
+        logging.info("COPY is not supported by the {} dialect. "
+            "Falling back to executemany".format(connection.dialect.name))
+        writer_cls = ExecuteManyWriter
+
+    return writer_cls(metrics=metrics)
+
+
+class TableWriter(object):
+    """
+    Write batches of rows to a schema's tables over a single connection
+
+    Args:
+
+        writer: Writer used to write the rows for each table.
+        connection: SQLAlchemy connection.
+        tables: List of (tabledef, SQLAlchemy Table) tuples.
+        atomic: If True, the whole load happens in a single transaction
+            that is committed by commit(). Otherwise each statement is
+            committed as it is executed.
+
+    """
+    def __init__(self, writer, connection, tables, atomic=False):
+        self.writer = writer
+        self.connection = connection
+        self.tables = tables
+        self.atomic = atomic
+        self._transaction = None
+
+    def open(self):
+        if self.atomic:
+            self._transaction = self.connection.begin()
+
+    def delete(self):
+        """
+        Delete existing rows, and the row hashes of incremental loads, from
+        all tables
+        """
+        # The incremental module imports this one
+        from .incremental import clear_row_hashes
+
+        # In the same transaction as the rows, when the load is atomic.
+        # This goes first because checking whether the hashes table exists
+        # commits the transaction with Python 2's sqlite3.
+        clear_row_hashes(self.connection,
+            [tabledef.name for tabledef, table in self.tables])
+
+        for tabledef, table in self.tables:
+            logging.info("Deleting existing data from {}".format(tabledef.name))
+            with self.writer.metrics.phase('delete', tabledef.name):
+                self.connection.execute(table.delete())
+
+    def write(self, batch):
+        """Write a list of rows for each table, in the order of the tables"""
+        for (tabledef, table), rows in zip(self.tables, batch):
+            logging.debug("Inserting {} rows into {}".format(
+                len(rows), tabledef.name))
+            self.writer.write(self.connection, table, rows)
+
+    def commit(self):
+        if self._transaction is not None:
+            self._transaction.commit()
+            self._transaction = None
+
+    def rollback(self):
+        if self._transaction is not None:
+            self._transaction.rollback()
+            self._transaction = None
+
+    def close(self):
+        self.rollback()
+
+
+class ConcurrentTableWriter(object):
+    """
+    Write batches of rows to a schema's tables concurrently
+
+    The tables are split into groups, one for each worker thread.  Each group
+    is written over its own connection checked out from the engine's pool, so
+    the engine's pool needs to allow at least that many connections.  Each
+    table is always written over the same connection, so deleting and
+    re-inserting a table's rows never waits on locks held by another
+    connection of the same load.
+
+    Args:
+
+        writer: Writer used to write the rows for each table.
+        engine: SQLAlchemy engine used to check out connections.
+        tables: List of (tabledef, SQLAlchemy Table) tuples.
+        workers: Maximum number of tables written at the same time.
+        atomic: If True, each connection writes inside a two-phase
+            transaction.  commit() only commits once every connection has
+            prepared its transaction, so either all of the tables are loaded
+            or none of them are.  In PostgreSQL, this requires
+            max_prepared_transactions to be at least the number of workers.
+
+    """
+    def __init__(self, writer, engine, tables, workers, atomic=False):
+        self.writer = writer
+        self.engine = engine
+        self.atomic = atomic
+        self.workers = min(workers, len(tables))
+        self._groups = self.get_groups(tables, self.workers)
+        self._connections = []
+        self._transactions = []
+        self._executor = None
+
+    @classmethod
+    def get_groups(cls, tables, num_groups):
+        """
+        Split tables into groups with about the same number of columns
+
+        Returns a list of lists of (index, tabledef, table) tuples, where
+        index is the position of the table in the batches being written.
+
+        """
+        groups = [[] for i in range(num_groups)]
+        sizes = [0] * num_groups
+        by_size = sorted(enumerate(tables),
+            key=lambda t: len(t[1][0].columns), reverse=True)
+
+        for i, (tabledef, table) in by_size:
+            smallest = sizes.index(min(sizes))
+            groups[smallest].append((i, tabledef, table))
+            sizes[smallest] += len(tabledef.columns)
+
+        return groups
+
+    def open(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.workers)
+        for group in self._groups:
+            connection = self.engine.connect()
+            self._connections.append(connection)
+            if self.atomic:
+                self._transactions.append(connection.begin_twophase())
+
+    def _run(self, fn):
+        futures = [self._executor.submit(fn, connection, group)
+            for connection, group in zip(self._connections, self._groups)]
+
+        # Wait for all the groups before raising an error, so no connection
+        # is still in use when the caller rolls back
+        errors = [f.exception() for f in futures]
+        for error in errors:
+            if error is not None:
+                raise error
+
+    def delete(self):
+        from .incremental import clear_row_hashes
+
+        def delete_group(connection, group):
+            # Before the rows, as in TableWriter.delete()
+            clear_row_hashes(connection,
+                [tabledef.name for i, tabledef, table in group])
+
+            for i, tabledef, table in group:
+                logging.info("Deleting existing data from {}".format(
+                    tabledef.name))
+                with self.writer.metrics.phase('delete', tabledef.name):
+                    connection.execute(table.delete())
+
+        self._run(delete_group)
+
+    def write(self, batch):
+        def write_group(connection, group):
+            for i, tabledef, table in group:
+                logging.debug("Inserting {} rows into {}".format(
+                    len(batch[i]), tabledef.name))
+                self.writer.write(connection, table, batch[i])
+
+        self._run(write_group)
+
+    def commit(self):
+        for transaction in self._transactions:
+            transaction.prepare()
+
+        for transaction in self._transactions:
+            transaction.commit()
+
+        self._transactions = []
+
+    def rollback(self):
+        for transaction in self._transactions:
+            transaction.rollback()
+
+        self._transactions = []
+
+    def close(self):
+        self.rollback()
+
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
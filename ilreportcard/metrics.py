@@ -0,0 +1,185 @@
+"""
+Instrumentation for the phases of a data load
+
+A LoadMetrics object collects the wall time, rows, bytes and peak memory of
+each phase of a load, optionally broken down by table:
+
+* schema: parsing the record layout
+* read: reading and splitting lines of the data file
+* convert: converting raw values to Python values
+* delete: deleting existing rows when flushing tables
+* compile: building SQL statements and the data sent with them
+* insert: executing the statements
+
+The totals can be written out as a JSON record, and callbacks registered
+with LoadMetrics are called with every measurement as it is recorded.
+"""
+from contextlib import contextmanager
+import json
+import resource
+import sys
+import threading
+import time
+
+
+def get_peak_rss():
+    """Get the peak resident set size of this process, in bytes"""
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return maxrss
+
+    # Kilobytes everywhere else
+    return maxrss * 1024
+
+
+class PhaseMetrics(object):
+    """Running totals for one phase, or one phase of one table"""
+    def __init__(self, phase, table=None):
+        self.phase = phase
+        self.table = table
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.peak_rss = 0
+
+    def add(self, seconds, rows=0, bytes=0, peak_rss=0):
+        self.calls += 1
+        self.seconds += seconds
+        self.rows += rows
+        self.bytes += bytes
+        self.peak_rss = max(self.peak_rss, peak_rss)
+
+    @property
+    def rows_per_second(self):
+        if not self.seconds:
+            return None
+
+        return self.rows / self.seconds
+
+    def as_dict(self):
+        return {
+            'phase': self.phase,
+            'table': self.table,
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'rows': self.rows,
+            'bytes': self.bytes,
+            'rows_per_second': self.rows_per_second,
+            'peak_rss_bytes': self.peak_rss,
+        }
+
+
+class LoadMetrics(object):
+    """
+    Collect measurements of the phases of a load
+
+    Args:
+
+        callbacks: Optional list of functions that are called with a
+            dictionary describing each measurement as it is recorded.  The
+            dictionary has 'phase', 'table', 'seconds', 'rows', 'bytes' and
+            'peak_rss_bytes' keys.
+        context: Optional dictionary of information about the load, like the
+            year and data file, included in the JSON record.
+
+    Measurements can be recorded from several threads at once.
+
+    """
+    def __init__(self, callbacks=None, context=None):
+        self.callbacks = list(callbacks or [])
+        self.context = dict(context or {})
+        self.started = time.time()
+        self._phases = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # Locks and callbacks can't be pickled.  Loaders, and so their
+        # metrics, are pickled to send them to worker processes.
+        state = self.__dict__.copy()
+        state['callbacks'] = []
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+
+    def record(self, phase, table=None, seconds=0.0, rows=0, bytes=0):
+        peak_rss = get_peak_rss()
+
+        with self._lock:
+            try:
+                metrics = self._phases[(phase, table)]
+            except KeyError:
+                metrics = self._phases[(phase, table)] = PhaseMetrics(phase,
+                    table)
+
+            metrics.add(seconds, rows=rows, bytes=bytes, peak_rss=peak_rss)
+
+        if self.callbacks:
+            event = {
+                'phase': phase,
+                'table': table,
+                'seconds': seconds,
+                'rows': rows,
+                'bytes': bytes,
+                'peak_rss_bytes': peak_rss,
+            }
+            for callback in self.callbacks:
+                callback(event)
+
+    @contextmanager
+    def phase(self, phase, table=None, rows=0, bytes=0):
+        """
+        Time a block of code as a phase of the load
+
+        Yields a dictionary whose 'rows' and 'bytes' values can be updated
+        inside the block.
+
+        """
+        counts = {'rows': rows, 'bytes': bytes}
+        start = time.time()
+        yield counts
+        self.record(phase, table, time.time() - start, rows=counts['rows'],
+            bytes=counts['bytes'])
+
+    @property
+    def phases(self):
+        return sorted(self._phases.values(),
+            key=lambda m: (m.phase, m.table or ''))
+
+    def get(self, phase, table=None):
+        return self._phases.get((phase, table))
+
+    def as_dict(self):
+        return {
+            'context': self.context,
+            'started': self.started,
+            'seconds': time.time() - self.started,
+            'peak_rss_bytes': get_peak_rss(),
+            'phases': [m.as_dict() for m in self.phases],
+        }
+
+    def to_json(self, **kwargs):
+        return json.dumps(self.as_dict(), **kwargs)
+
+
+class CountingLines(object):
+    """Iterate over the lines of a file, counting their length"""
+    def __init__(self, lines):
+        self._lines = iter(lines)
+        self.length = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self._lines)
+        self.length += len(line)
+        return line
+
+    next = __next__
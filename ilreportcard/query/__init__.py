@@ -1,4 +1,8 @@
-from sqlalchemy.sql import text
+import re
+
+from sqlalchemy.sql import bindparam, text
+
+from ilreportcard.generation import bump_load_generation
 
 CHICAGO_AREA_COUNTIES = [
     'Cook',
@@ -9,41 +13,106 @@ CHICAGO_AREA_COUNTIES = [
     'Kane',
 ]
 
-def summary_query(conn, year, rcdts_ids=None):
+# How query functions return their results.  See get_results().
+RESULT_MODES = ('dicts', 'tuples', 'columns', 'iter')
+
+
+def summary_query(conn, year, rcdts_ids=None, cache=None, result='dicts',
+        use_view=None):
+    # Streamed results can only be read once, so they can't be cached
+    if cache is not None and result != 'iter':
+        return cache.call(summary_query, conn, year, rcdts_ids=rcdts_ids,
+            result=result, use_view=use_view)
+
     f = globals()['summary_query_{}'.format(year)]
-    return f(conn, rcdts_ids)
+    return f(conn, rcdts_ids, result=result, use_view=use_view)
+
+
+def get_summary_view_name(year):
+    return 'summary_{}'.format(year)
 
 
-def summary_query_2015(conn, rcdts_ids=None):
+def summary_view_exists(conn, year):
+    # Only PostgreSQL has materialized views
+    if conn.dialect.name != 'postgresql':
+        return False
+
+    return conn.execute(text("SELECT to_regclass(:name)"),
+        name=get_summary_view_name(year)).scalar() is not None
+
+
+def create_summary_view(conn, year):
     """
-    Query for print agate
+    Create a materialized view of the results of the summary query
 
-    This includes:
+    The view stores the district ID computed from each school's ID, and the
+    percentages of students not tested, so summary_query() doesn't have to
+    join on an expression that can't use an index.  It's indexed on
+    school_id and district_id.  An existing view is replaced.
 
-    * School RCDTS ID
-    * School Name
-    * District RCDTS ID
-    * District Name
-    * Grades in School
-    * % proficient PARCC ELA School (Column 259)
-    * % proficient PARCC ELA District (Column 260)
-    * % proficient PARCC Math School (Column 263)
-    * % proficient PARCC Math District (Column 265)
-    * Tested enrollment PARCC ELA School
-    * # Tested PARCC ELA School
-    * Tested enrollment PARCC Math School
-    * # Tested PARCC Math School
-    * Tested enrollment PARCC ELA District
-    * # Tested PARCC ELA District
-    * Tested enrollment PARCC Math District
-    * # Tested PARCC Math District
-    
     """
-    # TODO: Document this and where the join table is coming from 
-    query = """
+    name = get_summary_view_name(year)
+    query = SUMMARY_QUERIES[int(year)]
+
+    with conn.begin():
+        conn.execute("DROP MATERIALIZED VIEW IF EXISTS {}".format(name))
+        conn.execute("CREATE MATERIALIZED VIEW {} AS {}".format(name, query))
+        # A unique index lets the view be refreshed concurrently
+        conn.execute("CREATE UNIQUE INDEX {0}_school_id_idx "
+            "ON {0} (school_id)".format(name))
+        conn.execute("CREATE INDEX {0}_district_id_idx "
+            "ON {0} (district_id)".format(name))
+        conn.execute("ANALYZE {}".format(name))
+
+
+def refresh_summary_view(conn, year, concurrently=True):
+    """
+    Update the summary view with the currently loaded data, creating it if
+    it doesn't exist
+
+    When concurrently is True, queries can read the view while it's
+    refreshed.
+
+    """
+    if not summary_view_exists(conn, year):
+        create_summary_view(conn, year)
+    else:
+        name = get_summary_view_name(year)
+        # Neither statement is committed automatically by SQLAlchemy
+        with conn.begin():
+            conn.execute("REFRESH MATERIALIZED VIEW {}{}".format(
+                "CONCURRENTLY " if concurrently else "", name))
+            conn.execute("ANALYZE {}".format(name))
+
+    # Results read from the view before the refresh may be cached
+    bump_load_generation(conn)
+
+
+def refresh_summary_views(conn, table_names):
+    """
+    Refresh the existing summary views that read from any of some tables
+
+    The load tasks call this after loading data, so that summary_query(),
+    which reads a year's view when it exists, doesn't return out of date
+    results.  Returns the years whose views were refreshed.
+
+    """
+    years = []
+    for year, query in sorted(SUMMARY_QUERIES.items()):
+        uses_tables = any(re.search(r'\b{}\b'.format(re.escape(name)), query)
+            for name in table_names)
+        if uses_tables and summary_view_exists(conn, year):
+            refresh_summary_view(conn, year)
+            years.append(year)
+
+    return years
+
+
+# TODO: Document this and where the join table is coming from 
+SUMMARY_QUERY_2015 = """
     SELECT s.school_id,
         s.school_name,
-        overlay(s.school_id placing '0000' from 12 for 4) AS district_id,
+        substr(s.school_id, 1, 11) || '0000' || substr(s.school_id, 16) AS district_id,
         s.district_name,
         s.grades_in_school,
         a.school_pct_proficiency_in_ela_parcc_2015_ela,
@@ -63,24 +132,83 @@ def summary_query_2015(conn, rcdts_ids=None):
         (CAST(coalesce(pd.absent_math, 0) + coalesce(pd.refusal_math, 0) AS float) / pd.tested_enrollment_math) * 100 AS pct_not_tested_math_district
     FROM assessment_2015_schools s 
     JOIN parcc_participation_2015 ps on ps.rcdts = s.school_id
-    JOIN parcc_participation_2015 pd on pd.rcdts = overlay(s.school_id placing
-    '0000' from 12 for 4)
+    JOIN parcc_participation_2015 pd on pd.rcdts = substr(s.school_id, 1, 11) || '0000' || substr(s.school_id, 16)
     JOIN assessment_2015_overall_achievement_parcc_dlm_performance a ON a.school_id = s.school_id
     """
 
-    if rcdts_ids is not None:
-        query += "WHERE s.school_id = ANY(:rcdts_ids)"
+# The summary query of each year, used for the summary views and batches
+SUMMARY_QUERIES = {
+    2015: SUMMARY_QUERY_2015,
+}
 
-    s = text(query)
-    return get_result_dicts(conn.execute(s, rcdts_ids=rcdts_ids))
 
+def summary_query_2015(conn, rcdts_ids=None, result='dicts', use_view=None):
+    """
+    Query for print agate
+
+    This includes:
+
+    * School RCDTS ID
+    * School Name
+    * District RCDTS ID
+    * District Name
+    * Grades in School
+    * % proficient PARCC ELA School (Column 259)
+    * % proficient PARCC ELA District (Column 260)
+    * % proficient PARCC Math School (Column 263)
+    * % proficient PARCC Math District (Column 265)
+    * Tested enrollment PARCC ELA School
+    * # Tested PARCC ELA School
+    * Tested enrollment PARCC Math School
+    * # Tested PARCC Math School
+    * Tested enrollment PARCC ELA District
+    * # Tested PARCC ELA District
+    * Tested enrollment PARCC Math District
+    * # Tested PARCC Math District
+
+    By default, the rows are read from the materialized view made by
+    refresh_summary_view() if it exists.  The load tasks refresh the view.
+    Pass use_view=False to run the full query instead, or True to always
+    read the view.
+
+    """
+    if use_view is None:
+        use_view = summary_view_exists(conn, 2015)
+
+    if use_view:
+        query = "SELECT * FROM {}\n".format(get_summary_view_name(2015))
+        column = "school_id"
+    else:
+        query = SUMMARY_QUERY_2015
+        column = "s.school_id"
+
+    if rcdts_ids is None:
+        s = text(query)
+    elif conn.dialect.name == 'postgresql':
+        s = text(query + "WHERE {} = ANY(:rcdts_ids)".format(column))
+    else:
+        # Other databases don't have arrays, so the IDs are expanded into
+        # an IN list
+        s = text(query + "WHERE {} IN :rcdts_ids".format(column)).bindparams(
+            bindparam('rcdts_ids', expanding=True))
+        rcdts_ids = list(rcdts_ids)
+
+    return execute_query(conn, s, {'rcdts_ids': rcdts_ids}, result)
+
+
+def best_worst_performers_query(conn, year, subject, order, limit=50, counties=None,
+        cache=None, result='dicts'):
+    if cache is not None and result != 'iter':
+        return cache.call(best_worst_performers_query, conn, year,
+            subject=subject, order=order, limit=limit, counties=counties,
+            result=result)
 
-def best_worst_performers_query(conn, year, subject, order, limit=50, counties=None):
     f = globals()['best_worst_performers_query_{}'.format(year)]
-    return f(conn, subject, order, limit, counties)
+    return f(conn, subject, order, limit, counties, result=result)
 
 
-def best_worst_performers_query_2015(conn, subject, order, limit, counties):
+def best_worst_performers_query_2015(conn, subject, order, limit, counties,
+        result='dicts'):
     """
     Query to get best and worst peformers by subject specified
 
@@ -129,13 +257,100 @@ def best_worst_performers_query_2015(conn, subject, order, limit, counties):
 
     s = text(query)
 
-    return get_result_dicts(conn.execute(s, **query_params))
+    return execute_query(conn, s, query_params, result)
 
 
-def get_result_dicts(result):
-    results = []
-    for row in result:
-        row_dict = {k:v for k,v in row.items()}
-        results.append(row_dict)
+def execute_query(conn, s, params, result='dicts'):
+    """
+    Execute a query and return its results in one of the RESULT_MODES
+
+    With the 'iter' mode, the query is executed with a server-side cursor
+    where the database supports it, so rows are fetched as they're read.
+
+    """
+    if result not in RESULT_MODES:
+        raise ValueError("Unknown result mode '{}'.  Use one of {}".format(
+            result, ", ".join(RESULT_MODES)))
 
-    return results
\ No newline at end of file
+    if result == 'iter':
+        conn = conn.execution_options(stream_results=True)
+
+    return get_results(conn.execute(s, **params), result)
+
+
+def get_results(result, mode='dicts'):
+    """
+    Get the rows of an SQLAlchemy result
+
+    Args:
+
+        result: SQLAlchemy ResultProxy.
+        mode: One of:
+            'dicts': A list of dictionaries, one for each row.
+            'tuples': A (columns, rows) tuple of a list of column names and
+                a list of row tuples.
+            'columns': A dictionary mapping each column name to a list of
+                the column's values.
+            'iter': A ResultIterator that yields row tuples as they are
+                fetched.
+
+    """
+    if mode == 'iter':
+        return ResultIterator(result)
+
+    if mode == 'dicts':
+        return get_result_dicts(result)
+
+    columns = list(result.keys())
+    rows = [tuple(row) for row in result]
+
+    if mode == 'tuples':
+        return columns, rows
+
+    if mode == 'columns':
+        if not rows:
+            return {c: [] for c in columns}
+
+        return {c: list(values) for c, values in zip(columns, zip(*rows))}
+
+    raise ValueError("Unknown result mode '{}'".format(mode))
+
+
+class ResultIterator(object):
+    """
+    Iterate over the rows of a result as tuples
+
+    The column names are in the columns attribute.  The result is closed
+    when all of its rows have been read, or when close() is called.
+
+    """
+    def __init__(self, result, chunk_size=1000):
+        self.result = result
+        self.columns = list(result.keys())
+        self.chunk_size = chunk_size
+
+    def __iter__(self):
+        try:
+            while True:
+                rows = self.result.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+
+                for row in rows:
+                    yield tuple(row)
+        finally:
+            self.close()
+
+    def close(self):
+        self.result.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def get_result_dicts(result):
+    keys = list(result.keys())
+    return [dict(zip(keys, row)) for row in result]
\ No newline at end of file
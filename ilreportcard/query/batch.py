@@ -0,0 +1,188 @@
+"""
+Run summary queries for many years and sets of schools at once
+
+School profile pages need the summary of several schools for several years.
+Instead of calling summary_query for each one, summary_query_batch groups
+the requests by year and runs one query per year for all of the schools
+requested for that year.  The rows are then split back up by request.
+
+On PostgreSQL, each year's query is prepared once per database connection
+and executed with the school IDs as a parameter, so it isn't parsed and
+planned again for every batch.
+"""
+from collections import OrderedDict
+
+from sqlalchemy.sql import text
+
+from . import (get_results, get_summary_view_name, summary_query,
+    SUMMARY_QUERIES)
+
+
+# Prefix of the names of prepared statements
+PREPARED_PREFIX = 'ilreportcard_'
+
+
+def normalize_request(request):
+    year, rcdts_ids = request
+    if rcdts_ids is not None:
+        rcdts_ids = tuple(rcdts_ids)
+
+    return int(year), rcdts_ids
+
+
+def group_requests(requests):
+    """
+    Get the schools needed for each year
+
+    Args:
+
+        requests: Dictionary mapping keys to (year, rcdts_ids) tuples.
+
+    Returns an ordered dictionary mapping each year to a sorted list of
+    school IDs, or None if all schools are needed.
+
+    """
+    years = OrderedDict()
+    for key, (year, rcdts_ids) in requests.items():
+        if rcdts_ids is None:
+            years[year] = None
+        elif year not in years:
+            years[year] = set(rcdts_ids)
+        elif years[year] is not None:
+            years[year].update(rcdts_ids)
+
+    return OrderedDict((year, sorted(ids) if ids is not None else None)
+        for year, ids in years.items())
+
+
+def split_results(requests, year_rows, result='dicts'):
+    """
+    Split each year's rows into the rows of each request
+
+    Args:
+
+        requests: Dictionary mapping keys to (year, rcdts_ids) tuples.
+        year_rows: Dictionary mapping each year to a (columns, rows) tuple.
+        result: 'dicts' or 'tuples', as for the query functions.
+
+    A request's rows are in the order of its school IDs.
+
+    """
+    by_school = {}
+    for year, (columns, rows) in year_rows.items():
+        school_id = columns.index('school_id')
+        by_school[year] = dict((row[school_id], row) for row in rows)
+
+    results = {}
+    for key, (year, rcdts_ids) in requests.items():
+        columns, rows = year_rows[year]
+        if rcdts_ids is not None:
+            schools = by_school[year]
+            rows = [schools[i] for i in rcdts_ids if i in schools]
+
+        if result == 'tuples':
+            results[key] = (columns, rows)
+        else:
+            results[key] = [dict(zip(columns, row)) for row in rows]
+
+    return results
+
+
+def get_summary_sql(year, use_view):
+    if use_view:
+        return "SELECT * FROM {}\n".format(get_summary_view_name(year)), ''
+
+    return SUMMARY_QUERIES[year], 's.'
+
+
+def prepare(conn, name, sql, param_types):
+    """Prepare a statement once for each database connection"""
+    prepared = conn.info.setdefault('ilreportcard_prepared', set())
+    if name in prepared:
+        return
+
+    # SQLAlchemy doesn't commit PREPARE automatically, which would leave
+    # the connection idle in a transaction
+    with conn.begin():
+        conn.execute("PREPARE {} {} AS {}".format(name,
+            "({})".format(", ".join(param_types)) if param_types else "",
+            sql))
+    prepared.add(name)
+
+
+def summary_views_exist(conn, years):
+    """Check which years have summary views, in one query"""
+    columns = ", ".join("to_regclass(:view_{})".format(year) for year in years)
+    row = conn.execute(text("SELECT {}".format(columns)), **{
+        'view_{}'.format(year): get_summary_view_name(year) for year in years
+    }).first()
+    return dict((year, value is not None) for year, value in zip(years, row))
+
+
+def query_year_prepared(conn, year, rcdts_ids, use_view):
+    sql, prefix = get_summary_sql(year, use_view)
+    name = '{}summary_{}{}'.format(PREPARED_PREFIX, year,
+        '_view' if use_view else '')
+
+    if rcdts_ids is None:
+        name += '_all'
+        prepare(conn, name, sql, [])
+        result = conn.execute("EXECUTE {}".format(name))
+    else:
+        prepare(conn, name, sql + "WHERE {}school_id = ANY($1)".format(prefix),
+            ['text[]'])
+        result = conn.execute(text("EXECUTE {}(:rcdts_ids)".format(name)),
+            rcdts_ids=list(rcdts_ids))
+
+    return get_results(result, 'tuples')
+
+
+def summary_query_batch(conn, requests, result='dicts', use_view=None):
+    """
+    Run summary queries for many (year, rcdts_ids) requests
+
+    Args:
+
+        conn: SQLAlchemy connection.  Prepared statements belong to the
+            database connection, so reusing a connection reuses them.
+        requests: Either a dictionary mapping keys to (year, rcdts_ids)
+            tuples, or a list of (year, rcdts_ids) tuples.  rcdts_ids can be
+            None to get every school.
+        result: 'dicts' or 'tuples', as for summary_query.
+        use_view: Whether to read from the materialized summary views.  By
+            default, they're used for the years they exist.
+
+    Returns a dictionary mapping each key to the request's results.  When
+    requests is a list, the keys are (year, tuple of rcdts_ids) tuples.
+
+    """
+    if result not in ('dicts', 'tuples'):
+        raise ValueError("Batch queries return 'dicts' or 'tuples'")
+
+    if isinstance(requests, dict):
+        requests = OrderedDict((key, normalize_request(request))
+            for key, request in requests.items())
+    else:
+        requests = OrderedDict((normalize_request(request),
+            normalize_request(request)) for request in requests)
+
+    years = group_requests(requests)
+    if not years:
+        return {}
+
+    year_rows = {}
+    if conn.dialect.name == 'postgresql':
+        if use_view is None:
+            views = summary_views_exist(conn, list(years))
+        else:
+            views = dict((year, use_view) for year in years)
+
+        for year, rcdts_ids in years.items():
+            year_rows[year] = query_year_prepared(conn, year, rcdts_ids,
+                views[year])
+    else:
+        for year, rcdts_ids in years.items():
+            year_rows[year] = summary_query(conn, year, rcdts_ids,
+                result='tuples', use_view=use_view)
+
+    return split_results(requests, year_rows, result)
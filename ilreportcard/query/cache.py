@@ -0,0 +1,297 @@
+"""
+Cache query results until the next load
+
+The report card data only changes when a loader runs, so query results can
+be reused until then.  Cached results are keyed on the query's name, the
+year and its other arguments, along with the load generation that the
+loaders increment (see ilreportcard.generation).  After a load, the
+generation changes, so results cached before it are never returned.
+
+Results are kept in memory by default.  DirectoryBackend stores them as
+pickle files so that several processes can share them.
+"""
+from collections import OrderedDict
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+from ilreportcard.generation import get_load_generation
+
+
+DEFAULT_MAX_SIZE = 256
+
+# Maximum number of files kept by a DirectoryBackend
+DEFAULT_MAX_FILES = 1024
+
+# Returned by backends when a key isn't cached
+MISSING = object()
+
+
+def normalize_value(value):
+    """
+    Convert an argument value to a hashable value that is the same for
+    equivalent arguments
+
+    Lists of ids or counties are matched with SQL's ANY, so their order
+    doesn't change the result and they are sorted.
+
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(sorted(normalize_value(v) for v in value))
+
+    if isinstance(value, dict):
+        return tuple(sorted((k, normalize_value(v)) for k, v in value.items()))
+
+    return value
+
+
+def get_cache_key(name, year, kwargs):
+    return (name, int(year), normalize_value(kwargs))
+
+
+class MemoryBackend(object):
+    """
+    Least recently used results, in memory
+
+    Args:
+
+        max_size: Maximum number of results to keep.
+        ttl: If set, results are dropped after this many seconds.
+
+    """
+    def __init__(self, max_size=DEFAULT_MAX_SIZE, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            try:
+                stored, value = self._entries.pop(key)
+            except KeyError:
+                return MISSING
+
+            if self.ttl is not None and time.time() - stored > self.ttl:
+                return MISSING
+
+            # Move it to the most recently used end
+            self._entries[key] = (stored, value)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time(), value)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DirectoryBackend(object):
+    """
+    Results stored as pickle files in a directory
+
+    Args:
+
+        directory: Directory for the cache files.  It's created if it
+            doesn't exist.
+        ttl: If set, results are ignored, and their files removed, after
+            this many seconds.
+        max_files: Maximum number of results to keep.  Whenever a result is
+            stored, expired files are removed, and then the oldest files
+            until there are at most this many.  Results from earlier load
+            generations can't be used again, so they're among the first
+            to go.
+
+    Files are written to a temporary name and renamed, so processes sharing
+    the directory never read a partly written result.  Only share the
+    directory with trusted processes, since loading a pickle can run
+    arbitrary code.
+
+    """
+    def __init__(self, directory, ttl=None, max_files=DEFAULT_MAX_FILES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_files = max_files
+
+    def get_path(self, key):
+        digest = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, digest + '.pickle')
+
+    def get(self, key):
+        path = self.get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                stored_key, value = pickle.load(f)
+            stored = os.path.getmtime(path)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return MISSING
+
+        if stored_key != key:
+            # Hash collision
+            return MISSING
+
+        if self.ttl is not None and time.time() - stored > self.ttl:
+            self._remove(path)
+            return MISSING
+
+        return value
+
+    def set(self, key, value):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump((key, value), f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self.get_path(key))
+        except Exception:
+            self._remove(tmp_path)
+            raise
+
+        self.prune()
+
+    def get_files(self):
+        """Get (modification time, path) tuples of the cached results"""
+        files = []
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.pickle'):
+                continue
+
+            path = os.path.join(self.directory, filename)
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                # Removed by another process
+                pass
+
+        return files
+
+    def prune(self):
+        """Remove expired results, and the oldest ones over max_files"""
+        files = sorted(self.get_files())
+        if self.ttl is not None:
+            now = time.time()
+            while files and now - files[0][0] > self.ttl:
+                self._remove(files.pop(0)[1])
+
+        while len(files) > self.max_files:
+            self._remove(files.pop(0)[1])
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        if not os.path.isdir(self.directory):
+            return
+
+        for stored, path in self.get_files():
+            self._remove(path)
+
+    def __len__(self):
+        if not os.path.isdir(self.directory):
+            return 0
+
+        return len(self.get_files())
+
+
+class QueryCache(object):
+    """
+    Cache the results of the query functions in ilreportcard.query
+
+    Args:
+
+        backend: Where results are stored.  Defaults to a MemoryBackend
+            created with max_size and ttl.
+        max_size: Maximum number of results kept by the default backend.
+        ttl: Seconds results are kept by the default backend.  Results are
+            also invalidated by loads, so this is only needed when data is
+            changed without a loader.
+        generation_interval: Seconds between checks of the load generation.
+            By default, it's checked on every call, which costs a single
+            row query once anything has been loaded, even when the result
+            is cached.  Raising this saves that query at the cost of
+            returning stale results for up to this long after a load.
+
+    Pass an instance as the cache argument of the query functions.  The same
+    result object is returned for every hit, so don't modify it.
+
+    """
+    def __init__(self, backend=None, max_size=DEFAULT_MAX_SIZE, ttl=None,
+            generation_interval=0):
+        if backend is None:
+            backend = MemoryBackend(max_size=max_size, ttl=ttl)
+
+        self.backend = backend
+        self.generation_interval = generation_interval
+        self.hits = 0
+        self.misses = 0
+        self._generation = None
+        self._generation_checked = 0
+        self._lock = threading.Lock()
+
+    def get_generation(self, conn):
+        now = time.time()
+        if (self._generation is None or
+                now - self._generation_checked >= self.generation_interval):
+            # Once there's a generation, its table exists
+            generation = get_load_generation(conn,
+                check_exists=not self._generation)
+            if (self._generation is not None and generation != self._generation
+                    and isinstance(self.backend, MemoryBackend)):
+                # Nothing cached for an earlier generation can be used again
+                self.backend.clear()
+
+            self._generation = generation
+            self._generation_checked = now
+
+        return self._generation
+
+    def call(self, fn, conn, year, **kwargs):
+        """
+        Get the result of fn(conn, year, **kwargs), from the cache if
+        possible
+        """
+        key = get_cache_key(fn.__name__, year, kwargs) + (
+            self.get_generation(conn),)
+        result = self.backend.get(key)
+
+        with self._lock:
+            if result is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+                return result
+
+        result = fn(conn, year, **kwargs)
+        self.backend.set(key, result)
+        return result
+
+    def clear(self):
+        self.backend.clear()
+        self._generation = None
+
+    @property
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': float(self.hits) / requests if requests else None,
+            'size': len(self.backend) if hasattr(self.backend, '__len__')
+                else None,
+        }
@@ -0,0 +1,223 @@
+"""
+Rank schools by proficiency in memory
+
+best_worst_performers_query runs a sorted query for every combination of
+subject, order and counties.  When many combinations are needed, like the
+top and bottom 50 schools in ELA and math for each county, it's faster to
+read the participation and proficiency columns once into a RankingSnapshot
+and rank the schools in memory.  All of the requests for a subject are
+answered in a single pass over the schools, keeping a bounded heap for each
+request.
+"""
+from array import array
+from collections import namedtuple
+import heapq
+
+from sqlalchemy.sql import text
+
+from . import CHICAGO_AREA_COUNTIES
+
+
+SUBJECTS = ('ela', 'math')
+
+# Schools where fewer of the eligible students were tested are left out of
+# the rankings
+MIN_PERCENT_TESTED = .85
+
+RankingRequest = namedtuple('RankingRequest',
+    ['subject', 'order', 'limit', 'counties'])
+
+
+def ranking_request(subject, order='desc', limit=50,
+        counties=CHICAGO_AREA_COUNTIES):
+    """
+    Make a RankingRequest, with the same defaults as the ranking methods
+
+    counties can be None to rank schools in every county.
+
+    """
+    if subject not in SUBJECTS:
+        raise ValueError("Unknown subject '{}'".format(subject))
+
+    if order.lower() not in ('asc', 'desc'):
+        raise ValueError("Order must be 'asc' or 'desc'")
+
+    return RankingRequest(subject, order.lower(), int(limit),
+        tuple(counties) if counties is not None else None)
+
+
+RANKING_QUERY_2015 = """
+    SELECT ps.rcdts AS school_id,
+      ps.district_name_school_name,
+      ps.city,
+      ps.county,
+      ps.district_number,
+      ps.tested_enrollment_ela,
+      ps.tested_ela,
+      ps.tested_enrollment_math,
+      ps.tested_math,
+      pd.school_pct_proficiency_in_ela_parcc_2015_ela AS passing_ela,
+      pd.school_pct_proficiency_in_math_parcc_2015_math AS passing_math
+    FROM parcc_participation_2015 ps
+    JOIN assessment_2015_overall_achievement_parcc_dlm_performance pd
+      ON pd.school_id = ps.rcdts
+    """
+
+# Columns of the rows passed to RankingSnapshot
+SNAPSHOT_COLUMNS = ['school_id', 'district_name_school_name', 'city',
+    'county', 'district_number', 'tested_enrollment_ela', 'tested_ela',
+    'tested_enrollment_math', 'tested_math', 'passing_ela', 'passing_math']
+
+NAN = float('nan')
+
+
+class RankingSnapshot(object):
+    """
+    Participation and proficiency of every school, for ranking
+
+    Args:
+
+        rows: Iterable of tuples with the values of SNAPSHOT_COLUMNS.
+
+    Text values are kept in lists and numbers in arrays.  For each subject,
+    the snapshot keeps the share of students tested and the percent
+    proficient of each school, with NaN for missing values.
+
+    """
+    def __init__(self, rows):
+        self.school_ids = []
+        self.names = []
+        self.cities = []
+        self.counties = []
+        self.district_numbers = []
+        self.tested_enrollment = {s: array('d') for s in SUBJECTS}
+        self.tested = {s: array('d') for s in SUBJECTS}
+        self.percent_tested = {s: array('d') for s in SUBJECTS}
+        self.passing = {s: array('d') for s in SUBJECTS}
+
+        for row in rows:
+            (school_id, name, city, county, district_number,
+                tested_enrollment_ela, tested_ela, tested_enrollment_math,
+                tested_math, passing_ela, passing_math) = row
+            self.school_ids.append(school_id)
+            self.names.append(name)
+            self.cities.append(city)
+            self.counties.append(county)
+            self.district_numbers.append(district_number)
+
+            for subject, enrollment, tested, passing in (
+                    ('ela', tested_enrollment_ela, tested_ela, passing_ela),
+                    ('math', tested_enrollment_math, tested_math,
+                        passing_math)):
+                self.tested_enrollment[subject].append(
+                    NAN if enrollment is None else enrollment)
+                self.tested[subject].append(NAN if tested is None else tested)
+                self.percent_tested[subject].append(
+                    float(tested) / enrollment
+                    if tested is not None and enrollment else NAN)
+                self.passing[subject].append(
+                    NAN if passing is None else passing)
+
+    @classmethod
+    def from_database(cls, conn, year):
+        query = globals()['RANKING_QUERY_{}'.format(year)]
+        result = conn.execute(text(query))
+        return cls(tuple(row) for row in result)
+
+    def __len__(self):
+        return len(self.school_ids)
+
+    def get_row(self, i, subject):
+        """Get a school's values as returned by best_worst_performers_query"""
+        def number(value):
+            if value != value:
+                # NaN
+                return None
+
+            return int(value) if value.is_integer() else value
+
+        return {
+            'school_id': self.school_ids[i],
+            'district_name_school_name': self.names[i],
+            'city': self.cities[i],
+            'county': self.counties[i],
+            'district_number': self.district_numbers[i],
+            'tested_enrollment_{}'.format(subject): number(
+                self.tested_enrollment[subject][i]),
+            'tested_{}'.format(subject): number(self.tested[subject][i]),
+            'percent_tested_{}'.format(subject): self.percent_tested[subject][i],
+            'passing': self.passing[subject][i],
+        }
+
+    def rank(self, subject, order='desc', limit=50,
+            counties=CHICAGO_AREA_COUNTIES):
+        """
+        Get the best or worst performing schools in a subject
+
+        The schools are filtered and ordered like best_worst_performers_query,
+        except that schools without a percent proficient are left out
+        instead of being sorted first.
+
+        """
+        request = ranking_request(subject, order, limit, counties)
+        return self.rank_many([request])[request]
+
+    def rank_many(self, requests):
+        """
+        Answer many ranking requests with one pass over the schools for each
+        subject
+
+        Args:
+
+            requests: Iterable of RankingRequest tuples.  Use
+                ranking_request() to fill in defaults.
+
+        Returns a dictionary mapping each request to a list of school
+        dictionaries, like the ones returned by best_worst_performers_query.
+
+        """
+        requests = list(set(requests))
+        heaps = [[] for request in requests]
+        county_sets = [set(r.counties) if r.counties is not None else None
+            for r in requests]
+        by_subject = {}
+        for j, request in enumerate(requests):
+            if request.limit > 0:
+                by_subject.setdefault(request.subject, []).append(j)
+
+        for subject, indexes in by_subject.items():
+            percent_tested = self.percent_tested[subject]
+            passing = self.passing[subject]
+
+            for i, county in enumerate(self.counties):
+                value = passing[i]
+                # Comparisons with NaN are false, so this also skips schools
+                # with missing values
+                if not (percent_tested[i] >= MIN_PERCENT_TESTED and
+                        value == value):
+                    continue
+
+                for j in indexes:
+                    counties = county_sets[j]
+                    if counties is not None and county not in counties:
+                        continue
+
+                    # Keep the limit best entries in a min heap, with the
+                    # school's position breaking ties in file order
+                    if requests[j].order == 'desc':
+                        entry = (value, -i)
+                    else:
+                        entry = (-value, -i)
+
+                    heap = heaps[j]
+                    if len(heap) < requests[j].limit:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+
+        results = {}
+        for request, heap in zip(requests, heaps):
+            results[request] = [self.get_row(-i, request.subject)
+                for value, i in sorted(heap, reverse=True)]
+
+        return results
@@ -0,0 +1,65 @@
+"""
+Find the schema and loader classes for a kind of data and a year
+
+The classes are named by import path and only imported when they're asked
+for, so that code like the command line tasks can look up a year's schema
+or loader without importing every schema, loader and database library up
+front.
+
+The get_*_schema() and get_*_loader() functions of ilreportcard.schema and
+ilreportcard.load look their classes up here.
+"""
+from importlib import import_module
+
+
+SCHEMAS = {
+    ('report_card', 2015): 'ilreportcard.schema:ReportCardSchema2015',
+    ('report_card', 2016): 'ilreportcard.schema:ReportCardSchema2016',
+    ('assessment', 2015): 'ilreportcard.schema:AssessmentSchema2015',
+    ('assessment', 2016): 'ilreportcard.schema:AssessmentSchema2016',
+    ('parcc_participation', 2015):
+        'ilreportcard.schema:PARCCParticipationSchema2015',
+}
+
+LOADERS = {
+    ('report_card', 2015): 'ilreportcard.load:DelimitedLoader',
+    ('report_card', 2016): 'ilreportcard.load:DelimitedLoader',
+    ('assessment', 2015): 'ilreportcard.load:DelimitedLoader',
+    ('assessment', 2016): 'ilreportcard.load:DelimitedLoader',
+    ('parcc_participation', 2015):
+        'ilreportcard.load:PARCCParticipationLoader2015',
+}
+
+def import_object(path):
+    """Import an object from a 'package.module:name' path"""
+    module_name, name = path.split(':')
+    return getattr(import_module(module_name), name)
+
+
+def get_schema_class(kind, year):
+    try:
+        path = SCHEMAS[(kind, int(year))]
+    except KeyError:
+        raise ValueError("No {} schema found for {}".format(kind, year))
+
+    return import_object(path)
+
+
+def get_schema(kind, year):
+    """Get a schema instance for a kind of data and a year"""
+    return get_schema_class(kind, year)()
+
+
+def get_loader(kind, year, **kwargs):
+    """
+    Get a loader for a kind of data and a year
+
+    Keyword arguments are passed to the loader class.
+
+    """
+    try:
+        path = LOADERS[(kind, int(year))]
+    except KeyError:
+        raise ValueError("No {} loader found for {}".format(kind, year))
+
+    return import_object(path)(**kwargs)
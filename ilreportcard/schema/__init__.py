@@ -1,13 +1,12 @@
 """Define and create relational database tables based on the record layout"""
 from copy import copy
 from enum import Enum
+from operator import itemgetter
 import re
 import sys
 
-from sqlalchemy import (Column as SQAColumn, Table as SQATable, String, Integer,
-    Float, Boolean)
-import xlrd
-from xlrd import XL_CELL_NUMBER
+from ilreportcard.registry import get_schema
+from ilreportcard.xlsx import XL_CELL_NUMBER, open_workbook
 
 from .column_names import (
     apply_filters,
@@ -66,17 +65,23 @@ def get_column_type(column_type_string):
         column_type_string))
 
 
+HYPHEN_RE = re.compile(r'\s*-\s*')
+INVALID_CHARACTERS_RE = re.compile(r'[^a-zA-Z0-9\$_ ]')
+WHITESPACE_RE = re.compile(r'\s+')
+LEADING_NUMBER_RE = re.compile(r'^\d+ ')
+
+
 def slugify(s):
     s_valid = s.strip()
 
     # Replace '-' with '_'
-    s_valid = re.sub(r'\s*-\s*', '_', s_valid)
+    s_valid = HYPHEN_RE.sub('_', s_valid)
 
     # Remove invalid characters
-    s_valid = re.sub(r'[^a-zA-Z0-9\$_ ]', '', s_valid)
+    s_valid = INVALID_CHARACTERS_RE.sub('', s_valid)
 
     # Replace spaces with underscores
-    s_valid = re.sub(r'\s+', '_', s_valid)
+    s_valid = WHITESPACE_RE.sub('_', s_valid)
 
     # Make the whole thing lowercase
     s_valid = s_valid.lower()
@@ -93,10 +98,16 @@ def valid_column_name(s):
 
     s_valid = s.strip()
 
-    s_valid = re.sub(r'^\d+ ', '', s_valid)
+    s_valid = LEADING_NUMBER_RE.sub('', s_valid)
 
     return slugify(s_valid)
 
+def conversion_error(columndef, value):
+    msg = "Could not convert value '{}' to {} for column '{}' (index {})"
+    return ValueError(msg.format(value, columndef.column_type,
+        columndef.name, columndef.column_index))
+
+
 def default_converter(columndef, value):
     try:
         if columndef.column_type == COLUMN_TYPES.INTEGER:
@@ -123,23 +134,154 @@ def default_converter(columndef, value):
         elif columndef.column_type == COLUMN_TYPES.STRING:
             return str(value)
     except ValueError:
-        msg = "Could not convert value '{}' to {} for column '{}' (index {})"
-        raise ValueError(msg.format(value, columndef.column_type,
-            columndef.name, columndef.column_index))
+        raise conversion_error(columndef, value)
 
     return value
 
 
+def compile_converter(columndef):
+    """
+    Get a function that strips and converts a single raw value for a column
+
+    The returned function gives the same results, and raises the same
+    errors, as stripping the value and calling the column's convert_value
+    method, but avoids dispatching on the column type for every value.
+    Plain strings, which is what the delimited data files contain, take a
+    fast path specialized for the column type.  Anything else, like the
+    numbers read from spreadsheets, goes through the column's converter.
+
+    """
+    converter = columndef.converter
+
+    def convert_generic(value):
+        try:
+            value = value.strip()
+        except AttributeError:
+            # Not string
+            pass
+
+        return converter(columndef, value)
+
+    if converter is not default_converter:
+        return convert_generic
+
+    column_type = columndef.column_type
+
+    if column_type == COLUMN_TYPES.INTEGER:
+        def convert(value):
+            if value.__class__ is not str:
+                return convert_generic(value)
+
+            value = value.strip()
+            if value == '':
+                return None
+
+            value = value.replace(',', '')
+            try:
+                return int(value)
+            except ValueError:
+                raise conversion_error(columndef, value)
+
+    elif column_type == COLUMN_TYPES.FLOAT:
+        def convert(value):
+            if value.__class__ is not str:
+                return convert_generic(value)
+
+            value = value.strip()
+            if value == '':
+                return None
+
+            value = value.replace('$', '').replace(',', '')
+            try:
+                return float(value)
+            except ValueError:
+                raise conversion_error(columndef, value)
+
+    elif column_type == COLUMN_TYPES.STRING:
+        def convert(value):
+            if value.__class__ is not str:
+                return convert_generic(value)
+
+            return value.strip()
+
+    else:
+        convert = convert_generic
+
+    return convert
+
+
+def compile_row_converter(columns, indexes=None, converters=None):
+    """
+    Get a function that converts a raw row of data into a tuple of values
+
+    Args:
+
+        columns: List of Column objects describing the values in the
+            converted row.
+        indexes: Optional list of indexes of each column's value in the raw
+            row.  Defaults to each column's column_index.
+        converters: Optional list of single-value converter functions for
+            each column.  Defaults to the result of compile_converter for
+            each column.
+
+    """
+    if indexes is None:
+        indexes = [c.column_index for c in columns]
+
+    if converters is None:
+        converters = [compile_converter(c) for c in columns]
+
+    if len(indexes) == 1:
+        index = indexes[0]
+        get_values = lambda row: (row[index],)
+    else:
+        get_values = itemgetter(*indexes)
+
+    def convert_row(row):
+        return tuple([convert(value)
+            for convert, value in zip(converters, get_values(row))])
+
+    return convert_row
+
+
 class Column(object):
-    """Data column definition"""
+    """
+    Data column definition
+
+    The report card schemas create thousands of columns, so they use slots
+    instead of a dictionary for their attributes.
+
+    Args:
+
+        column_index: Position of the column's value in a raw data row.
+        name: Name of the database column.
+        column_type: One of COLUMN_TYPES.
+        primary_key: Whether the column is part of its table's primary key.
+        table: Table the column belongs to.  It's set when the column is
+            added to a table.
+        converter: Function that converts a raw value for the column.
+        description: Description of the field in the record layout.
+        heading: Heading of the section of the record layout the field is
+            in, for layouts with sections.
+        subheading: Subheading of the section of the record layout the
+            field is in.
+
+    """
+    __slots__ = ('column_index', 'name', 'column_type', 'table',
+        'primary_key', 'converter', 'description', 'heading', 'subheading')
+
     def __init__(self, column_index, name, column_type, primary_key=False,
-            table=None, converter=default_converter):
+            table=None, converter=default_converter, description=None,
+            heading=None, subheading=None):
         self.column_index = column_index
         self.name = name
         self.column_type = column_type
         self.table = table
         self.primary_key = primary_key
         self.converter = converter
+        self.description = description
+        self.heading = heading
+        self.subheading = subheading
 
     def __repr__(self):
         return 'Column(column_index={}, name="{}", column_type={}, primary_key={})'.format(
@@ -149,6 +291,13 @@ class Column(object):
             self.primary_key
         )
 
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def set_table(self, table):
         self.table = table
 
@@ -159,6 +308,10 @@ class Column(object):
             column_type=self.column_type,
             primary_key=self.primary_key,
             table=self.table,
+            converter=self.converter,
+            description=self.description,
+            heading=self.heading,
+            subheading=self.subheading,
         )
 
     def convert_value(self, value):
@@ -167,29 +320,80 @@ class Column(object):
 
 class Table(object):
     """Data table representation"""
+    __slots__ = ('name', '_columns', '_columns_by_name', '_row_converter')
+
     def __init__(self, name):
         self.name = name
         self._columns = []
+        self._columns_by_name = {}
+        self._row_converter = None
 
     def __repr__(self):
         return 'Table(name="{}")'.format(self.name)
 
+    def __getstate__(self):
+        # The compiled row converter is a closure, which can't be pickled
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state['_row_converter'] = None
+        return state
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def add_column(self, column):
         column.set_table(self)
         self._columns.append(column)
+        self._columns_by_name.setdefault(column.name, column)
+        self._row_converter = None
 
     @property
     def columns(self):
         return self._columns
 
-    def as_sqlalchemy(self, metadata):
+    def get_column(self, name):
+        """Get a column by name.  Raises KeyError if there's no such
+        column."""
+        return self._columns_by_name[name]
+
+    def has_column(self, name):
+        return name in self._columns_by_name
+
+    def get_row_converter(self):
+        """
+        Get a function that converts a raw data row to a tuple of this
+        table's column values
+
+        The function is built once and reused until another column is added.
+
+        """
+        if self._row_converter is None:
+            self._row_converter = compile_row_converter(self._columns)
+
+        return self._row_converter
+
+    def as_sqlalchemy(self, metadata, name=None, primary_key=True):
         """
         Get an SQLAlchemy Table instance for this table definition
 
+        Args:
+
+            metadata: SQLAlchemy MetaData the table is added to.
+            name: Name of the database table, if it's different from the
+                name of this table definition.  The primary key constraint
+                is then explicitly named "<name>_pkey".
+            primary_key: If False, the table doesn't have a primary key
+                constraint, so that it can be added after loading the data.
+
         See
         http://docs.sqlalchemy.org/en/latest/core/metadata.html#accessing-tables-and-columns
 
         """
+        # SQLAlchemy is slow to import, and only needed to create or load
+        # tables
+        from sqlalchemy import (Column as SQAColumn, Table as SQATable,
+            String, Integer, Float, Boolean)
+
         column_type_map = {
             COLUMN_TYPES.INTEGER: Integer,
             COLUMN_TYPES.FLOAT: Float,
@@ -202,13 +406,100 @@ class Table(object):
         for columndef in self.columns:
             column = SQAColumn(columndef.name,
                 column_type_map[columndef.column_type],
-                primary_key=columndef.primary_key)
+                primary_key=primary_key and columndef.primary_key)
             columns.append(column)
 
-        return SQATable(self.name, metadata, *columns)
+        if name is None:
+            return SQATable(self.name, metadata, *columns)
+
+        table = SQATable(name, metadata, *columns)
+        table.primary_key.name = '{}_pkey'.format(name)
+        return table
+
+
+class Index(object):
+    """
+    Secondary index on a table
+
+    Args:
+
+        name: Name of the index, unique among the indexes of a table.
+        columns: List of names of the indexed columns.
+        expression: SQL expression that is indexed instead of columns, for
+            queries that filter on a calculated value.
+        table: Name of the table the index is on, with or without the
+            schema's name as a prefix.  If this isn't specified, the index is
+            created on every table of the schema that has all of the columns.
+        unique: If True, create a unique index.
+
+    """
+    def __init__(self, name, columns=None, expression=None, table=None,
+            unique=False):
+        if not columns and not expression:
+            raise ValueError("Index {} needs columns or an expression".format(
+                name))
+
+        if expression and table is None:
+            raise ValueError("Expression index {} needs a table".format(name))
+
+        self.name = name
+        self.columns = list(columns or [])
+        self.expression = expression
+        self.table = table
+        self.unique = unique
+
+    def __repr__(self):
+        return 'Index(name="{}")'.format(self.name)
+
+    def applies_to(self, schema_name, tabledef):
+        if self.table is not None:
+            return tabledef.name in (self.table,
+                '{}_{}'.format(schema_name, self.table))
+
+        if not all(tabledef.has_column(c) for c in self.columns):
+            return False
+
+        # The primary key is already indexed
+        key_columns = [c.name for c in tabledef.columns if c.primary_key]
+        return key_columns != self.columns
+
+
+class ColumnLookups(object):
+    """
+    Dictionaries for finding a schema's tables and columns
+
+    Args:
+
+        tables: The schema's tables.
+
+    When several tables have a column with the same name or layout index,
+    like the school ID column of the assessment tables, the first one is
+    used.
+
+    """
+    def __init__(self, tables):
+        self.tables = dict((table.name, table) for table in tables)
+        self.by_name = {}
+        self.by_index = {}
+        self.by_description = {}
+
+        for table in tables:
+            for column in table.columns:
+                self.by_name.setdefault(column.name, column)
+                self.by_index.setdefault(column.column_index, column)
+                if column.description is not None:
+                    self.by_description.setdefault((column.heading,
+                        column.subheading, column.description), column)
 
 
 class BaseSchema(object):
+    # Secondary indexes.  They're built after the data is loaded, since
+    # inserting rows into indexed tables is slower.
+    INDEXES = []
+
+    # Built the first time a column is looked up
+    _lookups = None
+
     def __init__(self, *args, **kwargs):
         self._tables = []
         self._columns = []
@@ -221,6 +512,57 @@ class BaseSchema(object):
     def tables(self):
         return self._tables
 
+    @property
+    def lookups(self):
+        if self._lookups is None:
+            self._lookups = ColumnLookups(self.tables)
+
+        return self._lookups
+
+    def reset_lookups(self):
+        """Rebuild the column lookups after the tables change"""
+        self._lookups = None
+
+    def get_column(self, name, table=None):
+        """
+        Get a column by name
+
+        Args:
+
+            name: Name of the column.
+            table: Optional name of the table the column is in.  Columns
+                with the same name in different tables, like school_id,
+                need this to get a particular table's column.
+
+        Raises KeyError if there's no such column.
+
+        """
+        if table is not None:
+            return self.get_table(table).get_column(name)
+
+        return self.lookups.by_name[name]
+
+    def get_table(self, name):
+        return self.lookups.tables[name]
+
+    def get_column_by_index(self, column_index):
+        """Get a column by the position of its field in the layout"""
+        return self.lookups.by_index[column_index]
+
+    def get_column_by_description(self, description, heading=None,
+            subheading=None):
+        """
+        Get a column by the description of its field in the record layout,
+        and the heading and subheading of the section the field is in
+        """
+        return self.lookups.by_description[(heading, subheading, description)]
+
+    def get_indexes(self):
+        """Get (tabledef, Index) tuples for the indexes of every table"""
+        return [(tabledef, index) for tabledef in self.tables
+            for index in self.INDEXES
+            if index.applies_to(getattr(self, 'name', None), tabledef)]
+
 
 class ColumnNamingMixin(object):
     DESCRIPTION_FILTERS = [
@@ -247,18 +589,20 @@ class ColumnNamingMixin(object):
 
 
 class ReportCardSchema(ColumnNamingMixin, BaseSchema):
+    INDEXES = [
+        Index('county', columns=['county']),
+    ]
+
     def from_file(self, f):
         # Create the table definition
         table = Table(self.name)
         self._tables.append(table)
 
         # For every row in the file ...
-        workbook = xlrd.open_workbook(file_contents=f.read())
+        workbook = open_workbook(f)
         sheet = workbook.sheet_by_index(0)
 
-        for i in range(sheet.nrows):
-            row = sheet.row(i)
-
+        for row in sheet.get_rows():
             # The first column is not a number, that means it's a heading
             # or a subheading. Ignore it.
             if row[0].ctype != XL_CELL_NUMBER:
@@ -278,9 +622,12 @@ class ReportCardSchema(ColumnNamingMixin, BaseSchema):
 
             # Add the column to a table definition
             columndef = Column(column_index=int(row[0].value) - 1, name=column_name,
-                column_type=column_type, primary_key=primary_key)
+                column_type=column_type, primary_key=primary_key,
+                description=row[5].value.strip())
             table.add_column(columndef)
 
+        self.reset_lookups()
+
     @classmethod
     def get_column_name(cls, row):
         # Grab cells needed to make the column name
@@ -340,12 +687,7 @@ class ReportCardSchema2016(ReportCardSchema):
 
 def get_report_card_schema(year):
     """Get a schema class for a particular year's data"""
-    if year == 2015:
-        return ReportCardSchema2015()
-    elif year == 2016:
-        return ReportCardSchema2016()
-
-    raise ValueError("No schema found for {}".format(year))
+    return get_schema('report_card', year)
 
 class AssessmentSchema(BaseSchema):
     # Table name to hold basic metadata about schools (RCDTS id, name, etc)
@@ -356,6 +698,14 @@ class AssessmentSchema(BaseSchema):
     # use something explicit and clear.
     SCHOOL_ID_COLUMN_NAME = "school_id"
 
+    # The record layout doesn't mark a primary key, so none of the tables
+    # has one.  Every table has a copy of the school_id column that queries
+    # join on.
+    INDEXES = [
+        Index('school_id', columns=[SCHOOL_ID_COLUMN_NAME]),
+        Index('county', columns=['county']),
+    ]
+
     # Headings and subheadings in the record layout file.
 
     # These will be used to break columns into separate tables in a way that
@@ -530,7 +880,7 @@ class AssessmentSchema(BaseSchema):
         #
         # Some rows act as headings, which can be identified when the first
         # column is not a number
-        workbook = xlrd.open_workbook(file_contents=f.read())
+        workbook = open_workbook(f)
         sheet = self.get_sheet(workbook)
 
         column_index = 0
@@ -542,8 +892,7 @@ class AssessmentSchema(BaseSchema):
         # anything related to assesment
         table = Table(self.name + "_" + self.SCHOOLS_TABLE_NAME)
 
-        for i in range(sheet.nrows):
-            row = sheet.row(i)
+        for i, row in enumerate(sheet.get_rows()):
             # The first column is not a number, that means it's a heading
             # or a subheading
             if row[0].ctype != XL_CELL_NUMBER:
@@ -590,17 +939,18 @@ class AssessmentSchema(BaseSchema):
             col = Column(
                column_index=column_index,
                name=column_name,
-               column_type=get_column_type(row[6].value)
+               column_type=get_column_type(row[6].value),
+               description=row[5].value.strip(),
+               heading=heading,
+               subheading=subheading
             )
 
             # Add this column to the tables list of columns
-            # and an overall list of columns
+            # and an overall list of columns.  Columns can be looked up by
+            # name, index or description with the get_column methods.
             table.add_column(col)
             self._columns.append(col)
 
-            # TODO: Should we build a lookup table of columns based on column
-            # descriptions or indices in the record layout?
-
             if column_name == self.SCHOOL_ID_COLUMN_NAME:
                 school_id_column = col
 
@@ -609,6 +959,7 @@ class AssessmentSchema(BaseSchema):
         # Add the last discovered table to the schema's list
         # of tables
         self._tables.append(table)
+        self.reset_lookups()
 
 
 class AssessmentSchema2015(ColumnNamingMixin, AssessmentSchema):
@@ -631,12 +982,7 @@ class AssessmentSchema2016(ColumnNamingMixin, AssessmentSchema):
 
 def get_assessment_schema(year):
     """Get a schema class for a particular year's data"""
-    if year == 2015:
-        return AssessmentSchema2015()
-    elif year == 2016:
-        return AssessmentSchema2016()
-
-    raise ValueError("No schema found for {}".format(year))
+    return get_schema('assessment', year)
 
 
 class PARCCParticipationSchema2015(BaseSchema):
@@ -650,6 +996,16 @@ class PARCCParticipationSchema2015(BaseSchema):
     """
     name = 'parcc_participation_2015'
 
+    # best_worst_performers_query filters on the share of students tested
+    # and on county
+    INDEXES = [
+        Index('county', columns=['county']),
+        Index('tested_ratio_ela', table='parcc_participation_2015',
+            expression='(CAST(tested_ela AS float) / tested_enrollment_ela)'),
+        Index('tested_ratio_math', table='parcc_participation_2015',
+            expression='(CAST(tested_math AS float) / tested_enrollment_math)'),
+    ]
+
     def __init__(self):
         self._tables = []
 
@@ -703,8 +1059,4 @@ class PARCCParticipationSchema2015(BaseSchema):
 
 def get_parcc_participation_schema(year):
     """Get a schema class for a particular year's data"""
-
-    if year == 2015:
-        return PARCCParticipationSchema2015()
-
-    raise ValueError("No schema found for {}".format(year))
+    return get_schema('parcc_participation', year)
@@ -0,0 +1,152 @@
+"""
+Cache parsed schemas on disk
+
+Parsing a record layout spreadsheet means opening the workbook and running
+every column description through the column naming filters.  The result
+only depends on the contents of the layout file and the schema class, so it
+is saved as a small JSON file named after a hash of both.  Changing the
+layout file, or upgrading this package, results in a different cache file.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+
+from ilreportcard.version import __version__
+
+from . import COLUMN_TYPES, Column, Table, default_converter
+
+
+# Bump this when the format of the cache files changes
+CACHE_FORMAT_VERSION = 2
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+    'ilreportcard', 'schema')
+
+
+def get_cache_key(schema, contents):
+    """Get a key identifying a schema class parsed from a layout file"""
+    h = hashlib.sha1()
+    h.update(contents)
+    h.update("{}.{}:{}:{}".format(type(schema).__module__,
+        type(schema).__name__, __version__,
+        CACHE_FORMAT_VERSION).encode('utf-8'))
+    return h.hexdigest()
+
+
+def schema_to_dict(schema):
+    """
+    Serialize a schema's tables and columns to a dictionary
+
+    Columns are stored as [column_index, name, column_type, primary_key,
+    description, heading, subheading] lists. The schema's list of columns is stored as (table, column)
+    positions so that columns shared with the tables are restored as the
+    same objects.
+
+    Raises ValueError if a column has a converter other than the default,
+    since functions can't be serialized.
+
+    """
+    positions = {}
+    tables = []
+
+    for i, table in enumerate(schema.tables):
+        columns = []
+        for j, column in enumerate(table.columns):
+            if column.converter is not default_converter:
+                raise ValueError("Column '{}' has a custom converter".format(
+                    column.name))
+
+            positions[id(column)] = [i, j]
+            columns.append([column.column_index, column.name,
+                column.column_type.name, column.primary_key,
+                column.description, column.heading, column.subheading])
+
+        tables.append({'name': table.name, 'columns': columns})
+
+    return {
+        'tables': tables,
+        'columns': [positions[id(c)] for c in schema.columns],
+    }
+
+
+def schema_from_dict(schema, data):
+    """Populate a schema's tables and columns from schema_to_dict's output"""
+    tables = []
+
+    for tabledata in data['tables']:
+        table = Table(tabledata['name'])
+        for (column_index, name, column_type, primary_key, description,
+                heading, subheading) in tabledata['columns']:
+            table.add_column(Column(column_index=column_index, name=name,
+                column_type=COLUMN_TYPES[column_type],
+                primary_key=primary_key, description=description,
+                heading=heading, subheading=subheading))
+        tables.append(table)
+
+    schema._tables = tables
+    schema._columns = [tables[i].columns[j] for i, j in data['columns']]
+    schema.reset_lookups()
+
+    return schema
+
+
+def write_cache_file(path, data):
+    """Write a cache file so readers never see a partially written file"""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def from_file_cached(schema, f, cache_dir=DEFAULT_CACHE_DIR):
+    """
+    Load a schema from a layout file, using a cached copy when possible
+
+    Args:
+
+        schema: Schema instance whose from_file method parses the layout.
+        f: File-like object containing the record layout spreadsheet.
+        cache_dir: Directory where parsed schemas are cached.
+
+    Returns the schema.
+
+    """
+    contents = f.read()
+    path = os.path.join(cache_dir, get_cache_key(schema, contents) + '.json')
+
+    try:
+        with open(path, 'r') as cache_file:
+            data = json.load(cache_file)
+    except IOError:
+        data = None
+    except ValueError:
+        logging.warning("Ignoring invalid schema cache file {}".format(path))
+        data = None
+
+    if data is not None:
+        logging.info("Loading schema from cache file {}".format(path))
+        return schema_from_dict(schema, data)
+
+    schema.from_file(io.BytesIO(contents))
+
+    try:
+        data = schema_to_dict(schema)
+    except ValueError as e:
+        logging.info("Not caching schema: {}".format(e))
+        return schema
+
+    logging.info("Writing schema cache file {}".format(path))
+    write_cache_file(path, data)
+
+    return schema
@@ -7,58 +7,131 @@ constraints of column names for database engines.
 """
 import re
 
+# Filter building blocks
+
+class RegexFilter(object):
+    """Filter that replaces matches of a precompiled regular expression"""
+    def __init__(self, pattern, repl, flags=0):
+        self.regex = re.compile(pattern, flags)
+        self.repl = repl
+
+    def __call__(self, s):
+        return self.regex.sub(self.repl, s)
+
+
+class ReplaceFilter(object):
+    """Filter that replaces a literal substring"""
+    def __init__(self, old, new):
+        self.old = old
+        self.new = new
+
+    def __call__(self, s):
+        return s.replace(self.old, self.new)
+
+
+def strings_overlap(a, b):
+    """
+    Check whether one string contains the other, or the end of one is the
+    start of the other
+    """
+    if a in b or b in a:
+        return True
+
+    return any(a.endswith(b[:i]) or b.endswith(a[:i])
+        for i in range(1, min(len(a), len(b))))
+
+
+class MultiReplaceFilter(object):
+    """
+    Several literal replacements made in one pass
+
+    The substrings are matched with a single compiled alternation and their
+    replacements looked up in a dictionary.  This gives the same result as
+    replacing them one after another only if none of the substrings overlap
+    each other or the replacements made before them.  Check with
+    can_fuse().
+
+    FilterPipeline fuses adjacent ReplaceFilters into these.
+
+    """
+    def __init__(self, replacements):
+        self.replacements = tuple(replacements)
+        self.lookup = dict(self.replacements)
+        self.regex = re.compile('|'.join(re.escape(old)
+            for old, new in self.replacements))
+
+    @classmethod
+    def can_fuse(cls, replacements, old):
+        """
+        Check whether a replacement made after some others can be made in
+        the same pass
+        """
+        for earlier_old, earlier_new in replacements:
+            if (strings_overlap(earlier_old, old) or
+                    strings_overlap(earlier_new, old)):
+                return False
+
+        return True
+
+    def __call__(self, s):
+        return self.regex.sub(lambda match: self.lookup[match.group(0)], s)
+
+
 # Name cleaning/shortening functions
 
-def replace_percent_sign(s):
-    return re.sub(r'^%( OF){0,1}', 'PCT', s, flags=re.I)
+replace_percent_sign = RegexFilter(r'^%( OF){0,1}', 'PCT', flags=re.I)
+
+replace_number_symbol = ReplaceFilter('#', 'NUM')
+
+abbreviate_percent = RegexFilter(r'PERCENT(AGE){0,1}', 'PCT', flags=re.I)
+
+abbreviate_credit = RegexFilter(r'CREDIT', 'CDT', flags=re.I)
+
+remove_and = RegexFilter(r'\s+AND\s+', ' ', flags=re.I)
+
+remove_for = RegexFilter(r'\s+FOR\s+', ' ', flags=re.I)
 
-def replace_number_symbol(s):
-    return s.replace('#', 'NUM')
+remove_of = RegexFilter(r'\s+OF\s+', ' ', flags=re.I)
 
-def abbreviate_percent(s):
-    return re.sub(r'PERCENT(AGE){0,1}', 'PCT', s, flags=re.I)
+remove_yet = RegexFilter(r'\s+YET\s+', ' ', flags=re.I)
 
-def abbreviate_credit(s):
-    return re.sub(r'CREDIT', 'CDT', s, flags=re.I)
+remove_composite = RegexFilter(r'\s+COMPOSITE\s+', ' ', flags=re.I)
 
-def remove_and(s):
-    return re.sub(r'\s+AND\s+', ' ', s, flags=re.I)
+remove_students = RegexFilter(r'\s+STUDENTS\s*', ' ', flags=re.I)
 
-def remove_for(s):
-    return re.sub(r'\s+FOR\s+', ' ', s, flags=re.I)
+fix_particially = ReplaceFilter('PARTICIALLY', 'PARTIALLY')
 
-def remove_of(s):
-    return re.sub(r'\s+OF\s+', ' ', s, flags=re.I)
+fix_averge = ReplaceFilter('AVERGE', 'AVERAGE')
 
-def remove_yet(s):
-    return re.sub(r'\s+YET\s+', ' ', s, flags=re.I)
+shorten_expectations = ReplaceFilter('EXPECTATIONS', 'EXPECTNS')
 
-def remove_composite(s):
-    return re.sub(r'\s+COMPOSITE\s+', ' ', s, flags=re.I)
+shorten_subregion = ReplaceFilter('SUBREGION', 'SUBRGN')
 
-def remove_students(s):
-    return re.sub(r'\s+STUDENTS\s*', ' ', s, flags=re.I)
+shorten_native_hawaiian = ReplaceFilter('NATIVE HAWAIIAN AND OTHERS', 'HAWAIIAN')
 
-def fix_particially(s):
-    return s.replace('PARTICIALLY', 'PARTIALLY')
+shorten_average = ReplaceFilter('AVERAGE', 'AVG')
 
-def fix_averge(s):
-    return s.replace('AVERGE', 'AVERAGE')
+shorten_physical_education = ReplaceFilter('PHYSICAL EDUCATION', 'PHYS ED')
 
-def shorten_expectations(s):
-    return s.replace('EXPECTATIONS', 'EXPECTNS')
 
-def shorten_subregion(s):
-    return s.replace('SUBREGION', 'SUBRGN')
+NUMBER_WORDS = {
+  "ONE": '1',
+  "TWO": '2',
+  "THREE": '3',
+  "FOUR": '4',
+  "FIVE": '5',
+  "SIX": '6',
+  "SEVEN": '7',
+  "EIGHT": '8',
+  "NINE": '9',
+}
 
-def shorten_native_hawaiian(s):
-    return s.replace('NATIVE HAWAIIAN AND OTHERS', 'HAWAIIAN')
+NUMBER_WORD_RE = re.compile(r'\s*({})\s+'.format("|".join(NUMBER_WORDS.keys())))
 
-def shorten_average(s):
-    return s.replace('AVERAGE', 'AVG')
 
-def shorten_physical_education(s):
-    return s.replace('PHYSICAL EDUCATION', 'PHYS ED')
+def replace_number_word(m):
+    return " " + NUMBER_WORDS[m.group(1)] + " "
+
 
 def number_word_to_numeral(s):
     """
@@ -69,28 +142,88 @@ def number_word_to_numeral(s):
     For a more robust approach, cosnider one of the strategies mentioned at
     http://stackoverflow.com/questions/493174/is-there-a-way-to-convert-number-words-to-integers-python
     """
-    number_words = {
-      "ONE": '1',
-      "TWO": '2',
-      "THREE": '3',
-      "FOUR": '4',
-      "FIVE": '5',
-      "SIX": '6',
-      "SEVEN": '7',
-      "EIGHT": '8',
-      "NINE": '9',
-    }
-
-    def replace_number_word(m):
-        return " " + number_words[m.group(1)] + " "
-
-    pattern = r'\s*({})\s+'.format("|".join(number_words.keys()))
-    return re.sub(pattern, replace_number_word, s)
+    return NUMBER_WORD_RE.sub(replace_number_word, s)
 
-def apply_filters(s, filters=[]):
-    cleaned = s
-    for fn in filters:
-        cleaned = fn(cleaned)
 
-    return cleaned
+class FilterPipeline(object):
+    """
+    A list of filters prepared to be applied to many strings
+
+    Adjacent literal replacements are fused into a single pass where that
+    doesn't change their result, and results are memoized, since the same descriptions and subgroup specifiers repeat
+    throughout a record layout.  Filters must be pure functions of their
+    input for the memoized results to be correct.
+
+    """
+    # Bound on the number of memoized results
+    MAX_CACHE_SIZE = 20000
+
+    def __init__(self, filters):
+        self.filters = tuple(filters)
+        self.steps = self.fuse(self.filters)
+        self._cache = {}
+
+    @classmethod
+    def fuse(cls, filters):
+        steps = []
+        replacements = []
+
+        for fn in filters:
+            if isinstance(fn, ReplaceFilter):
+                if not MultiReplaceFilter.can_fuse(replacements, fn.old):
+                    steps.append(cls.replacement_step(replacements))
+                    replacements = []
+
+                replacements.append((fn.old, fn.new))
+                continue
+
+            if replacements:
+                steps.append(cls.replacement_step(replacements))
+                replacements = []
+
+            steps.append(fn)
+
+        if replacements:
+            steps.append(cls.replacement_step(replacements))
 
+        return tuple(steps)
+
+    @classmethod
+    def replacement_step(cls, replacements):
+        if len(replacements) == 1:
+            return ReplaceFilter(*replacements[0])
+
+        return MultiReplaceFilter(replacements)
+
+    def __call__(self, s):
+        try:
+            return self._cache[s]
+        except KeyError:
+            pass
+
+        cleaned = s
+        for fn in self.steps:
+            cleaned = fn(cleaned)
+
+        if len(self._cache) >= self.MAX_CACHE_SIZE:
+            self._cache.clear()
+        self._cache[s] = cleaned
+
+        return cleaned
+
+
+_pipelines = {}
+
+
+def compile_filters(filters):
+    """Get a FilterPipeline for a list of filters, reusing prior pipelines"""
+    key = tuple(filters)
+    try:
+        return _pipelines[key]
+    except KeyError:
+        pipeline = _pipelines[key] = FilterPipeline(key)
+        return pipeline
+
+
+def apply_filters(s, filters=[]):
+    return compile_filters(filters)(s)
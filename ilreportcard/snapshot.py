@@ -0,0 +1,440 @@
+"""
+Save converted data to a binary file that can be memory-mapped
+
+Parsing a data file and converting every value takes most of the time of a
+load, and gives the same rows every time the file is loaded.  A snapshot
+stores the converted rows of each of a schema's tables by column, in the
+same layout as a ColumnStore:
+
+* Integers, floats and booleans are fixed-width little-endian arrays.
+* Text columns are arrays of codes into a dictionary of distinct values,
+  stored as offsets into the concatenated UTF-8 encoded values.
+* Every column has a bitmap with a bit set for each null value.
+
+The file starts with a magic string and the offset and length of a JSON
+header, which is written after the data and describes where each array is.
+Arrays start on 8-byte boundaries.  Opening a snapshot maps the file into
+memory and wraps the arrays in memoryviews, so nothing is read or copied
+until values are used.  Python 2 can't make memoryviews of a mapped file, so
+there the arrays are copied when the snapshot is opened.  The header also records the size and modification
+time of the data file, so a loader can tell whether a snapshot is still up
+to date.
+"""
+from array import array
+from collections import OrderedDict
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+
+from ilreportcard.columnstore import (ArrayColumn, BooleanColumn,
+    ColumnTable, StringColumn)
+from ilreportcard.compat import (INT64_TYPECODE, array_from_bytes,
+    array_to_bytes, get_native_typecode)
+
+
+MAGIC = b'ILSNAP1\n'
+
+# Bump this when the layout of snapshot files changes
+SNAPSHOT_FORMAT_VERSION = 1
+
+# Offset and length of the header
+HEADER_POSITION = struct.Struct('<QQ')
+
+ALIGNMENT = 8
+
+LITTLE_ENDIAN = sys.byteorder == 'little'
+
+# Whether arrays can be read straight from the mapped file
+ZERO_COPY = LITTLE_ENDIAN and hasattr(memoryview, 'cast')
+
+# Number of rows in each batch read from a snapshot by a loader
+DEFAULT_BATCH_SIZE = 10000
+
+
+def get_source_info(f):
+    """
+    Identify the data file a snapshot is made from
+
+    Returns a dictionary with the file's size and modification time, or None
+    if f isn't a file on disk.
+
+    """
+    path = getattr(f, 'name', None)
+    if path is None or not os.path.isfile(path):
+        return None
+
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+
+def get_column_type(column):
+    if isinstance(column, StringColumn):
+        return 's'
+
+    if isinstance(column, BooleanColumn):
+        return 'b'
+
+    if column.values.typecode == INT64_TYPECODE:
+        # Python 2 uses 'l' for 64-bit integers
+        return 'q'
+
+    return column.values.typecode
+
+
+def get_table_layout(tables):
+    """Get the names and types of the columns of ColumnTables"""
+    return [[table.name, [[name, get_column_type(column)]
+            for name, column in table.columns.items()]]
+        for table in tables]
+
+
+def get_schema_layout(schema):
+    return get_table_layout(ColumnTable.from_tabledef(tabledef)
+        for tabledef in schema.tables)
+
+
+class SnapshotFileWriter(object):
+    def __init__(self, f):
+        self.f = f
+        f.write(MAGIC)
+        f.write(HEADER_POSITION.pack(0, 0))
+
+    def write(self, data):
+        """Write an aligned section and return its (offset, length)"""
+        offset = self.f.tell()
+        padding = -offset % ALIGNMENT
+        self.f.write(b'\0' * padding)
+        self.f.write(data)
+        return offset + padding, len(data)
+
+    def write_array(self, values):
+        if not LITTLE_ENDIAN:
+            values = array(values.typecode, values)
+            values.byteswap()
+
+        return self.write(array_to_bytes(values))
+
+    def write_column(self, column):
+        info = {
+            'name': column.name,
+            'type': get_column_type(column),
+            'null_count': column.null_count,
+            'nulls': self.write(bytes(column.nulls)),
+            'values': self.write_array(column.values),
+        }
+
+        if isinstance(column, StringColumn):
+            # Python 2 loaders give byte strings, which are written as they
+            # are and read back as text
+            encoded = [value if isinstance(value, bytes)
+                else value.encode('utf-8') for value in column.dictionary]
+            offsets = array(get_native_typecode('Q'), [0])
+            for value in encoded:
+                offsets.append(offsets[-1] + len(value))
+
+            info['dictionary_offsets'] = self.write_array(offsets)
+            info['dictionary'] = self.write(b''.join(encoded))
+
+        return info
+
+    def close(self, header):
+        data = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        offset, length = self.write(data)
+        self.f.seek(len(MAGIC))
+        self.f.write(HEADER_POSITION.pack(offset, length))
+
+
+def write_snapshot(path, tables, source=None):
+    """
+    Write tables to a snapshot file
+
+    Args:
+
+        path: Path of the snapshot file.  It's written to a temporary file
+            that is renamed when it's complete, so readers never see a
+            partly written snapshot.
+        tables: List of ColumnTables, such as the values of a ColumnStore's
+            tables.
+        source: Dictionary returned by get_source_info() for the data file
+            the tables were loaded from.
+
+    """
+    tables = list(tables)
+    dirname = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            writer = SnapshotFileWriter(f)
+            header = {
+                'version': SNAPSHOT_FORMAT_VERSION,
+                'source': source,
+                'layout': get_table_layout(tables),
+                'tables': [{
+                    'name': table.name,
+                    'rows': len(table),
+                    'columns': [writer.write_column(column)
+                        for column in table.columns.values()],
+                } for table in tables],
+            }
+            writer.close(header)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+    logging.info("Wrote snapshot of {} tables to {}".format(len(tables),
+        path))
+
+
+class SnapshotColumn(object):
+    """
+    A column of a snapshot, backed by memoryviews of the mapped file
+
+    Has the same interface as the columns of a ColumnStore, so snapshot
+    tables are ColumnTables.  take() copies values into an in-memory column.
+
+    """
+    def __init__(self, name, column_type, values, nulls, null_count):
+        self.name = name
+        self.column_type = column_type
+        self.values = values
+        self.nulls = nulls
+        self.null_count = null_count
+
+    def empty(self):
+        if self.column_type == 'b':
+            return BooleanColumn(self.name)
+
+        return ArrayColumn(self.name, self.column_type)
+
+    def decode(self, value):
+        if self.column_type == 'b':
+            return bool(value)
+
+        return value
+
+    def is_null(self, i):
+        return bool(self.nulls[i >> 3] & (1 << (i & 7)))
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        if self.is_null(i):
+            return None
+
+        return self.decode(self.values[i])
+
+    def __iter__(self):
+        for start in range(0, len(self), DEFAULT_BATCH_SIZE):
+            for value in self.slice(start, start + DEFAULT_BATCH_SIZE):
+                yield value
+
+    def slice(self, start, stop):
+        """Get a list of the values of some consecutive rows"""
+        stop = min(stop, len(self))
+        values = [self.decode(v) for v in self.values[start:stop]]
+        if self.null_count:
+            for i in range(start, stop):
+                if self.is_null(i):
+                    values[i - start] = None
+
+        return values
+
+    def take(self, indexes):
+        column = self.empty()
+        for i in indexes:
+            column.append(self[i])
+
+        return column
+
+    @property
+    def nbytes(self):
+        return self.values.itemsize * len(self.values) + len(self.nulls)
+
+
+class SnapshotStringColumn(SnapshotColumn):
+    """A text column of a snapshot, whose dictionary is decoded when it's
+    first used"""
+    def __init__(self, name, values, nulls, null_count, offsets, data):
+        super(SnapshotStringColumn, self).__init__(name, 's', values, nulls,
+            null_count)
+        self._offsets = offsets
+        self._data = data
+        self._dictionary = None
+
+    @property
+    def dictionary(self):
+        if self._dictionary is None:
+            offsets = self._offsets
+            self._dictionary = [
+                bytes(self._data[offsets[i]:offsets[i + 1]]).decode('utf-8')
+                for i in range(len(offsets) - 1)]
+
+        return self._dictionary
+
+    def empty(self):
+        return StringColumn(self.name)
+
+    def decode(self, value):
+        return self.dictionary[value]
+
+    @property
+    def nbytes(self):
+        return (super(SnapshotStringColumn, self).nbytes +
+            self._offsets.itemsize * len(self._offsets) + len(self._data))
+
+
+class Snapshot(object):
+    """
+    A memory-mapped snapshot file
+
+    Args:
+
+        path: Path of the snapshot file.
+
+    tables is an ordered dictionary mapping table names to ColumnTables
+    whose columns read from the mapped file.  They can't be used after the
+    snapshot is closed.
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self._views = []
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            if self._mmap[:len(MAGIC)] != MAGIC:
+                raise ValueError("{} is not a snapshot file".format(path))
+
+            if ZERO_COPY:
+                self._buffer = memoryview(self._mmap)
+                self._views.append(self._buffer)
+            offset, length = HEADER_POSITION.unpack_from(self._mmap,
+                len(MAGIC))
+            self.header = json.loads(
+                self._mmap[offset:offset + length].decode('utf-8'))
+            if self.header['version'] != SNAPSHOT_FORMAT_VERSION:
+                raise ValueError("Unsupported snapshot version {}".format(
+                    self.header['version']))
+
+            self.tables = OrderedDict(
+                (t['name'], ColumnTable(t['name'], [self.get_column(c)
+                    for c in t['columns']]))
+                for t in self.header['tables'])
+        except Exception:
+            self.close()
+            raise
+
+    def get_view(self, section, typecode=None):
+        offset, length = section
+        if not ZERO_COPY:
+            data = self._mmap[offset:offset + length]
+            if typecode is None:
+                return bytearray(data)
+
+            values = array_from_bytes(get_native_typecode(typecode), data)
+            if not LITTLE_ENDIAN:
+                values.byteswap()
+
+            return values
+
+        view = self._buffer[offset:offset + length]
+        self._views.append(view)
+        if typecode is None:
+            return view
+
+        view = view.cast(typecode)
+        self._views.append(view)
+        return view
+
+    def get_column(self, info):
+        nulls = self.get_view(info['nulls'])
+        if info['type'] == 's':
+            return SnapshotStringColumn(info['name'],
+                self.get_view(info['values'], 'I'), nulls, info['null_count'],
+                self.get_view(info['dictionary_offsets'], 'Q'),
+                self.get_view(info['dictionary']))
+
+        return SnapshotColumn(info['name'], info['type'],
+            self.get_view(info['values'], info['type']), nulls,
+            info['null_count'])
+
+    @property
+    def source(self):
+        return self.header['source']
+
+    def __getitem__(self, name):
+        return self.tables[name]
+
+    def matches(self, schema, source):
+        """
+        Check whether the snapshot has a schema's tables and was made from a
+        data file
+
+        Args:
+
+            schema: Schema whose tables the snapshot should have.
+            source: Dictionary returned by get_source_info() for the data
+                file.
+
+        """
+        return (source is not None and self.source == source and
+            self.header['layout'] == get_schema_layout(schema))
+
+    def iter_batches(self, batch_size=DEFAULT_BATCH_SIZE):
+        """
+        Yield batches of rows, like a loader's iter_batches()
+
+        Each batch has a list of row tuples for each table.
+
+        """
+        tables = list(self.tables.values())
+        num_rows = max([len(table) for table in tables] or [0])
+        for start in range(0, num_rows, batch_size):
+            stop = start + batch_size
+            yield [list(zip(*[column.slice(start, stop)
+                    for column in table.columns.values()]))
+                for table in tables]
+
+    def close(self):
+        for view in reversed(self._views):
+            view.release()
+
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def open_matching_snapshot(path, schema, source):
+    """
+    Open a snapshot if it exists and is up to date with a data file
+
+    Returns None if there's no snapshot at path, or it's out of date.
+
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        snapshot = Snapshot(path)
+    except ValueError as e:
+        logging.warning("Ignoring snapshot {}: {}".format(path, e))
+        return None
+
+    if snapshot.matches(schema, source):
+        return snapshot
+
+    logging.info("Snapshot {} is out of date".format(path))
+    snapshot.close()
+    return None
@@ -1,21 +1,30 @@
 """
 Command line tasks for working with report card data
+
+invoke imports this module to list the tasks or show their help, so only
+the standard library, invoke and a few small modules are imported here.
+SQLAlchemy, the database driver, the schemas and the loaders are imported
+by the tasks that use them, and a year's schema and loader classes are
+found through ilreportcard.registry.
 """
 import logging
+import os
 
 from invoke import task
 
-from sqlalchemy import (create_engine, MetaData)
-
-from ilreportcard.schema import (get_assessment_schema,
-    get_parcc_participation_schema, get_report_card_schema)
-from ilreportcard.load import (get_assessment_loader,
-    get_parcc_participation_loader, get_report_card_loader)
+from ilreportcard.metrics import LoadMetrics
+from ilreportcard.registry import get_loader, get_schema
 
 logging.basicConfig(level=logging.INFO)
 
 DEFAULT_DATABASE = "postgresql://localhost:5432/school_report_card"
 
+# Directory where parsed record layouts are cached.  If it isn't set,
+# layouts are cached in ilreportcard.schema.cache.DEFAULT_CACHE_DIR.  Pass
+# an empty string to the tasks' --schema-cache option to always parse the
+# layout file.
+DEFAULT_SCHEMA_CACHE = os.environ.get('ILREPORTCARD_SCHEMA_CACHE')
+
 # TODO: Is invoke the best task runner to use? I like that it has
 # dependencies between tasks, but its discovery mechanism for the
 # tasks module is kind of annoying.
@@ -23,10 +32,48 @@ DEFAULT_DATABASE = "postgresql://localhost:5432/school_report_card"
 # TODO: Document arguments to these task functions.  For now, see
 # the examples in the README
 
+def schema_from_layout(schema, layout, schema_cache=DEFAULT_SCHEMA_CACHE,
+        metrics=None):
+    from ilreportcard.schema.cache import DEFAULT_CACHE_DIR, from_file_cached
+
+    metrics = metrics if metrics is not None else LoadMetrics()
+    if schema_cache is None:
+        schema_cache = DEFAULT_CACHE_DIR
+
+    with metrics.phase('schema') as phase:
+        with open(layout, 'rb') as f:
+            if schema_cache:
+                from_file_cached(schema, f, schema_cache)
+            else:
+                schema.from_file(f)
+
+            phase['bytes'] = f.tell()
+
+    return schema
+
+
+def write_metrics(metrics, path):
+    """Write a load's metrics as JSON to a file, or stdout if path is '-'"""
+    if path == '-':
+        print(metrics.to_json(indent=2))
+        return
+
+    with open(path, 'w') as f:
+        f.write(metrics.to_json(indent=2))
+
+
 def create_tables_from_schema(schema, database, drop=False):
+    from sqlalchemy import create_engine, MetaData
+
+    from ilreportcard.load.incremental import clear_row_hashes
+
+    # Secondary indexes are built by load_data, after the data is loaded
     engine = create_engine(database)
     metadata = MetaData()
 
+    if drop:
+        clear_row_hashes(engine, [tabledef.name for tabledef in schema.tables])
+
     for tabledef in schema.tables:
         table = tabledef.as_sqlalchemy(metadata)
         if drop:
@@ -37,71 +84,264 @@ def create_tables_from_schema(schema, database, drop=False):
         table.create(engine, checkfirst=True)
 
 
-def load_data(loader, f, database, flush):
-    engine = create_engine(database)
+def load_data(loader, schema, f, database, flush, indexes=True):
+    """
+    Load a data file and build the schema's secondary indexes
+
+    When flushing, existing secondary indexes are dropped first, so that
+    they're built once instead of updated for every inserted row.  Staged
+    loads build the indexes themselves.
+
+    Afterwards, the summary views that read from the loaded tables are
+    refreshed.  Staged loads recreate them when they swap the tables in.
+
+    """
+    from sqlalchemy import create_engine, MetaData
+
+    from ilreportcard.load.indexes import (analyze_tables, create_indexes,
+        drop_indexes)
+    from ilreportcard.query import refresh_summary_views
+
+    engine_options = {}
+    if loader.table_workers > 1:
+        # Leave room in the pool for the loader's own connection
+        engine_options['pool_size'] = loader.table_workers + 1
+
+    engine = create_engine(database, **engine_options)
     metadata = MetaData()
 
     with engine.connect() as connection:
+        build_indexes = indexes and not loader.staging
+        if build_indexes and flush:
+            drop_indexes(connection, schema.get_indexes())
+
         loader.load(f, metadata, connection, flush)
 
+        if build_indexes:
+            create_indexes(connection, schema.get_indexes())
+            analyze_tables(connection, [t.name for t in schema.tables])
+
+        if not loader.staging:
+            for year in refresh_summary_views(connection,
+                    [t.name for t in schema.tables]):
+                logging.info("Refreshed summary view for {}".format(year))
+
+    if loader.incremental_counts is not None:
+        loader.metrics.context['incremental_counts'] = loader.incremental_counts
+
 
 @task
 def create_report_card_schema(year, layout, database=DEFAULT_DATABASE,
-        drop=False):
-    with open(layout, 'rb') as f:
-        schema = get_report_card_schema(int(year))
-        schema.from_file(f)
-        create_tables_from_schema(schema, database, drop=drop)
+        drop=False, schema_cache=DEFAULT_SCHEMA_CACHE):
+    schema = schema_from_layout(get_schema('report_card', year), layout,
+        schema_cache)
+    create_tables_from_schema(schema, database, drop=drop)
+
+
+def get_loader_options(batch_size=None, engine=None, workers=None,
+        table_workers=None, atomic=False, metrics=None, queue_size=None,
+        incremental=False, delete_missing=False, checkpoint=False,
+        resume=False, staging=False, snapshot=None):
+    options = {'atomic': atomic, 'metrics': metrics,
+        'incremental': incremental, 'delete_missing': delete_missing,
+        'staging': staging, 'snapshot': snapshot}
+
+    if checkpoint or resume:
+        options['checkpoint'] = checkpoint
+        options['resume'] = resume
+
+    if queue_size is not None:
+        options['queue_size'] = int(queue_size)
+
+    if table_workers is not None:
+        options['table_workers'] = int(table_workers)
+
+    if workers is not None:
+        options['workers'] = int(workers)
+
+    if engine is not None:
+        options['engine'] = engine
+
+    if batch_size is not None:
+        options['batch_size'] = int(batch_size)
+
+    return options
 
 
 @task
 def load_report_card_data(year, layout, data, flush=False,
-        database=DEFAULT_DATABASE):
-    with open(layout, 'rb') as f:
-        schema = get_report_card_schema(int(year))
-        schema.from_file(f)
+        database=DEFAULT_DATABASE, batch_size=None, engine=None,
+        workers=None, table_workers=None, atomic=False,
+        schema_cache=DEFAULT_SCHEMA_CACHE, metrics=None, queue_size=None,
+        incremental=False, delete_missing=False, checkpoint=False,
+        resume=False, staging=False, indexes=True, snapshot=None):
+    load_metrics = LoadMetrics(context={'task': 'load_report_card_data',
+        'year': int(year), 'layout': layout, 'data': data})
+    schema = schema_from_layout(get_schema('report_card', year), layout,
+        schema_cache, metrics=load_metrics)
 
     with open(data, 'r') as f:
-        loader = get_report_card_loader(int(year))
+        loader = get_loader('report_card', year,
+            **get_loader_options(batch_size=batch_size, engine=engine,
+                workers=workers, table_workers=table_workers, atomic=atomic,
+                metrics=load_metrics, queue_size=queue_size,
+                incremental=incremental, delete_missing=delete_missing,
+                checkpoint=checkpoint, resume=resume, staging=staging,
+                snapshot=snapshot))
         loader.set_schema(schema)
-        load_data(loader, f, database, flush)
+        load_data(loader, schema, f, database, flush, indexes=indexes)
+
+    if metrics:
+        write_metrics(load_metrics, metrics)
 
 
 @task
-def create_assessment_schema(year, layout, database=DEFAULT_DATABASE, drop=False):
-    with open(layout, 'rb') as f:
-        schema = get_assessment_schema(int(year))
-        schema.from_file(f)
-        create_tables_from_schema(schema, database, drop=drop)
+def create_assessment_schema(year, layout, database=DEFAULT_DATABASE, drop=False,
+        schema_cache=DEFAULT_SCHEMA_CACHE):
+    schema = schema_from_layout(get_schema('assessment', year), layout,
+        schema_cache)
+    create_tables_from_schema(schema, database, drop=drop)
 
 
 @task
 def load_assessment_data(year, layout, data,
         flush=False,
-        database=DEFAULT_DATABASE):
-    with open(layout, 'rb') as f:
-        schema = get_assessment_schema(int(year))
-        schema.from_file(f)
+        database=DEFAULT_DATABASE, batch_size=None, engine=None,
+        workers=None, table_workers=None, atomic=False,
+        schema_cache=DEFAULT_SCHEMA_CACHE, metrics=None, queue_size=None,
+        incremental=False, delete_missing=False, checkpoint=False,
+        resume=False, staging=False, indexes=True, snapshot=None):
+    load_metrics = LoadMetrics(context={'task': 'load_assessment_data',
+        'year': int(year), 'layout': layout, 'data': data})
+    schema = schema_from_layout(get_schema('assessment', year), layout,
+        schema_cache, metrics=load_metrics)
 
     with open(data, 'r') as f:
-        loader = get_assessment_loader(int(year))
+        loader = get_loader('assessment', year,
+            **get_loader_options(batch_size=batch_size, engine=engine,
+                workers=workers, table_workers=table_workers, atomic=atomic,
+                metrics=load_metrics, queue_size=queue_size,
+                incremental=incremental, delete_missing=delete_missing,
+                checkpoint=checkpoint, resume=resume, staging=staging,
+                snapshot=snapshot))
         loader.set_schema(schema)
-        load_data(loader, f, database, flush)
+        load_data(loader, schema, f, database, flush, indexes=indexes)
+
+    if metrics:
+        write_metrics(load_metrics, metrics)
 
 
 @task
 def create_parcc_participation_schema(year, database=DEFAULT_DATABASE,
         drop=False):
-    schema = get_parcc_participation_schema(int(year))
+    schema = get_schema('parcc_participation', year)
     create_tables_from_schema(schema, database, drop=drop)
 
 
 @task
 def load_parcc_participation_data(year, data, flush=False,
-        database=DEFAULT_DATABASE):
-    schema = get_parcc_participation_schema(int(year))
+        database=DEFAULT_DATABASE, engine=None, atomic=False, metrics=None,
+        incremental=False, delete_missing=False, staging=False,
+        indexes=True, snapshot=None):
+    load_metrics = LoadMetrics(context={'task': 'load_parcc_participation_data',
+        'year': int(year), 'data': data})
+    schema = get_schema('parcc_participation', year)
 
-    with open(data, 'r') as f:
-        loader = get_parcc_participation_loader(int(year))
+    with open(data, 'rb') as f:
+        loader = get_loader('parcc_participation', year,
+            **get_loader_options(engine=engine, atomic=atomic,
+                metrics=load_metrics, incremental=incremental,
+                delete_missing=delete_missing, staging=staging,
+                snapshot=snapshot))
         loader.set_schema(schema)
-        load_data(loader, f, database, flush)
+        load_data(loader, schema, f, database, flush, indexes=indexes)
+
+    if metrics:
+        write_metrics(load_metrics, metrics)
+
+
+@task
+def refresh_summary_view(year, database=DEFAULT_DATABASE, concurrently=True):
+    from sqlalchemy import create_engine
+
+    from ilreportcard.query import refresh_summary_view as refresh_view
+
+    engine = create_engine(database)
+
+    with engine.connect() as connection:
+        logging.info("Refreshing summary view for {}".format(year))
+        refresh_view(connection, int(year), concurrently=concurrently)
+
+
+def split_option(value):
+    """Split a comma-separated task option into a list"""
+    if value is None:
+        return None
+
+    return [v.strip() for v in value.split(',') if v.strip()]
+
+
+@task
+def export_query_results(query, year, output=None, format='csv',
+        compress=False, database=DEFAULT_DATABASE, chunk_size=1000,
+        rcdts_ids=None, subject='ela', order='desc', limit=50, counties=None):
+    from sqlalchemy import create_engine
+
+    from ilreportcard.export import export_query, get_export_filename
+
+    if query == 'summary':
+        query_kwargs = {'rcdts_ids': split_option(rcdts_ids)}
+    else:
+        query_kwargs = {'subject': subject, 'order': order,
+            'limit': int(limit), 'counties': split_option(counties)}
+
+    if output is None:
+        output = get_export_filename('{}_{}'.format(query, year), format,
+            compress)
+
+    engine = create_engine(database)
+
+    with engine.connect() as connection:
+        export_query(connection, query, int(year), output, format=format,
+            compress=compress, chunk_size=int(chunk_size), **query_kwargs)
+
+
+@task
+def export_schema_tables(schema, year, directory, layout=None, format='csv',
+        compress=False, database=DEFAULT_DATABASE, chunk_size=1000, workers=1,
+        schema_cache=DEFAULT_SCHEMA_CACHE):
+    from sqlalchemy import create_engine
+
+    from ilreportcard.export import export_tables
+
+    export_schema = get_schema(schema, year)
+    if layout is not None:
+        schema_from_layout(export_schema, layout, schema_cache)
+
+    workers = int(workers)
+    engine_options = {}
+    if workers > 1:
+        engine_options['pool_size'] = workers
+
+    engine = create_engine(database, **engine_options)
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    export_tables(engine, [t.name for t in export_schema.tables], directory,
+        format=format, compress=compress, chunk_size=int(chunk_size),
+        workers=workers)
+
+
+@task
+def export_snapshot_tables(snapshot, directory, format='csv', compress=False,
+        chunk_size=1000):
+    from ilreportcard.export import export_column_tables
+    from ilreportcard.snapshot import Snapshot
+
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+
+    with Snapshot(snapshot) as data:
+        export_column_tables(data.tables.values(), directory, format=format,
+            compress=compress, chunk_size=int(chunk_size))
@@ -0,0 +1,283 @@
+"""
+Read rows from Excel workbooks without loading the whole workbook
+
+xlrd parses every sheet of a workbook, and keeps a Cell object for every
+cell, before returning any rows.  For the .xlsx files ISBE publishes, this
+module instead reads the workbook's zip archive directly.  Sheets are only
+parsed when their rows are requested, and rows are parsed from the sheet's
+XML one at a time, so only the current row and the workbook's shared
+strings are kept in memory.  Styles, and any other formatting information,
+are never read.
+
+Sheets and cells have the same interface as xlrd's, for the parts of it
+that the schemas and loaders use: sheets have a get_rows() method, and
+cells have ctype and value attributes.  Numbers are floats, as in xlrd, but
+since styles aren't read, dates are numbers rather than XL_CELL_DATE cells.
+"""
+from collections import namedtuple
+import re
+from xml.etree.ElementTree import iterparse
+import zipfile
+
+# Cell types, with the same values as xlrd's
+XL_CELL_EMPTY = 0
+XL_CELL_TEXT = 1
+XL_CELL_NUMBER = 2
+XL_CELL_DATE = 3
+XL_CELL_BOOLEAN = 4
+XL_CELL_ERROR = 5
+
+Cell = namedtuple('Cell', ['ctype', 'value'])
+
+EMPTY_CELL = Cell(XL_CELL_EMPTY, '')
+
+CELL_REFERENCE_RE = re.compile(r'([A-Z]+)(\d+)')
+
+RELATIONSHIPS_NAMESPACE = ('http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships')
+
+
+def local_name(tag):
+    """Strip the namespace from an element's tag"""
+    return tag.rsplit('}', 1)[-1]
+
+
+def get_column_index(reference):
+    """Get the zero-based column index of a cell reference like 'AB12'"""
+    index = 0
+    for letter in CELL_REFERENCE_RE.match(reference).group(1):
+        index = index * 26 + ord(letter) - ord('A') + 1
+
+    return index - 1
+
+
+def get_text(elem):
+    """
+    Get the text of a shared or inline string
+
+    Rich text strings are split into runs.  Phonetic hints are left out.
+
+    """
+    parts = []
+    for child in elem:
+        name = local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.extend(t.text or '' for t in child
+                if local_name(t.tag) == 't')
+
+    return ''.join(parts)
+
+
+class Sheet(object):
+    """
+    A worksheet in an .xlsx workbook
+
+    Args:
+
+        workbook: Workbook containing the sheet.
+        name: Name of the sheet.
+        path: Path of the sheet's XML in the workbook's zip archive.
+
+    """
+    def __init__(self, workbook, name, path):
+        self.workbook = workbook
+        self.name = name
+        self.path = path
+
+    def get_cell(self, elem):
+        cell_type = elem.get('t', 'n')
+        value = None
+        for child in elem:
+            name = local_name(child.tag)
+            if name == 'v':
+                value = child.text
+            elif name == 'is':
+                value = get_text(child)
+
+        if value is None:
+            return EMPTY_CELL
+
+        if cell_type == 'n':
+            return Cell(XL_CELL_NUMBER, float(value))
+
+        if cell_type == 's':
+            value = self.workbook.shared_strings[int(value)]
+
+        if cell_type == 'b':
+            return Cell(XL_CELL_BOOLEAN, int(value))
+
+        if cell_type == 'e':
+            return Cell(XL_CELL_ERROR, value)
+
+        # Inline strings and strings from formulas.  Like xlrd, treat empty
+        # strings as empty cells.
+        if not value:
+            return EMPTY_CELL
+
+        return Cell(XL_CELL_TEXT, value)
+
+    def get_rows(self):
+        """
+        Yield each row of the sheet as a list of cells
+
+        Empty rows are skipped.  Rows are padded with empty cells to the
+        width of the sheet, when the sheet declares its dimensions, or else
+        to the width of the widest row so far.
+
+        """
+        width = 0
+        sheet_data = None
+
+        with self.workbook.open_member(self.path) as f:
+            for event, elem in iterparse(f, events=('start', 'end')):
+                name = local_name(elem.tag)
+                if event == 'start':
+                    if name == 'sheetData':
+                        sheet_data = elem
+                    continue
+
+                if name == 'dimension':
+                    last = elem.get('ref', '').split(':')[-1]
+                    if CELL_REFERENCE_RE.match(last):
+                        width = get_column_index(last) + 1
+                elif name == 'row':
+                    row = []
+                    for c in elem:
+                        if local_name(c.tag) != 'c':
+                            continue
+
+                        reference = c.get('r')
+                        if reference is not None:
+                            index = get_column_index(reference)
+                            row.extend([EMPTY_CELL] * (index - len(row)))
+
+                        row.append(self.get_cell(c))
+
+                    # Drop the parsed row so memory use doesn't grow with
+                    # the size of the sheet
+                    sheet_data.clear()
+
+                    if not row:
+                        continue
+
+                    width = max(width, len(row))
+                    if len(row) < width:
+                        row.extend([EMPTY_CELL] * (width - len(row)))
+
+                    yield row
+
+
+class Workbook(object):
+    """
+    An .xlsx workbook
+
+    Args:
+
+        f: Binary file-like object containing the workbook.  It's read as it
+            is needed, so it has to stay open while the workbook is used.
+
+    """
+    def __init__(self, f):
+        self._zip = zipfile.ZipFile(f)
+        self._shared_strings = None
+        self._sheets = None
+
+    def open_member(self, path):
+        return self._zip.open(path)
+
+    def get_relationships(self):
+        """Map relationship IDs to paths and types of the workbook's parts"""
+        relationships = {}
+        with self.open_member('xl/_rels/workbook.xml.rels') as f:
+            for event, elem in iterparse(f):
+                if local_name(elem.tag) != 'Relationship':
+                    continue
+
+                target = elem.get('Target')
+                if target.startswith('/'):
+                    path = target.lstrip('/')
+                else:
+                    path = 'xl/' + target
+
+                relationships[elem.get('Id')] = (path,
+                    elem.get('Type', '').rsplit('/', 1)[-1])
+
+        return relationships
+
+    @property
+    def sheets(self):
+        if self._sheets is None:
+            relationships = self.get_relationships()
+            self._sheets = []
+            with self.open_member('xl/workbook.xml') as f:
+                for event, elem in iterparse(f):
+                    if local_name(elem.tag) != 'sheet':
+                        continue
+
+                    relationship_id = elem.get(
+                        '{{{}}}id'.format(RELATIONSHIPS_NAMESPACE))
+                    path = relationships[relationship_id][0]
+                    self._sheets.append(Sheet(self, elem.get('name'), path))
+
+        return self._sheets
+
+    @property
+    def nsheets(self):
+        return len(self.sheets)
+
+    def sheet_names(self):
+        return [sheet.name for sheet in self.sheets]
+
+    def sheet_by_index(self, index):
+        return self.sheets[index]
+
+    def sheet_by_name(self, name):
+        for sheet in self.sheets:
+            if sheet.name == name:
+                return sheet
+
+        raise KeyError("No sheet named '{}'".format(name))
+
+    @property
+    def shared_strings(self):
+        """List of the workbook's shared strings, read the first time it's
+        needed"""
+        if self._shared_strings is None:
+            self._shared_strings = []
+            paths = [path for path, part_type
+                in self.get_relationships().values()
+                if part_type == 'sharedStrings']
+            if paths:
+                with self.open_member(paths[0]) as f:
+                    root = None
+                    for event, elem in iterparse(f, events=('start', 'end')):
+                        if root is None:
+                            root = elem
+                        elif (event == 'end' and
+                                local_name(elem.tag) == 'si'):
+                            self._shared_strings.append(get_text(elem))
+                            root.clear()
+
+        return self._shared_strings
+
+
+def open_workbook(f):
+    """
+    Open a workbook from a binary file-like object
+
+    .xlsx workbooks are read with Workbook.  Older .xls workbooks, which
+    aren't zip archives, are read with xlrd, loading sheets on demand.
+
+    """
+    start = f.tell()
+    is_zip = f.read(4) == b'PK\x03\x04'
+    f.seek(start)
+
+    if is_zip:
+        return Workbook(f)
+
+    import xlrd
+
+    return xlrd.open_workbook(file_contents=f.read(), on_demand=True)
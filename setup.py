@@ -28,6 +28,7 @@ setup(
         'SQLAlchemy>=1.0.9',
         'invoke>=0.11.1',
         'psycopg2>=2.6.1',
+        'futures>=3.0.5; python_version < "3"',
     ],
     entry_points="",
     tests_require=[
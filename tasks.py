@@ -1,3 +1,5 @@
 from ilreportcard.tasks import (create_report_card_schema,
         load_report_card_data, create_assessment_schema, load_assessment_data,
-        create_parcc_participation_schema, load_parcc_participation_data) 
+        create_parcc_participation_schema, load_parcc_participation_data,
+        refresh_summary_view, export_query_results, export_schema_tables,
+        export_snapshot_tables)
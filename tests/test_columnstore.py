@@ -0,0 +1,96 @@
+import io
+import unittest
+
+from ilreportcard.columnstore import (ArrayColumn, ColumnStore, ColumnTable,
+    StringColumn)
+from ilreportcard.load import DelimitedLoader
+from ilreportcard.schema import BaseSchema, Column, Table, COLUMN_TYPES
+
+
+class SampleSchema(BaseSchema):
+    name = 'test'
+
+    def __init__(self):
+        super(SampleSchema, self).__init__()
+
+        schools = Table('test_schools')
+        schools.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        schools.add_column(Column(column_index=1, name='county',
+            column_type=COLUMN_TYPES.STRING))
+        schools.add_column(Column(column_index=2, name='enrollment',
+            column_type=COLUMN_TYPES.INTEGER))
+        schools.add_column(Column(column_index=3, name='pct_proficient',
+            column_type=COLUMN_TYPES.FLOAT))
+
+        self._tables = [schools]
+
+
+DATA = u"""000000000000001;Cook;100;50.5
+000000000000002;Cook;200;
+000000000000003;Will;1,000;25.0
+"""
+
+
+class ColumnTestCase(unittest.TestCase):
+    def test_nulls(self):
+        column = ArrayColumn('tested', 'q')
+        for value in [1, None, 3] * 5:
+            column.append(value)
+
+        self.assertEqual(len(column), 15)
+        self.assertEqual(column.null_count, 5)
+        self.assertEqual(list(column)[:3], [1, None, 3])
+        self.assertTrue(column.is_null(13))
+        self.assertEqual(len(column.nulls), 2)
+
+    def test_string_dictionary(self):
+        column = StringColumn('county')
+        for value in ['Cook', 'Will', 'Cook', None, 'Cook']:
+            column.append(value)
+
+        self.assertEqual(column.dictionary, ['Cook', 'Will'])
+        self.assertEqual(list(column), ['Cook', 'Will', 'Cook', None, 'Cook'])
+        self.assertEqual(list(column.take([1, 3])), ['Will', None])
+
+    def test_nbytes(self):
+        column = StringColumn('county')
+        column.append(u'Will \xe9')
+        # 4 bytes for the code, 1 for the null bitmap and 7 for the UTF-8
+        # encoded value
+        self.assertEqual(column.nbytes, 12)
+
+
+class ColumnStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        schema = SampleSchema()
+        loader = DelimitedLoader()
+        loader.set_schema(schema)
+        self.store = ColumnStore(schema).load(loader, io.StringIO(DATA))
+        self.table = self.store['test_schools']
+
+    def test_load(self):
+        self.assertIsInstance(self.table, ColumnTable)
+        self.assertEqual(len(self.table), 3)
+        self.assertEqual(list(self.table['enrollment']), [100, 200, 1000])
+        self.assertEqual(list(self.table['pct_proficient']),
+            [50.5, None, 25.0])
+
+    def test_filter_and_project(self):
+        table = self.table.filter(lambda county, enrollment:
+            county == 'Cook' and enrollment > 100, 'county', 'enrollment')
+        self.assertEqual(table.project('school_id', 'enrollment').to_dicts(),
+            [{'school_id': '000000000000002', 'enrollment': 200}])
+
+    def test_group_by(self):
+        self.assertEqual(self.table.group_by('county',
+            schools=('count', None), enrollment=('sum', 'enrollment'),
+            pct_proficient=('mean', 'pct_proficient')), [
+                {'county': 'Cook', 'schools': 2, 'enrollment': 300,
+                    'pct_proficient': 50.5},
+                {'county': 'Will', 'schools': 1, 'enrollment': 1000,
+                    'pct_proficient': 25.0},
+            ])
+
+        self.assertRaises(ValueError, self.table.group_by, 'county',
+            x=('median', 'enrollment'))
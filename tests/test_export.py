@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine
+
+from ilreportcard.export import export_rows, export_tables
+from ilreportcard.export.columnar import ColumnarReader
+
+
+COLUMNS = ['school_id', 'tested', 'pct_proficient', 'charter']
+
+ROWS = [
+    ('a', 10, 50.5, True),
+    ('b', None, 20, False),
+    (u'cé', 30, None, None),
+]
+
+
+def read_csv(data):
+    """Parse UTF-8 encoded CSV data"""
+    if sys.version_info[0] == 2:
+        return [[value.decode('utf-8') for value in row]
+            for row in csv.reader(io.BytesIO(data))]
+
+    return list(csv.reader(io.StringIO(data.decode('utf-8'), newline='')))
+
+
+class ExportTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def test_csv(self):
+        path = self.path('schools.csv.gz')
+        count = export_rows(COLUMNS, iter(ROWS), path, compress=True,
+            chunk_size=2)
+        self.assertEqual(count, 3)
+
+        with gzip.open(path) as f:
+            rows = read_csv(f.read())
+
+        self.assertEqual(rows[0], COLUMNS)
+        self.assertEqual(rows[2], ['b', '', '20', 'False'])
+        self.assertEqual(rows[3], [u'cé', '30', '', ''])
+        self.assertEqual(len(rows), 4)
+
+    def test_ndjson(self):
+        path = self.path('schools.ndjson')
+        export_rows(COLUMNS, ROWS, path, format='ndjson')
+
+        with io.open(path, encoding='utf-8') as f:
+            rows = [json.loads(line) for line in f]
+
+        self.assertEqual(rows[2], {'school_id': u'cé', 'tested': 30,
+            'pct_proficient': None, 'charter': None})
+
+    def test_columnar(self):
+        path = self.path('schools.ilcol')
+        export_rows(COLUMNS, ROWS, path, format='columnar', chunk_size=2)
+
+        with open(path, 'rb') as f:
+            reader = ColumnarReader(f)
+            self.assertEqual(reader.columns, COLUMNS)
+            rows = list(reader.iter_rows())
+
+        # Integers and floats in the same row group are read as floats
+        self.assertEqual(rows, [
+            ('a', 10, 50.5, True),
+            ('b', None, 20.0, False),
+            (u'cé', 30, None, None),
+        ])
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, export_rows, COLUMNS, ROWS,
+            self.path('schools.xml'), format='xml')
+
+    def test_export_tables(self):
+        engine = create_engine('sqlite:///' + self.path('test.db'))
+        for name in ('test_a', 'test_b'):
+            engine.execute("CREATE TABLE {} (school_id TEXT PRIMARY KEY, "
+                "tested INTEGER)".format(name))
+            engine.execute("INSERT INTO {} VALUES ('2', 20), ('1', 10)".format(
+                name))
+
+        paths = export_tables(engine, ['test_a', 'test_b'], self.directory,
+            workers=2)
+        self.assertEqual(paths['test_b'], self.path('test_b.csv'))
+
+        with open(paths['test_b'], 'rb') as f:
+            self.assertEqual(read_csv(f.read()), [['school_id', 'tested'],
+                ['1', '10'], ['2', '20']])
@@ -0,0 +1,598 @@
+import decimal
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from sqlalchemy import create_engine, event, Integer, MetaData
+from sqlalchemy import Column as SAColumn, Table as SATable
+
+from ilreportcard.load import DEFAULT_BATCH_SIZE, DelimitedLoader
+from ilreportcard.load.parallel import iter_parallel_batches, split_byte_ranges
+from ilreportcard.load.pipeline import BatchPipeline
+from ilreportcard.metrics import LoadMetrics
+from ilreportcard.load.writers import (ConcurrentTableWriter, CopyWriter,
+    ValuesWriter)
+from ilreportcard.load.indexes import (analyze_tables, create_indexes,
+    drop_indexes)
+from ilreportcard.schema import BaseSchema, Column, Index, Table, COLUMN_TYPES
+
+
+class SampleSchema(BaseSchema):
+    name = 'test'
+
+    INDEXES = [
+        Index('school_name', columns=['school_name']),
+        Index('proficient', table='scores',
+            expression='(pct_proficient * enrollment)'),
+    ]
+
+    def __init__(self):
+        super(SampleSchema, self).__init__()
+
+        schools = Table('test_schools')
+        schools.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        schools.add_column(Column(column_index=1, name='school_name',
+            column_type=COLUMN_TYPES.STRING))
+
+        scores = Table('test_scores')
+        scores.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        scores.add_column(Column(column_index=2, name='enrollment',
+            column_type=COLUMN_TYPES.INTEGER))
+        scores.add_column(Column(column_index=3, name='pct_proficient',
+            column_type=COLUMN_TYPES.FLOAT))
+
+        self._tables = [schools, scores]
+
+
+def make_data(num_rows):
+    lines = []
+    for i in range(num_rows):
+        lines.append("{:015d};School {};1,{:03d};{}.5\n".format(i, i, i % 1000,
+            i % 100))
+
+    return io.StringIO(u"".join(lines))
+
+
+class DelimitedLoaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = SampleSchema()
+        self.engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(self.engine)
+
+    def load(self, f, **kwargs):
+        loader = DelimitedLoader(**kwargs)
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            loader.load(f, MetaData(), connection, flush=True)
+
+    def count(self, table_name):
+        return self.engine.execute(
+            "SELECT count(*) FROM {}".format(table_name)).scalar()
+
+    def test_load(self):
+        self.load(make_data(25))
+        self.assertEqual(self.count('test_schools'), 25)
+        self.assertEqual(self.count('test_scores'), 25)
+
+        row = self.engine.execute("SELECT enrollment, pct_proficient "
+            "FROM test_scores WHERE school_id = '000000000000003'").first()
+        self.assertEqual(tuple(row), (1003, 3.5))
+
+    def test_load_batched(self):
+        loader = DelimitedLoader(batch_size=10)
+        loader.set_schema(self.schema)
+        batches = list(loader.iter_batches(make_data(25)))
+        self.assertEqual([len(b[0]) for b in batches], [10, 10, 5])
+
+        # Batched by default, unless the batch size is 0
+        loader = DelimitedLoader()
+        self.assertEqual(loader.batch_size, DEFAULT_BATCH_SIZE)
+        loader = DelimitedLoader(batch_size=0)
+        loader.set_schema(self.schema)
+        batches = list(loader.iter_batches(make_data(25)))
+        self.assertEqual([len(b[0]) for b in batches], [25])
+
+        self.load(make_data(25), batch_size=10)
+        self.assertEqual(self.count('test_schools'), 25)
+        self.assertEqual(self.count('test_scores'), 25)
+
+    def test_flush(self):
+        self.load(make_data(5), batch_size=2)
+        self.load(make_data(5), batch_size=2)
+        self.assertEqual(self.count('test_scores'), 5)
+
+    def test_flush_parse_error(self):
+        self.load(make_data(5))
+        bad_data = io.StringIO(u"000000000000001;School 1;1,abc;1.5\n")
+        self.assertRaises(ValueError, self.load, bad_data)
+        self.assertEqual(self.count('test_scores'), 5)
+
+    def test_engines(self):
+        for engine in ('values', 'executemany', 'copy'):
+            self.load(make_data(25), batch_size=10, engine=engine)
+            self.assertEqual(self.count('test_scores'), 25)
+
+    def test_load_parallel(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'data.txt')
+            with open(path, 'w') as f:
+                f.write(make_data(25).getvalue())
+
+            with open(path, 'r') as f:
+                self.load(f, workers=2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(self.count('test_schools'), 25)
+        self.assertEqual(self.count('test_scores'), 25)
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, self.load, make_data(5), engine='bogus')
+
+
+class CopyWriterTestCase(unittest.TestCase):
+    def test_get_buffer(self):
+        buf = CopyWriter.get_buffer([
+            (u'a\tb', None, 1, 2.5, True),
+            (u'c\\d\n', 0, None, 0.1, False),
+        ])
+        self.assertEqual(buf.getvalue(),
+            u'a\\tb\t\\N\t1\t2.5\tt\n'
+            u'c\\\\d\\n\t0\t\\N\t0.1\tf\n')
+
+    def test_text_types(self):
+        # Python 2 reads native strings and can have long integers
+        buf = CopyWriter.get_buffer([
+            (b'caf\xc3\xa9\t', u'caf\xe9', 2 ** 70, decimal.Decimal('1.50')),
+        ])
+        self.assertEqual(buf.getvalue(),
+            u'caf\xe9\\t\tcaf\xe9\t1180591620717411303424\t1.50\n')
+
+
+class ValuesWriterTestCase(unittest.TestCase):
+    def test_wide_batch(self):
+        engine = create_engine('sqlite://')
+        table = SATable('wide', MetaData(),
+            *[SAColumn('col_{}'.format(i), Integer) for i in range(40)])
+        table.create(engine)
+        rows = [tuple(range(i, i + 40)) for i in range(1000)]
+
+        with engine.connect() as connection:
+            # Some builds raise SQLite's limit, so set it to the default of
+            # older versions, which the batch is wider than
+            dbapi_connection = connection.connection.connection
+            if hasattr(dbapi_connection, 'setlimit'):
+                dbapi_connection.setlimit(
+                    sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER, 999)
+
+            ValuesWriter().write(connection, table, rows)
+            self.assertEqual(connection.execute(
+                "SELECT count(*), sum(col_39) FROM wide").first(),
+                (1000, sum(row[39] for row in rows)))
+
+
+class ParallelParseTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'data.txt')
+        with open(self.path, 'w') as f:
+            f.write(make_data(1000).getvalue())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_split_byte_ranges(self):
+        with open(self.path, 'rb') as f:
+            ranges = split_byte_ranges(f, 1000)
+            f.seek(0)
+            data = f.read()
+
+        self.assertTrue(len(ranges) > 1)
+        self.assertEqual(b"".join(data[start:end] for start, end in ranges),
+            data)
+        for start, end in ranges:
+            self.assertEqual(data[end - 1:end], b"\n")
+
+    def test_iter_parallel_batches(self):
+        loader = DelimitedLoader()
+        loader.set_schema(SampleSchema())
+        with open(self.path, 'r') as f:
+            expected = list(loader.iter_batches(f))[0]
+
+        batches = list(iter_parallel_batches(loader, self.path, 2,
+            chunk_size=1000))
+
+        self.assertTrue(len(batches) > 1)
+        for i in range(len(expected)):
+            self.assertEqual([r for b in batches for r in b[i]], expected[i])
+
+
+class TableWriterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.schema = SampleSchema()
+        # Connections are checked out in the loader's thread and used in
+        # the table writer's threads
+        self.engine = create_engine('sqlite:///' +
+            os.path.join(self.tmpdir, 'test.db'),
+            connect_args={'check_same_thread': False})
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def load(self, f, **kwargs):
+        loader = DelimitedLoader(**kwargs)
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            loader.load(f, MetaData(), connection, flush=True)
+
+    def count(self, table_name):
+        return self.engine.execute(
+            "SELECT count(*) FROM {}".format(table_name)).scalar()
+
+    def test_concurrent(self):
+        self.load(make_data(25), batch_size=10, table_workers=2)
+        self.assertEqual(self.count('test_schools'), 25)
+        self.assertEqual(self.count('test_scores'), 25)
+
+    def test_atomic(self):
+        self.load(make_data(5))
+
+        data = make_data(25).getvalue().replace(u";1,020;", u";bogus;")
+        self.assertRaises(ValueError, self.load, io.StringIO(data),
+            batch_size=10, atomic=True)
+        self.assertEqual(self.count('test_schools'), 5)
+        self.assertEqual(self.count('test_scores'), 5)
+
+    def test_get_groups(self):
+        tables = [(tabledef, None) for tabledef in self.schema.tables] * 2
+        groups = ConcurrentTableWriter.get_groups(tables, 2)
+        self.assertEqual([sorted(i for i, tabledef, table in group)
+            for group in groups], [[0, 1], [2, 3]])
+
+
+class LoadMetricsTestCase(unittest.TestCase):
+    def test_metrics(self):
+        schema = SampleSchema()
+        engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(engine)
+
+        events = []
+        metrics = LoadMetrics(callbacks=[events.append])
+        loader = DelimitedLoader(batch_size=10, metrics=metrics)
+        loader.set_schema(schema)
+        data = make_data(25)
+        with engine.connect() as connection:
+            loader.load(data, MetaData(), connection, flush=True)
+
+        self.assertEqual(metrics.get('read').rows, 25)
+        self.assertEqual(metrics.get('read').bytes, len(data.getvalue()))
+        self.assertEqual(metrics.get('convert').calls, 3)
+        self.assertEqual(metrics.get('insert', 'test_scores').rows, 25)
+        self.assertEqual(metrics.get('delete', 'test_scores').calls, 1)
+        self.assertTrue(metrics.get('compile', 'test_schools').calls > 0)
+
+        self.assertEqual(len(events),
+            sum(m.calls for m in metrics.phases))
+
+        record = json.loads(metrics.to_json())
+        self.assertEqual(set(p['phase'] for p in record['phases']),
+            set(['read', 'convert', 'delete', 'compile', 'insert']))
+
+
+class BatchPipelineTestCase(unittest.TestCase):
+    def test_pipeline(self):
+        batches = [[[i]] for i in range(10)]
+        self.assertEqual(list(BatchPipeline(iter(batches), 2)), batches)
+
+    def test_reader_error(self):
+        def batches():
+            yield [[1]]
+            raise ValueError("bad value")
+
+        pipeline = BatchPipeline(batches(), 2)
+        self.assertRaises(ValueError, list, pipeline)
+
+    def test_close(self):
+        produced = []
+
+        def batches():
+            for i in range(100):
+                produced.append(i)
+                yield [[i]]
+
+        pipeline = BatchPipeline(batches(), 2)
+        for batch in pipeline:
+            break
+        pipeline.close()
+
+        self.assertFalse(pipeline._thread.is_alive())
+        self.assertTrue(len(produced) < 100)
+
+    def test_load(self):
+        schema = SampleSchema()
+        engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(engine)
+
+        loader = DelimitedLoader(batch_size=10, queue_size=1)
+        loader.set_schema(schema)
+        with engine.connect() as connection:
+            loader.load(make_data(25), MetaData(), connection)
+
+        self.assertEqual(engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 25)
+
+
+class IncrementalLoadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = SampleSchema()
+        self.engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(self.engine)
+
+    def load(self, f, **kwargs):
+        loader = DelimitedLoader(batch_size=4, incremental=True, **kwargs)
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            loader.load(f, MetaData(), connection)
+
+        return loader.incremental_counts
+
+    def test_incremental(self):
+        counts = self.load(make_data(10))
+        self.assertEqual(counts['test_scores'], {'inserted': 10,
+            'updated': 0, 'unchanged': 0, 'deleted': 0})
+
+        lines = make_data(12).getvalue().splitlines(True)
+        lines[3] = lines[3].replace('School 3', 'School Three')
+        counts = self.load(io.StringIO(u"".join(lines)))
+        self.assertEqual(counts['test_schools'], {'inserted': 2,
+            'updated': 1, 'unchanged': 9, 'deleted': 0})
+        self.assertEqual(counts['test_scores'], {'inserted': 2,
+            'updated': 0, 'unchanged': 10, 'deleted': 0})
+        self.assertEqual(self.engine.execute("SELECT school_name "
+            "FROM test_schools WHERE school_id = '000000000000003'").scalar(),
+            'School Three')
+
+        counts = self.load(make_data(8), delete_missing=True)
+        self.assertEqual(counts['test_schools'], {'inserted': 0,
+            'updated': 1, 'unchanged': 7, 'deleted': 4})
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_schools").scalar(), 8)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM load_row_hashes").scalar(), 16)
+
+    def test_replaced_rows(self):
+        # Flushed and staged loads forget the hashes, so the rows they
+        # deleted aren't counted as unchanged by the next incremental load
+        for options in ({}, {'staging': True}):
+            self.load(make_data(20))
+
+            loader = DelimitedLoader(**options)
+            loader.set_schema(self.schema)
+            with self.engine.connect() as connection:
+                loader.load(make_data(5), MetaData(), connection, flush=True)
+
+            counts = self.load(make_data(20))
+            self.assertEqual(counts['test_scores']['inserted'], 20)
+            self.assertEqual(counts['test_scores']['unchanged'], 0)
+            self.assertEqual(self.engine.execute(
+                "SELECT count(*) FROM test_scores").scalar(), 20)
+
+    def test_failed_flush(self):
+        # An atomic flush that fails keeps the hashes along with the rows
+        self.load(make_data(10))
+
+        data = make_data(10).getvalue().replace(u";1,006;", u";bogus;")
+        loader = DelimitedLoader(batch_size=4, atomic=True)
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            self.assertRaises(ValueError, loader.load, io.StringIO(data),
+                MetaData(), connection, flush=True)
+
+        counts = self.load(make_data(10))
+        self.assertEqual(counts['test_scores']['unchanged'], 10)
+
+    def test_existing_rows(self):
+        # Rows loaded before there were hashes are replaced, not duplicated
+        loader = DelimitedLoader()
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            loader.load(make_data(5), MetaData(), connection)
+
+        counts = self.load(make_data(5))
+        self.assertEqual(counts['test_scores']['inserted'], 5)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 5)
+
+
+class CheckpointTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'data.txt')
+        self.schema = SampleSchema()
+        self.engine = create_engine('sqlite:///' + os.path.join(self.tmpdir,
+            'test.db'))
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(self.engine)
+
+    def tearDown(self):
+        self.engine.dispose()
+        shutil.rmtree(self.tmpdir)
+
+    def write_data(self, bad_row=None):
+        lines = make_data(25).getvalue().splitlines(True)
+        if bad_row is not None:
+            # Same length, so the file size doesn't change when it's fixed
+            lines[bad_row] = lines[bad_row].replace(';1,', ';X,')
+
+        with open(self.path, 'w') as f:
+            f.write(u"".join(lines))
+
+    def load(self, **kwargs):
+        loader = DelimitedLoader(checkpoint=True, **kwargs)
+        loader.set_schema(self.schema)
+        with open(self.path, 'r') as f:
+            with self.engine.connect() as connection:
+                loader.load(f, MetaData(), connection, flush=True)
+
+    def state(self):
+        return self.engine.execute("SELECT table_name, byte_offset, rows, "
+            "completed FROM load_state ORDER BY table_name").fetchall()
+
+    def test_resume(self):
+        self.write_data(bad_row=17)
+        self.assertRaises(ValueError, self.load, batch_size=5)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 15)
+
+        size = os.path.getsize(self.path)
+        offset = len(u"".join(make_data(25).getvalue().splitlines(True)[:15]))
+        self.assertEqual([tuple(row) for row in self.state()],
+            [('test_schools', offset, 15, 0), ('test_scores', offset, 15, 0)])
+
+        # Resuming doesn't insert the first 15 rows again, which would
+        # violate the primary key
+        self.write_data()
+        self.load(batch_size=5, resume=True)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 25)
+        self.assertEqual([tuple(row) for row in self.state()],
+            [('test_schools', size, 25, 1), ('test_scores', size, 25, 1)])
+
+        # Resuming a completed load does nothing
+        self.load(batch_size=5, resume=True)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 25)
+
+    def test_resume_parallel(self):
+        self.write_data()
+        self.load(workers=2)
+        self.assertEqual(self.state()[0][1], os.path.getsize(self.path))
+
+        self.load(workers=2, resume=True)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_schools").scalar(), 25)
+
+    def test_incremental(self):
+        self.write_data()
+        self.assertRaises(ValueError, self.load, batch_size=10,
+            incremental=True)
+        self.assertRaises(ValueError, DelimitedLoader, resume=True,
+            incremental=True)
+        self.assertEqual(self.engine.execute(
+            "SELECT count(*) FROM test_scores").scalar(), 0)
+
+
+class StagedLoadTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = SampleSchema()
+        self.engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(self.engine)
+
+    def load(self, f, **kwargs):
+        loader = DelimitedLoader(staging=True, **kwargs)
+        loader.set_schema(self.schema)
+        with self.engine.connect() as connection:
+            loader.load(f, MetaData(), connection)
+
+    def count(self, table_name):
+        return self.engine.execute(
+            "SELECT count(*) FROM {}".format(table_name)).scalar()
+
+    def table_names(self):
+        return sorted(name for name in self.engine.table_names()
+            if name.startswith('test_'))
+
+    def test_staging(self):
+        self.load(make_data(10))
+        self.load(make_data(7), batch_size=3)
+        self.assertEqual(self.count('test_schools'), 7)
+        self.assertEqual(self.count('test_scores'), 7)
+        self.assertEqual(self.table_names(), ['test_schools', 'test_scores'])
+
+    def test_indexes(self):
+        self.load(make_data(10))
+        self.load(make_data(7))
+        self.assertEqual(sorted(self.engine.execute("SELECT name "
+            "FROM sqlite_master WHERE type = 'index' "
+            "AND name LIKE '%_idx'").fetchall()),
+            [('test_schools_school_name_idx',),
+             ('test_scores_proficient_idx',)])
+
+    def test_failed_load(self):
+        self.load(make_data(10))
+
+        lines = make_data(7).getvalue().splitlines(True)
+        lines[5] = lines[5].replace(';1,', ';X,')
+        self.assertRaises(ValueError, self.load, io.StringIO(u"".join(lines)),
+            batch_size=3)
+
+        # The old data is untouched and the staging tables are dropped
+        self.assertEqual(self.count('test_scores'), 10)
+        self.assertEqual(self.table_names(), ['test_schools', 'test_scores'])
+
+    def test_options(self):
+        self.assertRaises(ValueError, DelimitedLoader, staging=True,
+            incremental=True)
+        self.assertRaises(ValueError, DelimitedLoader, staging=True,
+            resume=True)
+
+
+class IndexesTestCase(unittest.TestCase):
+    def test_create_and_drop(self):
+        schema = SampleSchema()
+        engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(engine)
+
+        def index_names():
+            return sorted(row[0] for row in engine.execute("SELECT name "
+                "FROM sqlite_master WHERE type = 'index' "
+                "AND name LIKE '%_idx'"))
+
+        with engine.connect() as connection:
+            create_indexes(connection, schema.get_indexes())
+            # Creating indexes that exist does nothing
+            create_indexes(connection, schema.get_indexes())
+            self.assertEqual(index_names(), ['test_schools_school_name_idx',
+                'test_scores_proficient_idx'])
+
+            drop_indexes(connection, schema.get_indexes())
+            self.assertEqual(index_names(), [])
+
+    def test_analyze(self):
+        engine = create_engine('sqlite://')
+        engine.execute("CREATE TABLE test_schools (school_id TEXT)")
+        statements = []
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def record(conn, cursor, statement, *args):
+            statements.append((statement, conn.in_transaction()))
+
+        with engine.connect() as connection:
+            analyze_tables(connection, ['test_schools'])
+
+        self.assertEqual(statements, [('ANALYZE test_schools', True)])
@@ -0,0 +1,283 @@
+from contextlib import contextmanager
+import unittest
+
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import text
+
+import ilreportcard.query
+from ilreportcard.query import (ResultIterator, execute_query,
+    refresh_summary_view, refresh_summary_views, summary_query,
+    summary_query_2015, summary_view_exists)
+from ilreportcard.query.batch import (group_requests, split_results,
+    summary_query_batch)
+
+
+class ResultModesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.engine.execute("CREATE TABLE schools (school_id TEXT, "
+            "pct_proficient FLOAT)")
+        self.engine.execute("INSERT INTO schools VALUES ('a', 10.5), "
+            "('b', 20.5), ('c', NULL)")
+        self.query = text("SELECT school_id, pct_proficient FROM schools "
+            "WHERE school_id != :excluded ORDER BY school_id")
+
+    def execute(self, result):
+        return execute_query(self.engine, self.query, {'excluded': 'c'},
+            result)
+
+    def test_dicts(self):
+        self.assertEqual(self.execute('dicts'), [
+            {'school_id': 'a', 'pct_proficient': 10.5},
+            {'school_id': 'b', 'pct_proficient': 20.5},
+        ])
+
+    def test_tuples(self):
+        self.assertEqual(self.execute('tuples'), (
+            ['school_id', 'pct_proficient'], [('a', 10.5), ('b', 20.5)]))
+
+    def test_columns(self):
+        self.assertEqual(self.execute('columns'), {
+            'school_id': ['a', 'b'],
+            'pct_proficient': [10.5, 20.5],
+        })
+
+        self.assertEqual(execute_query(self.engine,
+            text("SELECT school_id FROM schools WHERE 0"), {}, 'columns'),
+            {'school_id': []})
+
+    def test_iter(self):
+        rows = self.execute('iter')
+        self.assertIsInstance(rows, ResultIterator)
+        self.assertEqual(rows.columns, ['school_id', 'pct_proficient'])
+        self.assertEqual(list(rows), [('a', 10.5), ('b', 20.5)])
+
+    def test_unknown_mode(self):
+        self.assertRaises(ValueError, self.execute, 'bogus')
+
+
+class BatchQueryTestCase(unittest.TestCase):
+    def test_group_requests(self):
+        requests = {
+            'a': (2015, ('1', '2')),
+            'b': (2015, ('3', '2')),
+            'c': (2016, ('1',)),
+            'd': (2016, None),
+        }
+        self.assertEqual(dict(group_requests(requests)),
+            {2015: ['1', '2', '3'], 2016: None})
+
+    def test_split_results(self):
+        requests = {
+            'a': (2015, ('2', '1', '9')),
+            'b': (2016, None),
+        }
+        year_rows = {
+            2015: (['school_id', 'n'], [('1', 10), ('2', 20)]),
+            2016: (['school_id', 'n'], [('1', 11)]),
+        }
+        self.assertEqual(split_results(requests, year_rows), {
+            'a': [{'school_id': '2', 'n': 20}, {'school_id': '1', 'n': 10}],
+            'b': [{'school_id': '1', 'n': 11}],
+        })
+        self.assertEqual(split_results(requests, year_rows, 'tuples')['a'],
+            (['school_id', 'n'], [('2', 20), ('1', 10)]))
+
+    def create_tables(self, conn):
+        conn.execute("CREATE TABLE assessment_2015_schools (school_id TEXT, "
+            "school_name TEXT, district_name TEXT, grades_in_school TEXT)")
+        conn.execute("CREATE TABLE "
+            "assessment_2015_overall_achievement_parcc_dlm_performance ("
+            "school_id TEXT, "
+            "school_pct_proficiency_in_ela_parcc_2015_ela FLOAT, "
+            "district_pct_proficiency_in_ela_parcc_2015_ela FLOAT, "
+            "school_pct_proficiency_in_math_parcc_2015_math FLOAT, "
+            "district_pct_proficiency_in_math_parcc_2015_math FLOAT)")
+        conn.execute("CREATE TABLE parcc_participation_2015 (rcdts TEXT, "
+            "tested_enrollment_ela INTEGER, tested_ela INTEGER, "
+            "absent_ela INTEGER, refusal_ela INTEGER, "
+            "tested_enrollment_math INTEGER, tested_math INTEGER, "
+            "absent_math INTEGER, refusal_math INTEGER)")
+
+        district_id = '050162000260000'
+        conn.execute(text("INSERT INTO parcc_participation_2015 VALUES "
+            "(:rcdts, 1000, 900, 50, 50, 1000, 880, 60, 60)"),
+            rcdts=district_id)
+        school_ids = ['05016200026{:04d}'.format(i + 1) for i in range(3)]
+        for i, school_id in enumerate(school_ids):
+            conn.execute(text("INSERT INTO assessment_2015_schools VALUES "
+                "(:school_id, :name, 'District 1', '9 10 11 12')"),
+                school_id=school_id, name='School {}'.format(i))
+            conn.execute(text("INSERT INTO "
+                "assessment_2015_overall_achievement_parcc_dlm_performance "
+                "VALUES (:school_id, :i, 30, :i, 25)"),
+                school_id=school_id, i=10 * i)
+            conn.execute(text("INSERT INTO parcc_participation_2015 VALUES "
+                "(:school_id, 100, 90, :i, 0, 100, 80, :i, 1)"),
+                school_id=school_id, i=i)
+
+        return school_ids
+
+    def test_summary_query_batch(self):
+        # Other databases than PostgreSQL run summary_query for each year
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            school_ids = self.create_tables(conn)
+            requests = {
+                'first': (2015, school_ids[:1]),
+                'rest': (2015, [school_ids[2], school_ids[1], 'missing']),
+            }
+            results = summary_query_batch(conn, requests)
+
+            self.assertEqual(results['first'],
+                summary_query_2015(conn, school_ids[:1]))
+            self.assertEqual(results['rest'], [
+                summary_query_2015(conn, [school_id])[0]
+                for school_id in (school_ids[2], school_ids[1])
+            ])
+            self.assertEqual(results['rest'][0]['district_id'],
+                '050162000260000')
+            self.assertEqual(results['rest'][0]['pct_not_tested_ela'], 2.0)
+
+            results = summary_query_batch(conn, [(2015, None)], 'tuples')
+            self.assertEqual(results[(2015, None)],
+                summary_query_2015(conn, result='tuples'))
+
+    def test_prepare(self):
+        conn = RecordingConnection()
+        summary_query_batch(conn, [(2015, ['1']), (2015, ['2'])],
+            use_view=False)
+        summary_query_batch(conn, [(2015, ['3'])], use_view=False)
+
+        # Each statement is prepared once per connection, and committed
+        prepared = [(sql, in_transaction)
+            for sql, in_transaction in conn.statements
+            if sql.startswith('PREPARE')]
+        self.assertEqual(len(prepared), 1)
+        self.assertTrue(prepared[0][1])
+        self.assertTrue(prepared[0][0].startswith(
+            'PREPARE ilreportcard_summary_2015 (text[]) AS SELECT'))
+
+
+class RecordingResult(object):
+    def __init__(self, value=None):
+        self.value = value
+
+    def scalar(self):
+        return self.value
+
+    def keys(self):
+        return ['school_id']
+
+    def __iter__(self):
+        return iter([])
+
+
+class RecordingConnection(object):
+    """
+    Stands in for a PostgreSQL connection, recording each statement and
+    whether it was executed in a transaction
+    """
+    dialect = postgresql.dialect()
+
+    def __init__(self, view_exists=True):
+        self.view_exists = view_exists
+        self.statements = []
+        self.in_transaction = False
+        self.info = {}
+
+    @contextmanager
+    def begin(self):
+        self.in_transaction = True
+        try:
+            yield
+        finally:
+            self.in_transaction = False
+
+    def execute(self, statement, **params):
+        sql = " ".join(str(statement).split())
+        self.statements.append((sql, self.in_transaction))
+        if sql.startswith('SELECT to_regclass'):
+            return RecordingResult(params['name'] if self.view_exists
+                else None)
+
+        return RecordingResult()
+
+
+class SummaryViewTestCase(unittest.TestCase):
+    def setUp(self):
+        # The recording connection can't create the load_generation table
+        self.bumped = []
+        self.bump_load_generation = ilreportcard.query.bump_load_generation
+        ilreportcard.query.bump_load_generation = self.bumped.append
+
+    def tearDown(self):
+        ilreportcard.query.bump_load_generation = self.bump_load_generation
+
+    def test_refresh(self):
+        conn = RecordingConnection()
+        refresh_summary_view(conn, 2015)
+        self.assertEqual(conn.statements[1:], [
+            ('REFRESH MATERIALIZED VIEW CONCURRENTLY summary_2015', True),
+            ('ANALYZE summary_2015', True),
+        ])
+        self.assertEqual(self.bumped, [conn])
+
+    def test_create(self):
+        conn = RecordingConnection(view_exists=False)
+        refresh_summary_view(conn, 2015, concurrently=False)
+        statements = [sql for sql, in_transaction in conn.statements[1:]
+            if in_transaction]
+        self.assertEqual(len(statements), len(conn.statements) - 1)
+        self.assertTrue(statements[1].startswith(
+            'CREATE MATERIALIZED VIEW summary_2015 AS SELECT s.school_id'))
+        self.assertEqual(statements[-1], 'ANALYZE summary_2015')
+        self.assertEqual(self.bumped, [conn])
+
+    def test_refresh_for_tables(self):
+        conn = RecordingConnection()
+        self.assertEqual(refresh_summary_views(conn,
+            ['report_card_2015']), [])
+        self.assertEqual(conn.statements, [])
+
+        self.assertEqual(refresh_summary_views(conn,
+            ['parcc_participation_2015', 'report_card_2015']), [2015])
+        self.assertEqual(conn.statements[-2:], [
+            ('REFRESH MATERIALIZED VIEW CONCURRENTLY summary_2015', True),
+            ('ANALYZE summary_2015', True),
+        ])
+
+        # Views that don't exist aren't created
+        conn = RecordingConnection(view_exists=False)
+        self.assertEqual(refresh_summary_views(conn,
+            ['parcc_participation_2015']), [])
+        self.assertEqual(len(conn.statements), 1)
+
+    def test_use_view(self):
+        # The view is read when it exists
+        conn = RecordingConnection()
+        summary_query(conn, 2015, ['1'])
+        self.assertEqual(conn.statements[1:], [('SELECT * FROM summary_2015 '
+            'WHERE school_id = ANY(:rcdts_ids)', False)])
+
+        conn = RecordingConnection(view_exists=False)
+        summary_query(conn, 2015, ['1'])
+        self.assertEqual(len(conn.statements), 2)
+        self.assertIn('FROM assessment_2015_schools', conn.statements[1][0])
+
+        conn = RecordingConnection()
+        summary_query(conn, 2015, ['1'], use_view=False)
+        self.assertEqual(len(conn.statements), 1)
+        self.assertIn('FROM assessment_2015_schools', conn.statements[0][0])
+
+        conn = RecordingConnection(view_exists=False)
+        summary_query(conn, 2015, ['1'], use_view=True)
+        self.assertEqual(conn.statements, [('SELECT * FROM summary_2015 '
+            'WHERE school_id = ANY(:rcdts_ids)', False)])
+
+    def test_sqlite(self):
+        # There are no views to read on other databases
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            self.assertFalse(summary_view_exists(conn, 2015))
@@ -0,0 +1,119 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import create_engine, event
+
+from ilreportcard.generation import bump_load_generation, get_load_generation
+from ilreportcard.query.cache import (DirectoryBackend, MemoryBackend,
+    MISSING, QueryCache, get_cache_key)
+
+
+class QueryCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        self.connection = self.engine.connect()
+        self.calls = []
+
+    def tearDown(self):
+        self.connection.close()
+
+    def fake_query(self, conn, year, rcdts_ids=None):
+        self.calls.append((year, rcdts_ids))
+        return [{'year': year, 'count': len(self.calls)}]
+
+    def test_generation(self):
+        self.assertEqual(get_load_generation(self.connection), 0)
+        self.assertEqual(bump_load_generation(self.connection), 1)
+        self.assertEqual(bump_load_generation(self.connection), 2)
+        self.assertEqual(get_load_generation(self.connection), 2)
+
+    def test_cache_key(self):
+        self.assertEqual(get_cache_key('q', '2015', {'ids': ['b', 'a']}),
+            get_cache_key('q', 2015, {'ids': ('a', 'b')}))
+        self.assertNotEqual(get_cache_key('q', 2015, {'ids': ['a']}),
+            get_cache_key('q', 2016, {'ids': ['a']}))
+
+    def test_hits_and_invalidation(self):
+        cache = QueryCache()
+        first = cache.call(self.fake_query, self.connection, 2015,
+            rcdts_ids=['b', 'a'])
+        second = cache.call(self.fake_query, self.connection, 2015,
+            rcdts_ids=['a', 'b'])
+        self.assertIs(first, second)
+        self.assertEqual(len(self.calls), 1)
+
+        bump_load_generation(self.connection)
+        cache.call(self.fake_query, self.connection, 2015,
+            rcdts_ids=['a', 'b'])
+        self.assertEqual(len(self.calls), 2)
+
+        stats = cache.stats
+        self.assertEqual((stats['hits'], stats['misses']), (1, 2))
+        self.assertEqual(stats['size'], 1)
+
+    def test_generation_queries(self):
+        bump_load_generation(self.connection)
+        cache = QueryCache()
+        cache.call(self.fake_query, self.connection, 2015)
+
+        statements = []
+
+        @event.listens_for(self.connection, 'before_cursor_execute')
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        # A hit only reads the generation
+        cache.call(self.fake_query, self.connection, 2015)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('load_generation', statements[0])
+
+    def test_memory_backend(self):
+        backend = MemoryBackend(max_size=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertIs(backend.get('b'), MISSING)
+        self.assertEqual(backend.get('a'), 1)
+
+        backend = MemoryBackend(ttl=0.01)
+        backend.set('a', 1)
+        time.sleep(0.02)
+        self.assertIs(backend.get('a'), MISSING)
+
+    def test_directory_backend(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            # Two caches sharing a directory, as in two app processes
+            first = QueryCache(backend=DirectoryBackend(tmpdir))
+            second = QueryCache(backend=DirectoryBackend(tmpdir))
+            result = first.call(self.fake_query, self.connection, 2015)
+            self.assertEqual(second.call(self.fake_query, self.connection,
+                2015), result)
+            self.assertEqual(len(self.calls), 1)
+            self.assertEqual(second.stats['hits'], 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_directory_backend_pruning(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            backend = DirectoryBackend(tmpdir, max_files=2)
+            for i, key in enumerate(['a', 'b', 'c']):
+                backend.set(key, i)
+                # Give each file a different modification time
+                os.utime(backend.get_path(key), (i, i))
+
+            self.assertEqual(len(backend), 2)
+            self.assertIs(backend.get('a'), MISSING)
+            self.assertEqual(backend.get('c'), 2)
+
+            backend = DirectoryBackend(tmpdir, ttl=60)
+            backend.set('d', 3)
+            self.assertEqual(len(backend), 1)
+            self.assertEqual(backend.get('d'), 3)
+        finally:
+            shutil.rmtree(tmpdir)
@@ -0,0 +1,95 @@
+import random
+import unittest
+
+from ilreportcard.query.ranking import (RankingSnapshot, ranking_request,
+    CHICAGO_AREA_COUNTIES)
+
+
+COUNTIES = CHICAGO_AREA_COUNTIES + ['Adams', 'Peoria']
+
+
+def make_rows(num_rows, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for i in range(num_rows):
+        enrollment_ela = rng.choice([None, 0, 50, 100, 200])
+        enrollment_math = rng.choice([None, 50, 100, 200])
+        rows.append((
+            '{:015d}'.format(i),
+            'School {}'.format(i),
+            'City',
+            rng.choice(COUNTIES),
+            '{:04d}'.format(i // 4),
+            enrollment_ela,
+            int((enrollment_ela or 0) * rng.choice([0.5, 0.85, 0.9, 1])),
+            enrollment_math,
+            int((enrollment_math or 0) * rng.choice([0.8, 0.9, 1])),
+            rng.choice([None, round(rng.random() * 100, 1)]),
+            round(rng.random() * 100, 1),
+        ))
+
+    return rows
+
+
+def brute_force(rows, subject, order, limit, counties):
+    offset = 0 if subject == 'ela' else 2
+    candidates = []
+    for i, row in enumerate(rows):
+        enrollment, tested = row[5 + offset], row[6 + offset]
+        passing = row[9] if subject == 'ela' else row[10]
+        if not enrollment or passing is None:
+            continue
+
+        if float(tested) / enrollment < .85:
+            continue
+
+        if counties is not None and row[3] not in counties:
+            continue
+
+        candidates.append((passing, i))
+
+    if order == 'desc':
+        candidates.sort(key=lambda c: (-c[0], c[1]))
+    else:
+        candidates.sort(key=lambda c: (c[0], c[1]))
+
+    return [rows[i][0] for passing, i in candidates[:limit]]
+
+
+class RankingSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rows = make_rows(500)
+        self.snapshot = RankingSnapshot(self.rows)
+
+    def test_rank(self):
+        results = self.snapshot.rank('ela', 'desc', limit=10)
+        self.assertEqual([r['school_id'] for r in results],
+            brute_force(self.rows, 'ela', 'desc', 10, CHICAGO_AREA_COUNTIES))
+
+        row = results[0]
+        self.assertEqual(sorted(row.keys()), ['city', 'county',
+            'district_name_school_name', 'district_number', 'passing',
+            'percent_tested_ela', 'school_id', 'tested_ela',
+            'tested_enrollment_ela'])
+        self.assertTrue(row['percent_tested_ela'] >= .85)
+        self.assertIsInstance(row['tested_enrollment_ela'], int)
+
+    def test_rank_many(self):
+        requests = []
+        for subject in ('ela', 'math'):
+            for order in ('asc', 'desc'):
+                requests.append(ranking_request(subject, order, 5, None))
+                for county in COUNTIES:
+                    requests.append(ranking_request(subject, order, 5,
+                        [county]))
+
+        results = self.snapshot.rank_many(requests)
+        self.assertEqual(len(results), len(requests))
+        for request in requests:
+            self.assertEqual([r['school_id'] for r in results[request]],
+                brute_force(self.rows, *request))
+
+    def test_bad_request(self):
+        self.assertRaises(ValueError, ranking_request, 'science')
+        self.assertRaises(ValueError, ranking_request, 'ela', 'sideways')
+        self.assertEqual(self.snapshot.rank('ela', limit=0), [])
@@ -0,0 +1,61 @@
+import os
+import subprocess
+import sys
+import unittest
+
+from ilreportcard.load import (DelimitedLoader, PARCCParticipationLoader2015,
+    get_parcc_participation_loader, get_report_card_loader)
+from ilreportcard.registry import (LOADERS, SCHEMAS, get_loader, get_schema,
+    import_object)
+from ilreportcard.schema import (AssessmentSchema2016,
+    PARCCParticipationSchema2015, ReportCardSchema2015,
+    get_assessment_schema, get_parcc_participation_schema,
+    get_report_card_schema)
+
+
+class RegistryTestCase(unittest.TestCase):
+    def test_schemas(self):
+        for kind, year in SCHEMAS:
+            self.assertIsInstance(get_schema(kind, str(year)),
+                import_object(SCHEMAS[(kind, year)]))
+
+        for path in LOADERS.values():
+            import_object(path)
+
+    def test_getters(self):
+        # The older per-kind functions use the registry
+        self.assertIsInstance(get_report_card_schema(2015),
+            ReportCardSchema2015)
+        self.assertIsInstance(get_assessment_schema(2016),
+            AssessmentSchema2016)
+        self.assertIsInstance(get_parcc_participation_schema(2015),
+            PARCCParticipationSchema2015)
+        self.assertIsInstance(get_report_card_loader(2016), DelimitedLoader)
+        self.assertIsInstance(get_parcc_participation_loader(2015),
+            PARCCParticipationLoader2015)
+        self.assertRaises(ValueError, get_parcc_participation_schema, 2016)
+        self.assertRaises(ValueError, get_parcc_participation_loader, 2016)
+
+    def test_loaders(self):
+        loader = get_loader('parcc_participation', '2015', atomic=True)
+        self.assertIsInstance(loader, PARCCParticipationLoader2015)
+        self.assertTrue(loader.atomic)
+        self.assertIsInstance(get_loader('report_card', 2016),
+            DelimitedLoader)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, get_schema, 'report_card', 2014)
+        self.assertRaises(ValueError, get_schema, 'attendance', 2015)
+        self.assertRaises(ValueError, get_loader, 'parcc_participation', 2016)
+
+
+class TasksImportTestCase(unittest.TestCase):
+    def test_lazy_imports(self):
+        script = ("import sys; import ilreportcard.tasks; "
+            "print(','.join(m for m in ['sqlalchemy', 'xlrd', 'psycopg2', "
+            "'ilreportcard.schema', 'ilreportcard.load'] "
+            "if m in sys.modules))")
+        cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        output = subprocess.check_output([sys.executable, '-c', script],
+            cwd=cwd, universal_newlines=True)
+        self.assertEqual(output.strip(), '')
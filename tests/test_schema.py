@@ -0,0 +1,134 @@
+from copy import copy
+import pickle
+import unittest
+
+from ilreportcard.load import BaseLoader, PARCCParticipationLoader2015
+from ilreportcard.schema import (AssessmentSchema2015, Column, Index,
+    PARCCParticipationSchema2015, Table, COLUMN_TYPES, compile_converter,
+    get_parcc_participation_schema)
+
+
+VALUES = ['', '  ', '12', ' 1,234 ', '$1,234.50', '3.5', 'abc', ' abc ',
+    '1.5.2', 7.0, 2.5, 0, None, True]
+
+
+def legacy_convert(columndef, value):
+    try:
+        return ('ok', BaseLoader.get_column_value(columndef, value))
+    except Exception as e:
+        return (type(e), str(e))
+
+
+def compiled_convert(convert, value):
+    try:
+        return ('ok', convert(value))
+    except Exception as e:
+        return (type(e), str(e))
+
+
+class RowConverterTestCase(unittest.TestCase):
+    def test_compile_converter(self):
+        for column_type in COLUMN_TYPES:
+            columndef = Column(column_index=3, name='col',
+                column_type=column_type)
+            convert = compile_converter(columndef)
+
+            for value in VALUES:
+                expected = legacy_convert(columndef, value)
+                actual = compiled_convert(convert, value)
+                self.assertEqual(actual, expected,
+                    "{} {!r}".format(column_type, value))
+                if expected[0] == 'ok':
+                    self.assertIs(type(actual[1]), type(expected[1]))
+
+    def test_custom_converter(self):
+        columndef = Column(column_index=0, name='col',
+            column_type=COLUMN_TYPES.INTEGER,
+            converter=lambda c, v: (c.name, v))
+        self.assertEqual(compile_converter(columndef)(' x '), ('col', 'x'))
+
+    def test_row_converter(self):
+        table = Table('test')
+        table.add_column(Column(column_index=2, name='b',
+            column_type=COLUMN_TYPES.INTEGER))
+        self.assertEqual(table.get_row_converter()(['a', 'x', '1,000']),
+            (1000,))
+
+        table.add_column(Column(column_index=0, name='a',
+            column_type=COLUMN_TYPES.STRING))
+        self.assertEqual(table.get_row_converter()(['a ', 'x', '1,000']),
+            (1000, 'a'))
+
+    def test_parcc_participation_row_converter(self):
+        tabledef = get_parcc_participation_schema(2015).tables[0]
+        row = ['150162990250001', 'Adams', '172', 'Quincy SD 172', 'Quincy',
+            '<10', 8.0, 1.0, 1.0, 0.0, 0.0, 402.0, 390.0, 5.0, 7.0, 0.0, 0.0]
+        convert = PARCCParticipationLoader2015.get_row_converter(tabledef)
+        self.assertEqual(convert(row), ('150162990250001', 'Adams', '172',
+            'Quincy SD 172', 'Quincy', None, True, 8, 1, 1, 0, 0, 402, False,
+            390, 5, 7, 0, 0))
+
+
+class IndexTestCase(unittest.TestCase):
+    def test_get_indexes(self):
+        schema = PARCCParticipationSchema2015()
+        self.assertEqual([index.name for tabledef, index in schema.get_indexes()],
+            ['county', 'tested_ratio_ela', 'tested_ratio_math'])
+
+    def test_primary_key_not_indexed(self):
+        schema = AssessmentSchema2015()
+        schools = Table('assessment_2015_schools')
+        schools.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        grade_3 = Table('assessment_2015_parcc_grade_3')
+        grade_3.add_column(copy(schools.columns[0]))
+        grade_3.columns[0].primary_key = False
+        schema._tables = [schools, grade_3]
+
+        self.assertEqual([(t.name, index.name)
+            for t, index in schema.get_indexes()],
+            [('assessment_2015_parcc_grade_3', 'school_id')])
+
+    def test_expression_needs_table(self):
+        self.assertRaises(ValueError, Index, 'ratio', expression='a / b')
+
+
+
+class ColumnLookupTestCase(unittest.TestCase):
+    def setUp(self):
+        self.schema = AssessmentSchema2015()
+        schools = Table('assessment_2015_schools')
+        schools.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True,
+            description='SCHOOL ID'))
+        grade_3 = Table('assessment_2015_parcc_grade_3')
+        grade_3.add_column(copy(schools.columns[0]))
+        grade_3.add_column(Column(column_index=1, name='pct_proficient',
+            column_type=COLUMN_TYPES.FLOAT, description='% PROFICIENT',
+            heading='PARCC', subheading='GRADE 3'))
+        self.schema._tables = [schools, grade_3]
+        self.schema.reset_lookups()
+
+    def test_lookups(self):
+        schools, grade_3 = self.schema.tables
+        self.assertIs(self.schema.get_column('school_id'), schools.columns[0])
+        self.assertIs(self.schema.get_column('school_id',
+            table='assessment_2015_parcc_grade_3'), grade_3.columns[0])
+        self.assertIs(self.schema.get_column_by_index(1), grade_3.columns[1])
+        self.assertIs(self.schema.get_column_by_description('% PROFICIENT',
+            'PARCC', 'GRADE 3'), grade_3.columns[1])
+        self.assertRaises(KeyError, self.schema.get_column_by_description,
+            '% PROFICIENT')
+        self.assertRaises(KeyError, self.schema.get_column, 'bogus')
+
+    def test_slots(self):
+        column = self.schema.get_column('pct_proficient')
+        self.assertFalse(hasattr(column, '__dict__'))
+        self.assertFalse(hasattr(column.table, '__dict__'))
+
+    def test_pickle(self):
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            schema = pickle.loads(pickle.dumps(self.schema, protocol))
+            table = schema.tables[1]
+            self.assertIs(table.get_column('pct_proficient').table, table)
+            self.assertEqual(table.columns[1].heading, 'PARCC')
@@ -0,0 +1,60 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from ilreportcard.schema import BaseSchema, Column, Table, COLUMN_TYPES
+from ilreportcard.schema.cache import from_file_cached
+
+
+class LineSchema(BaseSchema):
+    """Schema with a column for each "name:type" line of the layout file"""
+    parsed = 0
+
+    def from_file(self, f):
+        LineSchema.parsed += 1
+
+        table = Table('lines')
+        for i, line in enumerate(f.read().decode('utf-8').splitlines()):
+            name, column_type = line.split(':')
+            column = Column(column_index=i, name=name,
+                column_type=COLUMN_TYPES[column_type], primary_key=(i == 0))
+            table.add_column(column)
+            self._columns.append(column)
+
+        self._tables.append(table)
+
+
+class SchemaCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        LineSchema.parsed = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def load(self, layout):
+        return from_file_cached(LineSchema(), io.BytesIO(layout),
+            self.cache_dir)
+
+    def test_cache(self):
+        layout = b"school_id:STRING\nenrollment:INTEGER\npct:FLOAT"
+        parsed = self.load(layout)
+        cached = self.load(layout)
+
+        self.assertEqual(LineSchema.parsed, 1)
+        self.assertEqual(len(os.listdir(self.cache_dir)), 1)
+        self.assertEqual(
+            [(c.column_index, c.name, c.column_type, c.primary_key,
+                c.table.name) for c in cached.columns],
+            [(c.column_index, c.name, c.column_type, c.primary_key,
+                c.table.name) for c in parsed.columns])
+        self.assertIs(cached.columns[1], cached.tables[0].columns[1])
+
+    def test_invalidation(self):
+        self.load(b"school_id:STRING")
+        schema = self.load(b"school_id:STRING\nenrollment:INTEGER")
+
+        self.assertEqual(LineSchema.parsed, 2)
+        self.assertEqual(len(schema.columns), 2)
@@ -1,9 +1,101 @@
+import re
 import unittest
 
-from ilreportcard.schema.column_names import number_word_to_numeral
+from ilreportcard.schema import (AssessmentSchema2015, ReportCardSchema2015,
+    ReportCardSchema2016)
+from ilreportcard.schema import column_names
+from ilreportcard.schema.column_names import (number_word_to_numeral,
+    FilterPipeline, MultiReplaceFilter, apply_filters, replace_number_symbol,
+    fix_averge, remove_and, shorten_average)
+
+
+# Descriptions and subgroup specifiers in the style of the record layouts
+SAMPLE_STRINGS = [
+    '% TWO OR MORE RACES TEACHER - DISTRICT',
+    '% OF STUDENTS WHO MET OR EXCEEDED EXPECTATIONS IN ELA',
+    '# of LEP students who have attended schools in the U.S. (SCHOOL)',
+    'PERCENTAGE OF STUDENTS PARTICIALLY MEETING EXPECTATIONS FOR MATH',
+    'AVERGE CLASS SIZE - SUBREGION AND STATE',
+    'STUDENTS ENROLLED IN PHYSICAL EDUCATION COMPOSITE SCORE',
+    'NATIVE HAWAIIAN AND OTHERS',
+    'NOT YET MEETING CREDIT REQUIREMENTS FOR GRADE NINE',
+    'ONE TWO THREE FOUR FIVE SIX SEVEN EIGHT NINE ',
+    'AVERAGE ACT COMPOSITE SCORE OF STUDENTS',
+    '',
+]
+
+
+def legacy_filters():
+    """The column naming filters as they were before being precompiled"""
+    number_words = {
+      "ONE": '1', "TWO": '2', "THREE": '3', "FOUR": '4', "FIVE": '5',
+      "SIX": '6', "SEVEN": '7', "EIGHT": '8', "NINE": '9',
+    }
+
+    def number_word(s):
+        pattern = r'\s*({})\s+'.format("|".join(number_words.keys()))
+        return re.sub(pattern,
+            lambda m: " " + number_words[m.group(1)] + " ", s)
+
+    return {
+        'replace_percent_sign': lambda s: re.sub(r'^%( OF){0,1}', 'PCT', s, flags=re.I),
+        'replace_number_symbol': lambda s: s.replace('#', 'NUM'),
+        'abbreviate_percent': lambda s: re.sub(r'PERCENT(AGE){0,1}', 'PCT', s, flags=re.I),
+        'abbreviate_credit': lambda s: re.sub(r'CREDIT', 'CDT', s, flags=re.I),
+        'remove_and': lambda s: re.sub(r'\s+AND\s+', ' ', s, flags=re.I),
+        'remove_for': lambda s: re.sub(r'\s+FOR\s+', ' ', s, flags=re.I),
+        'remove_of': lambda s: re.sub(r'\s+OF\s+', ' ', s, flags=re.I),
+        'remove_yet': lambda s: re.sub(r'\s+YET\s+', ' ', s, flags=re.I),
+        'remove_composite': lambda s: re.sub(r'\s+COMPOSITE\s+', ' ', s, flags=re.I),
+        'remove_students': lambda s: re.sub(r'\s+STUDENTS\s*', ' ', s, flags=re.I),
+        'fix_particially': lambda s: s.replace('PARTICIALLY', 'PARTIALLY'),
+        'fix_averge': lambda s: s.replace('AVERGE', 'AVERAGE'),
+        'shorten_expectations': lambda s: s.replace('EXPECTATIONS', 'EXPECTNS'),
+        'shorten_subregion': lambda s: s.replace('SUBREGION', 'SUBRGN'),
+        'shorten_native_hawaiian': lambda s: s.replace('NATIVE HAWAIIAN AND OTHERS', 'HAWAIIAN'),
+        'shorten_average': lambda s: s.replace('AVERAGE', 'AVG'),
+        'shorten_physical_education': lambda s: s.replace('PHYSICAL EDUCATION', 'PHYS ED'),
+        'number_word_to_numeral': number_word,
+    }
+
+
+def get_filter_name(fn):
+    for name in dir(column_names):
+        if getattr(column_names, name) is fn:
+            return name
+
 
 class ColumnNamesTestCase(unittest.TestCase):
     def test_number_word_to_numeral(self):
         self.assertEqual(number_word_to_numeral('% TWO OR MORE RACES TEACHER - DISTRICT'),
             '% 2 OR MORE RACES TEACHER - DISTRICT')
-       
+
+    def test_fuse(self):
+        steps = FilterPipeline([replace_number_symbol, fix_averge,
+            remove_and]).steps
+        self.assertEqual(len(steps), 2)
+        self.assertIsInstance(steps[0], MultiReplaceFilter)
+        self.assertEqual(steps[0]('# AVERGE #'), 'NUM AVERAGE NUM')
+        self.assertIs(steps[1], remove_and)
+
+        # AVERAGE is only made by fix_averge, so it can't be shortened in
+        # the same pass
+        filters = [replace_number_symbol, fix_averge, shorten_average]
+        self.assertEqual(len(FilterPipeline(filters).steps), 2)
+        self.assertEqual(apply_filters('# AVERGE', filters), 'NUM AVG')
+
+    def test_matches_legacy_filters(self):
+        legacy = legacy_filters()
+
+        for schema_cls in (ReportCardSchema2015, ReportCardSchema2016,
+                AssessmentSchema2015):
+            for filters in (schema_cls.DESCRIPTION_FILTERS,
+                    schema_cls.SUBGROUP_SPECIFIER_FILTERS):
+                for s in SAMPLE_STRINGS:
+                    expected = s
+                    for fn in filters:
+                        expected = legacy[get_filter_name(fn)](expected)
+
+                    # Apply twice to check memoized results as well
+                    self.assertEqual(apply_filters(s, filters), expected)
+                    self.assertEqual(apply_filters(s, filters), expected)
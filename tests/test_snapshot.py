@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy import MetaData, create_engine
+
+from ilreportcard.columnstore import ColumnStore
+from ilreportcard.load import DelimitedLoader
+from ilreportcard.schema import BaseSchema, Column, Table, COLUMN_TYPES
+from ilreportcard.snapshot import Snapshot, get_source_info, write_snapshot
+
+
+def convert_flag(columndef, value):
+    return {'Y': True, 'N': False}.get(value)
+
+
+class SampleSchema(BaseSchema):
+    name = 'test'
+
+    def __init__(self):
+        super(SampleSchema, self).__init__()
+
+        schools = Table('test_schools')
+        schools.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        schools.add_column(Column(column_index=1, name='county',
+            column_type=COLUMN_TYPES.STRING))
+
+        scores = Table('test_scores')
+        scores.add_column(Column(column_index=0, name='school_id',
+            column_type=COLUMN_TYPES.STRING, primary_key=True))
+        scores.add_column(Column(column_index=2, name='enrollment',
+            column_type=COLUMN_TYPES.INTEGER))
+        scores.add_column(Column(column_index=3, name='pct_proficient',
+            column_type=COLUMN_TYPES.FLOAT))
+        scores.add_column(Column(column_index=4, name='charter',
+            column_type=COLUMN_TYPES.BOOLEAN, converter=convert_flag))
+
+        self._tables = [schools, scores]
+
+
+DATA = u"""000000000000001;Cook;100;50.5;Y
+000000000000002;Cook;200;;N
+000000000000003;Will é;1,000;25.0;
+"""
+
+
+class SnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.schema = SampleSchema()
+        self.path = os.path.join(self.directory, 'test.snapshot')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def get_loader(self, **kwargs):
+        loader = DelimitedLoader(**kwargs)
+        loader.set_schema(self.schema)
+        return loader
+
+    def test_round_trip(self):
+        store = ColumnStore(self.schema).load(self.get_loader(),
+            io.StringIO(DATA))
+        write_snapshot(self.path, store.tables.values())
+
+        with Snapshot(self.path) as snapshot:
+            self.assertIsNone(snapshot.source)
+            for name, table in store.tables.items():
+                self.assertEqual(list(snapshot[name].iter_rows()),
+                    list(table.iter_rows()))
+
+            scores = snapshot['test_scores']
+            self.assertEqual(list(scores['pct_proficient']),
+                [50.5, None, 25.0])
+            self.assertEqual(scores.filter(lambda e: e > 100,
+                'enrollment').to_dicts()[0]['school_id'], '000000000000002')
+
+            batches = list(snapshot.iter_batches(2))
+            self.assertEqual([len(batch[1]) for batch in batches], [2, 1])
+            self.assertEqual(batches[1][0],
+                [('000000000000003', u'Will é')])
+
+    def test_load_from_snapshot(self):
+        data_path = os.path.join(self.directory, 'data.txt')
+        with io.open(data_path, 'w', encoding='utf-8') as f:
+            f.write(DATA)
+
+        engine = create_engine('sqlite://')
+        metadata = MetaData()
+        for tabledef in self.schema.tables:
+            tabledef.as_sqlalchemy(metadata).create(engine)
+
+        def load():
+            loader = self.get_loader(snapshot=self.path)
+            with engine.connect() as connection:
+                with io.open(data_path, encoding='utf-8') as f:
+                    loader.load(f, MetaData(), connection, flush=True)
+                rows = connection.execute("SELECT * FROM test_scores "
+                    "ORDER BY school_id").fetchall()
+
+            return loader.metrics, [tuple(row) for row in rows]
+
+        metrics, rows = load()
+        self.assertIsNotNone(metrics.get('convert'))
+        self.assertIsNone(metrics.get('snapshot'))
+
+        with Snapshot(self.path) as snapshot:
+            with open(data_path) as f:
+                self.assertEqual(snapshot.source, get_source_info(f))
+
+        metrics, snapshot_rows = load()
+        self.assertIsNone(metrics.get('convert'))
+        self.assertEqual(metrics.get('snapshot').rows, 3)
+        self.assertEqual(snapshot_rows, rows)
+
+    def test_checkpoint_not_allowed(self):
+        self.assertRaises(ValueError, DelimitedLoader, snapshot=self.path,
+            checkpoint=True)
@@ -0,0 +1,150 @@
+import io
+import unittest
+from xml.sax.saxutils import escape
+import zipfile
+
+from sqlalchemy import MetaData, create_engine
+
+from ilreportcard.load import PARCCParticipationLoader2015
+from ilreportcard.schema import get_parcc_participation_schema
+from ilreportcard.xlsx import (XL_CELL_BOOLEAN, XL_CELL_EMPTY,
+    XL_CELL_NUMBER, XL_CELL_TEXT, open_workbook)
+
+MAIN_NAMESPACE = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+RELATIONSHIPS_NAMESPACE = ('http://schemas.openxmlformats.org/'
+    'officeDocument/2006/relationships')
+PACKAGE_RELATIONSHIPS_NAMESPACE = ('http://schemas.openxmlformats.org/'
+    'package/2006/relationships')
+
+
+def column_letter(index):
+    letters = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+
+    return letters
+
+
+def make_workbook(sheets):
+    """
+    Build an .xlsx workbook in memory
+
+    sheets is a list of (name, rows) tuples.  Strings are written as shared
+    strings, except ones starting with 'inline:', and None values are left
+    out of the sheet.
+
+    """
+    shared_strings = []
+    f = io.BytesIO()
+
+    with zipfile.ZipFile(f, 'w') as z:
+        sheet_elements = []
+        relationships = []
+        for i, (name, rows) in enumerate(sheets):
+            width = max(len(row) for row in rows)
+            row_elements = []
+            for r, row in enumerate(rows):
+                cells = []
+                for c, value in enumerate(row):
+                    ref = '{}{}'.format(column_letter(c), r + 1)
+                    if value is None:
+                        continue
+                    elif isinstance(value, bool):
+                        cells.append('<c r="{}" t="b"><v>{}</v></c>'.format(
+                            ref, int(value)))
+                    elif isinstance(value, (int, float)):
+                        cells.append('<c r="{}"><v>{}</v></c>'.format(
+                            ref, value))
+                    elif value.startswith('inline:'):
+                        cells.append('<c r="{}" t="inlineStr"><is><t>{}</t>'
+                            '</is></c>'.format(ref,
+                                escape(value[len('inline:'):])))
+                    else:
+                        shared_strings.append(value)
+                        cells.append('<c r="{}" t="s"><v>{}</v></c>'.format(
+                            ref, len(shared_strings) - 1))
+
+                row_elements.append('<row r="{}">{}</row>'.format(r + 1,
+                    ''.join(cells)))
+
+            z.writestr('xl/worksheets/sheet{}.xml'.format(i + 1),
+                '<worksheet xmlns="{}"><dimension ref="A1:{}{}"/>'
+                '<sheetData>{}</sheetData></worksheet>'.format(
+                    MAIN_NAMESPACE, column_letter(width - 1), len(rows),
+                    ''.join(row_elements)))
+            sheet_elements.append('<sheet name="{}" sheetId="{}" '
+                'r:id="rId{}"/>'.format(name, i + 1, i + 1))
+            relationships.append('<Relationship Id="rId{0}" '
+                'Type="{1}/worksheet" Target="worksheets/sheet{0}.xml"/>'.format(
+                    i + 1, RELATIONSHIPS_NAMESPACE))
+
+        relationships.append('<Relationship Id="rIdStrings" '
+            'Type="{}/sharedStrings" Target="sharedStrings.xml"/>'.format(
+                RELATIONSHIPS_NAMESPACE))
+        z.writestr('xl/workbook.xml', '<workbook xmlns="{}" xmlns:r="{}">'
+            '<sheets>{}</sheets></workbook>'.format(MAIN_NAMESPACE,
+                RELATIONSHIPS_NAMESPACE, ''.join(sheet_elements)))
+        z.writestr('xl/_rels/workbook.xml.rels',
+            '<Relationships xmlns="{}">{}</Relationships>'.format(
+                PACKAGE_RELATIONSHIPS_NAMESPACE, ''.join(relationships)))
+        z.writestr('xl/sharedStrings.xml', '<sst xmlns="{}">{}</sst>'.format(
+            MAIN_NAMESPACE, ''.join('<si><t>{}</t></si>'.format(escape(s))
+                for s in shared_strings)))
+
+    f.seek(0)
+    return f
+
+
+class WorkbookTestCase(unittest.TestCase):
+    def setUp(self):
+        self.workbook = open_workbook(make_workbook([
+            ('RC16', [['Layout'], [1, None, 'inline:A & B', True]]),
+            ('Assessment', [['Heading'], [], [2.5, 'x', '']]),
+        ]))
+
+    def test_sheets(self):
+        self.assertEqual(self.workbook.nsheets, 2)
+        self.assertEqual(self.workbook.sheet_names(), ['RC16', 'Assessment'])
+
+    def test_rows(self):
+        rows = list(self.workbook.sheet_by_index(0).get_rows())
+        self.assertEqual([[c.ctype for c in row] for row in rows], [
+            [XL_CELL_TEXT, XL_CELL_EMPTY, XL_CELL_EMPTY, XL_CELL_EMPTY],
+            [XL_CELL_NUMBER, XL_CELL_EMPTY, XL_CELL_TEXT, XL_CELL_BOOLEAN],
+        ])
+        self.assertEqual([c.value for c in rows[1]], [1.0, '', 'A & B', 1])
+
+    def test_empty_rows_skipped(self):
+        rows = list(self.workbook.sheet_by_name('Assessment').get_rows())
+        self.assertEqual([[c.value for c in row] for row in rows],
+            [['Heading', '', ''], [2.5, 'x', '']])
+        self.assertEqual(rows[1][2].ctype, XL_CELL_EMPTY)
+
+
+class PARCCParticipationLoadTestCase(unittest.TestCase):
+    def test_load(self):
+        f = make_workbook([('Sheet1', [
+            ['PARCC Participation'],
+            ['RCDTS', 'County'],
+            ['150162990250001', 'Adams', '172', 'Quincy SD 172', 'Quincy',
+                '<10', 8.0, 1.0, 1.0, 0.0, 0.0, 402.0, 390.0, 5.0, 7.0, 0.0,
+                0.0],
+        ])])
+        engine = create_engine('sqlite://')
+        schema = get_parcc_participation_schema(2015)
+        metadata = MetaData()
+        schema.tables[0].as_sqlalchemy(metadata).create(engine)
+
+        loader = PARCCParticipationLoader2015()
+        loader.set_schema(schema)
+        with engine.connect() as connection:
+            loader.load(f, MetaData(), connection)
+            rows = connection.execute(
+                "SELECT rcdts, county, tested_ela FROM parcc_participation_2015"
+            ).fetchall()
+
+        self.assertEqual([tuple(row) for row in rows],
+            [('150162990250001', 'Adams', 8)])
+        self.assertEqual(loader.metrics.get('convert').rows, 1)